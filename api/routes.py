@@ -1,40 +1,228 @@
-from flask import Blueprint, jsonify, request
-from flask_login import login_required
+from flask import Blueprint, request, Response, stream_with_context, g
+from flask_login import login_required, current_user
 import time
-import json
+from datetime import date
 from mqtt.client import (
     devices,
-    client,
+    outbound,
     request_device_settings,
     request_device_config,
+    request_display_info,
     update_device_settings,
     update_device_config,
     send_reboot_command,
-    get_device_state
+    send_qrcode_payment,
+    send_free_payment,
+    clear_payment,
+    send_action_command,
+    get_device_state,
+    pending_requests,
+    ingest_pipeline,
+    fleet_summary,
+    liveness,
+    journal_reader
 )
+from mqtt.events import event_bus
+from mqtt.outbound import OutboundQueueFull
+from mqtt.commands import CommandError
+from mqtt.journal import EXPORT_FORMATS
+from mqtt.batch import COMMANDS, batch_jobs, select_devices, selector_error
+from mqtt.persistence import query_rollups
+from mqtt.rollups import PERSISTED_RESOLUTIONS
+from metrics import http_requests, http_request_seconds
+from serializer import jsonify
+from auth import user_store
+from config import Config
 
 api = Blueprint("api", __name__)
 
+@api.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@api.after_request
+def record_request_metrics(response):
+    """Учет задержки и статуса запроса по маршруту API"""
+    endpoint = request.endpoint or "unknown"
+    http_request_seconds.labels(endpoint).observe(time.perf_counter() - g.request_started)
+    http_requests.labels(endpoint, str(response.status_code)).inc()
+    return response
+
+# Максимальный размер страницы истории приема денег
+DENOMINATION_PAGE_MAX = 1000
+
+# Максимальный размер страницы сводки по устройствам
+SUMMARY_PAGE_MAX = 500
+
+# Максимальное число переходов в сеть/из сети в одном ответе
+TRANSITIONS_PAGE_MAX = 1000
+
+# Максимальное число изменений состояния в одном ответе
+STATE_CHANGES_PAGE_MAX = 1000
+
+# Максимальное число корзин агрегатов в одном ответе (по нему выбирается разрешение)
+ROLLUP_POINTS_MAX = 1000
+
+def slot_response(device_id, slot):
+    """Ответ с разделом устройства; при совпадении ETag - 304 без сериализации"""
+    snapshot = devices.serialized(device_id, slot)
+    if snapshot is None:
+        return jsonify({"error": "Device not found"}), 404
+    etag, body = snapshot
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    # Браузер всегда перепроверяет ответ по ETag, а не берет его из кэша
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+def get_bool_arg(name):
+    """Булев параметр запроса: true/false или None, если не задан"""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    return value.lower() in ("1", "true", "yes")
+
+@api.errorhandler(OutboundQueueFull)
+def outbound_queue_full(error):
+    """Очередь команд устройства заполнена - клиенту следует повторить позже"""
+    return jsonify({"error": str(error)}), 429
+
+@api.errorhandler(CommandError)
+def invalid_command(error):
+    """Полезная нагрузка команды не соответствует протоколу"""
+    return jsonify({"error": str(error)}), 400
+
+def get_wait_timeout():
+    """Время ожидания ответа устройства из параметра ?wait= (в секундах)"""
+    try:
+        wait = float(request.args.get("wait", 0))
+    except ValueError:
+        return 0
+    return max(0, min(wait, Config.ACK_WAIT_MAX))
+
+def command_response(request_id, message, **extra):
+    """Ответ на отправку команды; при ?wait= дожидаемся ответа устройства"""
+    body = {"message": message, "request_id": request_id, **extra}
+    timeout = get_wait_timeout()
+    if timeout:
+        pending = pending_requests.get(request_id)
+        response = pending.wait(timeout) if pending else None
+        if response is None:
+            body["error"] = "Device response timeout"
+            return jsonify(body), 504
+        body["response"] = response
+    return jsonify(body)
+
 @api.route("/devices", methods=["GET"])
 @login_required
 def get_devices():
     """Получение списка найденных устройств"""
-    return jsonify({"devices": list(devices.keys())})
+    return jsonify({"devices": devices.ids()})
+
+@api.route("/ingest/stats", methods=["GET"])
+@login_required
+def get_ingest_stats():
+    """Состояние очереди обработки входящих MQTT-сообщений"""
+    return jsonify(ingest_pipeline.stats())
+
+@api.route("/devices/summary", methods=["GET"])
+@login_required
+def get_devices_summary():
+    """Сводка по устройствам с фильтрацией, сортировкой и постраничной выдачей.
+
+    Фильтры: online, blocked, has_errors (true/false), mode, q (часть device_id).
+    Сортировка: sort (поле), order (asc/desc). Страницы: page, per_page.
+    """
+    # Сводка меняется только вместе с версией (сообщения, переходы в сеть/из сети);
+    # дата нужна, потому что сумма за сегодня обнуляется в полночь
+    etag = f"{fleet_summary.version}-{date.today().isoformat()}"
+    if etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    page = max(1, request.args.get("page", 1, type=int))
+    per_page = max(1, min(request.args.get("per_page", 50, type=int), SUMMARY_PAGE_MAX))
+    rows, total = fleet_summary.query(
+        online=get_bool_arg("online"),
+        blocked=get_bool_arg("blocked"),
+        mode=request.args.get("mode"),
+        has_errors=get_bool_arg("has_errors"),
+        search=request.args.get("q"),
+        sort=request.args.get("sort", "device_id"),
+        descending=request.args.get("order") == "desc",
+        page=page,
+        per_page=per_page
+    )
+
+    response = jsonify({"devices": rows, "total": total, "page": page, "per_page": per_page})
+    response.set_etag(etag)
+    return response
+
+@api.route("/devices/liveness", methods=["GET"])
+@login_required
+def get_liveness_transitions():
+    """Переходы устройств в сеть и из сети после курсора since"""
+    since = max(0, request.args.get("since", 0, type=int))
+    limit = max(1, min(request.args.get("limit", 100, type=int), TRANSITIONS_PAGE_MAX))
+    transitions, cursor = liveness.transitions(since, limit)
+    return jsonify({
+        "transitions": transitions,
+        "next_cursor": cursor,
+        "offline_after": liveness.offline_after,
+        **liveness.counts()
+    })
+
+@api.route("/devices/<device_id>/liveness", methods=["GET"])
+@login_required
+def get_device_liveness(device_id):
+    """Время последнего сообщения и состояние устройства в сети"""
+    status = liveness.status(device_id)
+    if status is None:
+        return jsonify({"error": "Device not found"}), 404
+    return jsonify(status)
+
+def event_stream_response(device_id=None):
+    """Формирование ответа text/event-stream для подписчика"""
+    return Response(
+        stream_with_context(event_bus.stream(device_id)),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Отключаем буферизацию в nginx
+        }
+    )
+
+@api.route("/events", methods=["GET"])
+@login_required
+def stream_events():
+    """Поток событий всех устройств (Server-Sent Events)"""
+    return event_stream_response()
+
+@api.route("/devices/<device_id>/events", methods=["GET"])
+@login_required
+def stream_device_events(device_id):
+    """Поток событий конкретного устройства (Server-Sent Events)"""
+    if device_id not in devices:
+        return jsonify({"error": "Device not found"}), 404
+    return event_stream_response(device_id)
 
 @api.route("/devices/<device_id>/settings", methods=["GET"])
 @login_required
 def get_device_settings(device_id):
     """Получение текущих настроек устройства"""
-    if device_id in devices and "settings" in devices[device_id]:
-        settings = devices[device_id]["settings"]
-        
+    settings = devices.read(device_id, "settings")
+    if settings is not None:
         # Проверяем, есть ли метка времени и насколько недавно получены настройки
         current_time = time.time()
         received_at = settings.get("received_at", 0)
         
         # Если настройки получены в течение последних 60 секунд после запроса
         if received_at > 0 and (current_time - received_at) < 60:
-            return jsonify(settings)
+            return slot_response(device_id, "settings")
             
         # Настройки устарели или не были получены после запроса
         return jsonify({"error": "Settings are outdated or not received yet"}), 404
@@ -46,52 +234,45 @@ def get_device_settings(device_id):
 def request_settings(device_id):
     """Запрос настроек у устройства"""
     if device_id in devices:
-        # Сбрасываем временную метку, если настройки уже были получены ранее
-        if "settings" in devices[device_id]:
-            if "received_at" in devices[device_id]["settings"]:
-                devices[device_id]["settings"]["received_at"] = 0
-            
-        request_device_settings(device_id)
-        return jsonify({"message": f"Settings request sent to {device_id}"})
+        # Повторный запрос, пока устройство не ответило (или ответ свежий),
+        # в устройство не отправляется
+        request_id = request_device_settings(device_id)
+        return command_response(request_id, f"Settings request sent to {device_id}")
     return jsonify({"error": "Device not found"}), 404
 
 @api.route("/devices/<device_id>/settings/ack", methods=["GET"])
 @login_required
 def get_settings_ack(device_id):
     """Получение подтверждения отправки настроек"""
-    if device_id in devices and "setting_ack" in devices[device_id]:
-        return jsonify(devices[device_id]["setting_ack"])
+    if devices.read(device_id, "setting_ack") is not None:
+        return slot_response(device_id, "setting_ack")
     return jsonify({"error": "Settings ACK not available"}), 404
 
 @api.route("/devices/<device_id>/settings", methods=["PUT"])
 @login_required
 def update_settings(device_id):
     """Обновление настроек устройства"""
-    if device_id not in devices or "settings" not in devices[device_id]:
+    if device_id not in devices:
         return jsonify({"error": "Device not found or settings unavailable"}), 404
 
     new_settings = request.json
-    # Очистка ACK перед отправкой новых настроек
-    if "setting_ack" in devices[device_id]:
-        devices[device_id]["setting_ack"] = None
         
-    update_device_settings(device_id, new_settings)
-    return jsonify({"message": f"Settings updated and sent to {device_id}"})
+    request_id = update_device_settings(device_id, new_settings)
+    return command_response(request_id, f"Settings updated and sent to {device_id}")
 
 @api.route("/devices/<device_id>/config", methods=["GET"])
 @login_required
 def get_device_config(device_id):
     """Получение конфигурации устройства"""
-    if device_id in devices and "config" in devices[device_id]:
-        config = devices[device_id]["config"]
-        
+    config = devices.read(device_id, "config")
+    if config is not None:
         # Проверяем, есть ли метка времени и насколько недавно получена конфигурация
         current_time = time.time()
         received_at = config.get("received_at", 0)
         
         # Если конфигурация получена в течение последних 60 секунд после запроса
         if received_at > 0 and (current_time - received_at) < 60:
-            return jsonify(config)
+            return slot_response(device_id, "config")
             
         # Конфигурация устарела или не была получена после запроса
         return jsonify({"error": "Configuration is outdated or not received yet"}), 404
@@ -103,45 +284,39 @@ def get_device_config(device_id):
 def request_config(device_id):
     """Запрос конфигурации у устройства"""
     if device_id in devices:
-        # Сбрасываем временную метку, если конфигурация уже была получена ранее
-        if "config" in devices[device_id]:
-            if "received_at" in devices[device_id]["config"]:
-                devices[device_id]["config"]["received_at"] = 0
-            
-        request_device_config(device_id)
-        return jsonify({"message": f"Config request sent to {device_id}"})
+        # Повторный запрос, пока устройство не ответило (или ответ свежий),
+        # в устройство не отправляется
+        request_id = request_device_config(device_id)
+        return command_response(request_id, f"Config request sent to {device_id}")
     return jsonify({"error": "Device not found"}), 404
 
 @api.route("/devices/<device_id>/config/ack", methods=["GET"])
 @login_required
 def get_config_ack(device_id):
     """Получение подтверждения отправки конфигурации"""
-    if device_id in devices and "config_ack" in devices[device_id]:
-        return jsonify(devices[device_id]["config_ack"])
+    if devices.read(device_id, "config_ack") is not None:
+        return slot_response(device_id, "config_ack")
     return jsonify({"error": "Config ACK not available"}), 404
 
 @api.route("/devices/<device_id>/reboot/ack", methods=["GET"])
 @login_required
 def get_reboot_ack(device_id):
     """Получение подтверждения перезагрузки"""
-    if device_id in devices and "reboot_ack" in devices[device_id]:
-        return jsonify(devices[device_id]["reboot_ack"])
+    if devices.read(device_id, "reboot_ack") is not None:
+        return slot_response(device_id, "reboot_ack")
     return jsonify({"error": "Reboot ACK not available"}), 404
 
 @api.route("/devices/<device_id>/config", methods=["PUT"])
 @login_required
 def update_config(device_id):
     """Отправка новой конфигурации в устройство"""
-    if device_id not in devices or "config" not in devices[device_id]:
+    if device_id not in devices:
         return jsonify({"error": "Device not found or config unavailable"}), 404
 
     new_config = request.json
-    # Очистка ACK перед отправкой новой конфигурации
-    if "config_ack" in devices[device_id]:
-        devices[device_id]["config_ack"] = None
         
-    update_device_config(device_id, new_config)
-    return jsonify({"message": f"Config updated and sent to {device_id}"})
+    request_id = update_device_config(device_id, new_config)
+    return command_response(request_id, f"Config updated and sent to {device_id}")
 
 @api.route("/devices/<device_id>/reboot", methods=["POST"])
 @login_required
@@ -150,29 +325,154 @@ def reboot_device(device_id):
     if device_id not in devices:
         return jsonify({"error": "Device not found"}), 404
 
-    delay = request.json.get("delay", 400)  # Значение по умолчанию 400
-    # Очистка ACK перед отправкой команды перезагрузки
-    if "reboot_ack" in devices[device_id]:
-        devices[device_id]["reboot_ack"] = None
+    # Тело запроса необязательно: без него задержка по умолчанию 400
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"error": "Payload must be an object"}), 400
+    delay = data.get("delay", 400)
         
-    send_reboot_command(device_id, delay)
-    return jsonify({"message": f"Reboot command sent to {device_id} with delay {delay}"})
+    request_id = send_reboot_command(device_id, delay)
+    return command_response(request_id, f"Reboot command sent to {device_id} with delay {delay}")
 
 @api.route("/devices/<device_id>/state/info", methods=["GET"])
 @login_required
 def get_device_state_api(device_id):
     """Получение текущего состояния устройства"""
-    if device_id in devices and devices[device_id].get("state"):
-        return jsonify(devices[device_id]["state"])
+    if devices.read(device_id, "state"):
+        return slot_response(device_id, "state")
     return jsonify({"error": "State not available"}), 404
 
+@api.route("/devices/<device_id>/state/changes", methods=["GET"])
+@login_required
+def get_device_state_changes(device_id):
+    """Изменения состояния устройства после версии since.
+
+    Каждое изменение содержит только изменившиеся поля (changes), удаленные
+    поля (removed) и время формирования сообщения на устройстве (created). Если история с версии since не сохранилась (или since=0),
+    вместо изменений возвращается полное состояние (state). Клиент передает
+    полученный version в следующем запросе.
+    """
+    since = max(0, request.args.get("since", 0, type=int))
+    limit = max(1, min(request.args.get("limit", 100, type=int), STATE_CHANGES_PAGE_MAX))
+
+    result = devices.state_changes(device_id, since, limit)
+    if result is None:
+        return jsonify({"error": "Device not found"}), 404
+    version, entries, state = result
+
+    if entries is None or since > version:
+        return jsonify({"version": version, "state": state, "changes": [], "has_more": False})
+
+    changes = []
+    for entry_version, received_at, fields, removed, metadata in entries:
+        change = {"version": entry_version, "received_at": received_at, **metadata, "changes": fields}
+        if removed:
+            change["removed"] = removed
+        changes.append(change)
+    has_more = bool(changes) and changes[-1]["version"] < version
+    return jsonify({
+        "version": changes[-1]["version"] if changes else version,
+        "changes": changes,
+        "has_more": has_more
+    })
+
 @api.route("/devices/<device_id>/denomination", methods=["GET"])
 @login_required
 def get_device_denomination(device_id):
-    """Получение истории приема денег устройством"""
-    if device_id in devices and "denomination" in devices[device_id]:
-        return jsonify({"denomination": devices[device_id]["denomination"]})
-    return jsonify({"denomination": []})
+    """Получение истории приема денег устройством.
+
+    Параметры: since/until - границы по времени получения (unix time),
+    cursor - курсор следующей страницы, limit - размер страницы.
+    """
+    since = request.args.get("since", type=float)
+    until = request.args.get("until", type=float)
+    cursor = request.args.get("cursor", type=int)
+    limit = request.args.get("limit", 100, type=int)
+    limit = max(1, min(limit, DENOMINATION_PAGE_MAX))
+
+    record = devices.get(device_id)
+    if record is not None:
+        entries, next_cursor = record.denomination.query(
+            since=since, until=until, cursor=cursor, limit=limit
+        )
+        return jsonify({"denomination": entries, "next_cursor": next_cursor})
+    return jsonify({"denomination": [], "next_cursor": None})
+
+@api.route("/devices/<device_id>/rollups", methods=["GET"])
+@login_required
+def get_device_rollups(device_id):
+    """Агрегаты показателей устройства по минутам, часам или суткам.
+
+    Параметры: since/until - границы диапазона (unix time, по умолчанию
+    последние сутки), resolution - minute, hour или day. Без resolution
+    выбирается самое подробное разрешение, которое хранит весь диапазон
+    и дает не больше ROLLUP_POINTS_MAX корзин.
+    """
+    record = devices.get(device_id)
+    if record is None:
+        return jsonify({"error": "Device not found"}), 404
+
+    until = request.args.get("until", time.time(), type=float)
+    since = request.args.get("since", until - 86400, type=float)
+    if since >= until:
+        return jsonify({"error": "since must be less than until"}), 400
+
+    resolutions = record.rollups.resolutions()
+    resolution = request.args.get("resolution")
+    if resolution is None:
+        now = time.time()
+        candidates = [
+            (width, name) for name, (width, capacity) in resolutions.items()
+            if (until - since) / width <= ROLLUP_POINTS_MAX and since >= now - width * capacity
+        ]
+        resolution = min(candidates)[1] if candidates else max(
+            (width, name) for name, (width, _) in resolutions.items())[1]
+    elif resolution not in resolutions:
+        return jsonify({"error": f"Unknown resolution, expected one of: {', '.join(resolutions)}"}), 400
+
+    if Config.PROCESS_ROLE == "web" and Config.PERSIST_ENABLED and resolution in PERSISTED_RESOLUTIONS:
+        # Журнал общего хранилища покрывает только SHARED_LOG_RETENTION секунд,
+        # а часовые и суточные корзины процесс приема сохраняет в базу
+        buckets = query_rollups(device_id, resolution, resolutions[resolution][0], since, until)
+    else:
+        buckets = record.rollups.query(resolution, since, until)
+    return jsonify({
+        "device_id": device_id,
+        "resolution": resolution,
+        "width": resolutions[resolution][0],
+        "buckets": buckets[-ROLLUP_POINTS_MAX:]
+    })
+
+@api.route("/devices/<device_id>/journal", methods=["GET"])
+@login_required
+def export_device_journal(device_id):
+    """Выгрузка сырых сообщений устройства из журнала.
+
+    Параметры: since/until - границы диапазона (unix time, по умолчанию
+    последние сутки), format - ndjson или csv. Ответ формируется потоком,
+    поэтому диапазон не загружается в память целиком.
+    """
+    if journal_reader is None:
+        return jsonify({"error": "Message journal is disabled"}), 404
+
+    until = request.args.get("until", time.time(), type=float)
+    since = request.args.get("since", until - 86400, type=float)
+    if since >= until:
+        return jsonify({"error": "since must be less than until"}), 400
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"Unknown format, expected one of: {', '.join(EXPORT_FORMATS)}"}), 400
+
+    export, mimetype = EXPORT_FORMATS[export_format]
+    records = journal_reader.read(device_id, since, until)
+    return Response(
+        stream_with_context(export(records)),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": f'attachment; filename="{device_id}-{int(since)}-{int(until)}.{export_format}"',
+            "X-Accel-Buffering": "no"
+        }
+    )
 
 # Добавить эти маршруты в конец файла routes.py
 
@@ -180,98 +480,54 @@ def get_device_denomination(device_id):
 @login_required
 def get_display_info(device_id):
     """Получение информации с дисплея"""
-    if device_id in devices and "display" in devices[device_id]:
-        return jsonify(devices[device_id]["display"])
+    if devices.read(device_id, "display") is not None:
+        return slot_response(device_id, "display")
     return jsonify({"error": "Display info not available"}), 404
 
 @api.route("/devices/<device_id>/display/request", methods=["GET"])
 @login_required
-def request_display_info(device_id):
+def request_display(device_id):
     """Запрос информации с дисплея устройства"""
     if device_id in devices:
-        topic = f"wsm/{device_id}/client/display/get"
-        payload = json.dumps({"request_id": 234, "fields": ["line_1", "line_2"]})
-        client.publish(topic, payload)
-        return jsonify({"message": f"Display info request sent to {device_id}"})
+        request_id = request_display_info(device_id)
+        return command_response(request_id, f"Display info request sent to {device_id}")
     return jsonify({"error": "Device not found"}), 404
 
 @api.route("/devices/<device_id>/payment/qrcode", methods=["POST"])
 @login_required
-def send_qrcode_payment(device_id):
+def post_qrcode_payment(device_id):
     """Отправка оплаты QRcode"""
     if device_id not in devices:
         return jsonify({"error": "Device not found"}), 404
-        
-    # Очистка ACK перед отправкой
-    if "payment_ack" in devices[device_id]:
-        devices[device_id]["payment_ack"] = None
-        
-    data = request.json
+
+    data = request.json or {}
     order_id = data.get("order_id", f"order_{int(time.time())}")
     amount = data.get("amount", 0)
     
-    topic = f"wsm/{device_id}/client/payment/set"
-    payload = json.dumps({
-        "request_id": 234,
-        "addQRcode": {
-            "order_id": order_id,
-            "amount": amount
-        }
-    })
-    
-    client.publish(topic, payload)
-    return jsonify({"message": f"QR code payment sent to {device_id}", "order_id": order_id})
+    request_id = send_qrcode_payment(device_id, order_id, amount)
+    return command_response(request_id, f"QR code payment sent to {device_id}", order_id=order_id)
 
 @api.route("/devices/<device_id>/payment/free", methods=["POST"])
 @login_required
-def send_free_payment(device_id):
+def post_free_payment(device_id):
     """Отправка свободного начисления"""
     if device_id not in devices:
         return jsonify({"error": "Device not found"}), 404
-        
-    # Очистка ACK перед отправкой
-    if "payment_ack" in devices[device_id]:
-        devices[device_id]["payment_ack"] = None
-        
-    amount = request.json.get("amount", 0)
-    
-    topic = f"wsm/{device_id}/client/payment/set"
-    payload = json.dumps({
-        "request_id": 234,
-        "addFree": {
-            "amount": amount
-        }
-    })
+
+    amount = (request.json or {}).get("amount", 0)
     
-    client.publish(topic, payload)
-    return jsonify({"message": f"Free payment sent to {device_id}"})
+    request_id = send_free_payment(device_id, amount)
+    return command_response(request_id, f"Free payment sent to {device_id}")
 
 @api.route("/devices/<device_id>/payment/clear", methods=["POST"])
 @login_required
-def clear_payment(device_id):
+def post_payment_clear(device_id):
     """Обнуление оплаты"""
     if device_id not in devices:
         return jsonify({"error": "Device not found"}), 404
-        
-    # Очистка ACK перед отправкой
-    if "payment_ack" in devices[device_id]:
-        devices[device_id]["payment_ack"] = None
-    
-    clear_options = request.json or {}
-    
-    payload = {
-        "request_id": 234,
-        "CoinClear": clear_options.get("CoinClear", True),
-        "BillClear": clear_options.get("BillClear", True),
-        "PrevClear": clear_options.get("PrevClear", True),
-        "FreeClear": clear_options.get("FreeClear", True),
-        "QRcodeClear": clear_options.get("QRcodeClear", True),
-        "PayPassClear": clear_options.get("PayPassClear", True)
-    }
-    
-    topic = f"wsm/{device_id}/client/payment/set"
-    client.publish(topic, json.dumps(payload))
-    return jsonify({"message": f"Payment cleared for {device_id}"})
+
+    request_id = clear_payment(device_id, request.json or {})
+    return command_response(request_id, f"Payment cleared for {device_id}")
 
 @api.route("/devices/<device_id>/action", methods=["POST"])
 @login_required
@@ -279,39 +535,151 @@ def send_action(device_id):
     """Отправка команды управления (пролив/блокировка)"""
     if device_id not in devices:
         return jsonify({"error": "Device not found"}), 404
-        
-    # Очистка ACK перед отправкой
-    if "action_ack" in devices[device_id]:
-        devices[device_id]["action_ack"] = None
-    
-    data = request.json
-    pour = data.get("pour")
-    blocking = data.get("blocking")
-    
-    payload = {"request_id": 234}
-    
-    if pour in ["Start_1", "Start_2", "Stop"]:
-        payload["Pour"] = pour
-        
-    if blocking is not None:
-        payload["Blocking"] = blocking
-    
-    topic = f"wsm/{device_id}/client/action/set"
-    client.publish(topic, json.dumps(payload))
-    return jsonify({"message": f"Action command sent to {device_id}"})
+
+    data = request.json or {}
+    request_id = send_action_command(device_id, data.get("pour"), data.get("blocking"))
+    return command_response(request_id, f"Action command sent to {device_id}")
+
+@api.route("/outbound", methods=["GET"])
+@login_required
+def get_outbound_stats():
+    """Сводка по очередям команд устройствам"""
+    return jsonify(outbound.stats())
+
+@api.route("/devices/<device_id>/outbound", methods=["GET"])
+@login_required
+def get_device_outbound(device_id):
+    """Очередь команд устройства: ожидающие отправки, ожидающие ответа и неудачные"""
+    stats = outbound.stats(device_id)
+    if stats is None:
+        if device_id not in devices:
+            return jsonify({"error": "Device not found"}), 404
+        stats = {"device_id": device_id, "queued": [], "in_flight": [], "failed_recent": [],
+                 "sent": 0, "acked": 0, "failed": 0, "retries": 0, "rejected": 0}
+    return jsonify(stats)
 
 @api.route("/devices/<device_id>/payment/ack", methods=["GET"])
 @login_required
 def get_payment_ack(device_id):
     """Получение подтверждения платежа"""
-    if device_id in devices and "payment_ack" in devices[device_id]:
-        return jsonify(devices[device_id]["payment_ack"])
+    if devices.read(device_id, "payment_ack") is not None:
+        return slot_response(device_id, "payment_ack")
     return jsonify({"error": "Payment ACK not available"}), 404
 
 @api.route("/devices/<device_id>/action/ack", methods=["GET"])
 @login_required
 def get_action_ack(device_id):
     """Получение подтверждения действия"""
-    if device_id in devices and "action_ack" in devices[device_id]:
-        return jsonify(devices[device_id]["action_ack"])
-    return jsonify({"error": "Action ACK not available"}), 404
\ No newline at end of file
+    if devices.read(device_id, "action_ack") is not None:
+        return slot_response(device_id, "action_ack")
+    return jsonify({"error": "Action ACK not available"}), 404
+
+@api.route("/devices/<device_id>/requests/<int:request_id>", methods=["GET"])
+@login_required
+def get_request_status(device_id, request_id):
+    """Статус отправленной команды (поддерживает ожидание ответа через ?wait=)"""
+    pending = pending_requests.get(request_id)
+    if pending is None or pending.device_id != device_id:
+        return jsonify({"error": "Request not found"}), 404
+
+    timeout = get_wait_timeout()
+    if timeout:
+        pending.wait(timeout)
+    return jsonify(pending.to_dict())
+
+@api.route("/batch", methods=["POST"])
+@login_required
+def start_batch():
+    """Массовая отправка команды на группу устройств.
+
+    Тело запроса: selector (all/devices/pattern/where), command, payload,
+    необязательные concurrency, qos и ack_timeout. С ?wait= ждем завершения задания.
+    """
+    data = request.json or {}
+    selector = data.get("selector")
+    command = data.get("command")
+    payload = data.get("payload") or {}
+    qos = data.get("qos")
+
+    error = selector_error(selector)
+    if error is not None:
+        return jsonify({"error": error}), 400
+    if command not in COMMANDS:
+        return jsonify({"error": f"Unknown command, expected one of: {', '.join(COMMANDS)}"}), 400
+    if not isinstance(payload, dict):
+        return jsonify({"error": "Payload must be an object"}), 400
+    if qos is not None and qos not in (0, 1, 2):
+        return jsonify({"error": "QoS must be 0, 1 or 2"}), 400
+    concurrency = data.get("concurrency")
+    if concurrency is not None and (isinstance(concurrency, bool) or not isinstance(concurrency, int)
+                                    or concurrency < 1):
+        return jsonify({"error": "concurrency must be a positive integer"}), 400
+    ack_timeout = data.get("ack_timeout")
+    if ack_timeout is not None and (isinstance(ack_timeout, bool) or not isinstance(ack_timeout, (int, float))
+                                    or ack_timeout < 0):
+        return jsonify({"error": "ack_timeout must be a non-negative number of seconds"}), 400
+
+    # Некорректный payload отклоняется до выбора устройств (CommandError -> 400)
+    prepared = COMMANDS[command](payload)
+
+    device_ids = select_devices(selector)
+    if not device_ids:
+        return jsonify({"error": "No devices match the selector"}), 404
+
+    job = batch_jobs.start(
+        command,
+        prepared,
+        device_ids,
+        concurrency=concurrency,
+        qos=qos,
+        ack_timeout=ack_timeout
+    )
+
+    timeout = get_wait_timeout()
+    if timeout and job.wait(timeout):
+        return jsonify(job.to_dict())
+    return jsonify(job.to_dict()), 202
+
+@api.route("/batch", methods=["GET"])
+@login_required
+def list_batches():
+    """Список последних массовых заданий"""
+    return jsonify({"jobs": [job.to_dict(include_devices=False) for job in batch_jobs.list()]})
+
+@api.route("/batch/<job_id>", methods=["GET"])
+@login_required
+def get_batch(job_id):
+    """Статус массового задания с результатами по каждому устройству"""
+    job = batch_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    timeout = get_wait_timeout()
+    if timeout:
+        job.wait(timeout)
+    return jsonify(job.to_dict())
+
+@api.route("/tokens", methods=["GET"])
+@login_required
+def list_tokens():
+    """API-токены текущего пользователя"""
+    return jsonify({"tokens": user_store.tokens(current_user)})
+
+@api.route("/tokens", methods=["POST"])
+@login_required
+def create_token():
+    """Создание API-токена для скриптов (Authorization: Bearer <токен>).
+
+    Токен показывается только в этом ответе; в базе хранится его хэш.
+    """
+    data = request.json or {}
+    name = str(data.get("name") or "api").strip()[:64]
+    return jsonify(user_store.create_token(current_user, name)), 201
+
+@api.route("/tokens/<int:token_id>", methods=["DELETE"])
+@login_required
+def revoke_token(token_id):
+    """Отзыв API-токена текущего пользователя (сразу во всех процессах)"""
+    if not user_store.revoke_token(current_user, token_id):
+        return jsonify({"error": "Token not found"}), 404
+    return jsonify({"status": "ok"})
\ No newline at end of file
@@ -1,28 +1,23 @@
-from flask import Flask, render_template, redirect, url_for, request, flash
-from flask_sqlalchemy import SQLAlchemy
+import hmac
+from flask import Flask, Response, render_template, redirect, url_for, request, flash
 from flask_login import login_user, logout_user, login_required, current_user
 from config import Config
-from api.routes import api
-from mqtt.client import devices, client  # Запускаем MQTT при старте
-from auth import init_auth, User, users, check_auth
-
-# Инициализация Flask-приложения
-app = Flask(__name__, static_folder='static')
-app.config.from_object(Config)
-
-# Секретный ключ для сессий
-app.secret_key = Config.SECRET_KEY
+from logging_setup import setup_logging
 
-# Инициализация базы данных (пока не используется, но может пригодиться)
-# db = SQLAlchemy(app)
+# Логирование настраиваем до запуска MQTT-клиента
+setup_logging(Config.LOG_LEVEL, Config.LOG_JSON, Config.LOG_SAMPLE_INTERVAL)
 
-# Инициализация авторизации
-init_auth(app)
-
-# Регистрация API-маршрутов
-app.register_blueprint(api, url_prefix="/api")
+from models import db
+from api.routes import api
+from mqtt.client import (
+    devices, restore_devices, restore_denominations, restore_rollups, shared_follower, start_mqtt
+)
+from mqtt.persistence import (
+    load_denominations, load_snapshots, load_last_seen, load_rollups, telemetry_writer, rollup_writer
+)
+from metrics import registry
+from auth import init_auth, check_auth, authenticate
 
-@app.route("/login", methods=["GET", "POST"])
 def login():
     """Страница входа"""
     if current_user.is_authenticated:
@@ -33,8 +28,8 @@ def login():
         username = request.form.get("username")
         password = request.form.get("password")
         
-        user = users.get(username)
-        if user and user.check_password(password):
+        user = check_auth(username, password)
+        if user:
             login_user(user)
             next_page = request.args.get('next', url_for('index'))
             return redirect(next_page)
@@ -43,20 +38,17 @@ def login():
     
     return render_template("login.html", error=error)
 
-@app.route("/logout")
 @login_required
 def logout():
     """Выход из системы"""
     logout_user()
     return redirect(url_for('login'))
 
-@app.route("/")
 @login_required
 def index():
     """Главная страница: список устройств"""
     return render_template("index.html")
 
-@app.route("/device/<device_id>")
 @login_required
 def device_page(device_id):
     """Страница конкретного устройства с настройками"""
@@ -64,5 +56,78 @@ def device_page(device_id):
         return "Device not found", 404
     return render_template("device.html", device_id=device_id)
 
+def metrics():
+    """Метрики в текстовом формате Prometheus.
+
+    Если задан METRICS_TOKEN - доступ только по Authorization: Bearer <токен>,
+    иначе - как к API (сессия, API-токен или HTTP Basic Auth).
+    """
+    if Config.METRICS_TOKEN:
+        expected = f"Bearer {Config.METRICS_TOKEN}"
+        if not hmac.compare_digest(request.headers.get("Authorization", ""), expected):
+            return Response("Unauthorized", 401)
+    elif not current_user.is_authenticated:
+        return authenticate()
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+def create_app(start=True):
+    """Создание Flask-приложения.
+
+    start=False - без запуска MQTT и фоновых потоков (для тестов и утилит).
+    """
+    app = Flask(__name__, static_folder='static')
+    app.config.from_object(Config)
+
+    # Секретный ключ для сессий
+    app.secret_key = Config.SECRET_KEY
+
+    # Инициализация базы данных
+    db.init_app(app)
+
+    # Восстанавливаем последние известные данные устройств и запускаем запись телеметрии.
+    # Веб-воркер берет снимки из базы, а сообщения после них - из журнала общего
+    # хранилища; телеметрию и агрегаты пишет процесс приема
+    if start and Config.PERSIST_ENABLED:
+        with app.app_context():
+            db.create_all()
+            # Веб-воркер восстанавливает платежи, принятые до начала журнала
+            before = shared_follower.resume() if Config.PROCESS_ROLE == "web" else None
+            restore_devices(load_snapshots(), load_last_seen())
+            restore_denominations(load_denominations(devices.ids(), Config.DENOMINATION_CAPACITY, before))
+            if Config.PROCESS_ROLE != "web":
+                restore_rollups(load_rollups(devices))
+        if Config.PROCESS_ROLE != "web":
+            telemetry_writer.start(app)
+            rollup_writer.start(app, devices)
+
+    # Инициализация авторизации
+    init_auth(app)
+
+    # Регистрация API-маршрутов
+    app.register_blueprint(api, url_prefix="/api")
+
+    app.add_url_rule("/login", view_func=login, methods=["GET", "POST"])
+    app.add_url_rule("/logout", view_func=logout)
+    app.add_url_rule("/", view_func=index)
+    app.add_url_rule("/device/<device_id>", view_func=device_page)
+    app.add_url_rule("/metrics", view_func=metrics)
+
+    if start:
+        start_mqtt()
+    return app
+
+def __getattr__(name):
+    """Модульный app для `flask run` и `gunicorn app:app`.
+
+    Приложение создается (и MQTT запускается) при первом обращении к app,
+    а не при импорте модуля, поэтому create_app(start=False) в тестах
+    и утилитах по-прежнему ничего не запускает.
+    """
+    if name == "app":
+        app = globals()["app"] = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 if __name__ == "__main__":
+    app = create_app()
     app.run(host="0.0.0.0", port=Config.FLASK_PORT, debug=True)
\ No newline at end of file
@@ -0,0 +1,257 @@
+"""ASGI-приложение для большого числа долгих подключений.
+
+Потоки событий (Server-Sent Events) обслуживаются в цикле asyncio без
+отдельного потока на каждого клиента, MQTT-соединение обслуживается тем же
+циклом. Остальные маршруты выполняет то же Flask-приложение в пуле потоков,
+поэтому их поведение совпадает с обычным режимом.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import io
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# Режим нужно задать до импорта настроек
+os.environ.setdefault("MQTT_LOOP", "asyncio")
+
+import paho.mqtt.client as mqtt
+from flask_login import current_user
+from app import create_app
+from config import Config
+from mqtt.async_client import AsyncioMqttLoop
+from mqtt.client import client, devices
+from mqtt.events import event_bus, SUBSCRIBER_QUEUE_SIZE, HEARTBEAT_INTERVAL
+
+# Маршруты потоков событий, которые обслуживаются без Flask
+EVENTS_PATH = re.compile(r"^/api/events$")
+DEVICE_EVENTS_PATH = re.compile(r"^/api/devices/([^/]+)/events$")
+
+EVENT_STREAM_HEADERS = [
+    (b"content-type", b"text/event-stream; charset=utf-8"),
+    (b"cache-control", b"no-cache"),
+    (b"x-accel-buffering", b"no"),
+]
+
+
+def wsgi_environ(scope, body):
+    """WSGI-окружение для HTTP-запроса ASGI."""
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": scope["client"][0] if scope.get("client") else "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = "HTTP_" + name
+        environ[name] = environ[name] + "," + value if name in environ else value
+    return environ
+
+
+class AsyncEventStreams:
+    """Раздача событий EventBus подписчикам в цикле asyncio.
+
+    Для каждого устройства (и для всего парка) в EventBus регистрируется
+    один подписчик, который переносит событие в цикл событий; дальше оно
+    раскладывается по очередям asyncio всех клиентов без участия потоков.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        # device_id -> множество очередей asyncio; None - подписчики на все устройства
+        self._subscribers = {}
+        # device_id -> подписчик EventBus, переносящий события в цикл
+        self._forwarders = {}
+
+    def subscribe(self, device_id=None):
+        q = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        subscribers = self._subscribers.get(device_id)
+        if subscribers is None:
+            subscribers = self._subscribers[device_id] = set()
+            forwarder = self._forwarders[device_id] = _LoopForwarder(self, device_id)
+            event_bus.subscribe(device_id, forwarder)
+        subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q, device_id=None):
+        subscribers = self._subscribers.get(device_id)
+        if subscribers is None:
+            return
+        subscribers.discard(q)
+        if not subscribers:
+            # Последний клиент отключился: события устройства больше не нужны в цикле
+            del self._subscribers[device_id]
+            event_bus.unsubscribe(self._forwarders.pop(device_id), device_id)
+
+    def _dispatch(self, device_id, message):
+        for q in self._subscribers.get(device_id, ()):
+            try:
+                q.put_nowait(message)
+            except asyncio.QueueFull:
+                pass
+
+
+class _LoopForwarder:
+    """Подписчик EventBus, передающий события в цикл asyncio."""
+
+    def __init__(self, streams, device_id):
+        self.streams = streams
+        self.device_id = device_id
+
+    def put_nowait(self, message):
+        self.streams.loop.call_soon_threadsafe(self.streams._dispatch, self.device_id, message)
+
+
+class Application:
+    """ASGI-приложение: потоки событий в asyncio, остальное - Flask в пуле потоков."""
+
+    def __init__(self, flask_app, threads=32):
+        self.flask_app = flask_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="asgi-wsgi")
+        self.streams = None
+        self.mqtt_loop = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            if self.streams is None:
+                self.streams = AsyncEventStreams(asyncio.get_running_loop())
+            body = await self._read_body(receive)
+            match = DEVICE_EVENTS_PATH.match(scope["path"])
+            if scope["method"] == "GET" and (match or EVENTS_PATH.match(scope["path"])):
+                await self._events(scope, body, receive, send, match.group(1) if match else None)
+            else:
+                await self._wsgi(scope, body, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                # В режиме web MQTT-клиента нет - команды уходят через общее хранилище
+                if isinstance(client, mqtt.Client) and Config.MQTT_LOOP == "asyncio":
+                    self.mqtt_loop = AsyncioMqttLoop(client, asyncio.get_running_loop())
+                    self.mqtt_loop.start(Config.MQTT_BROKER, Config.MQTT_PORT, 60)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.mqtt_loop is not None:
+                    await self.mqtt_loop.stop()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    @staticmethod
+    async def _read_body(receive):
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                return b"".join(chunks)
+
+    def _authenticated(self, environ):
+        """Проверка сессии так же, как login_required во Flask.
+
+        Загрузка пользователя может читать базу и проверять пароль (Basic
+        Auth), поэтому вызывается в пуле потоков, а не в цикле событий.
+        """
+        with self.flask_app.request_context(environ):
+            return current_user.is_authenticated
+
+    async def _events(self, scope, body, receive, send, device_id):
+        """Поток событий; поведение совпадает с /api/events и /api/devices/<id>/events."""
+        environ = wsgi_environ(scope, body)
+        loop = asyncio.get_running_loop()
+        if not await loop.run_in_executor(self.executor, self._authenticated, environ):
+            # Ответ для неавторизованного клиента формирует Flask (редирект на вход)
+            await self._wsgi(scope, body, send)
+            return
+        if device_id is not None and device_id not in devices:
+            await self._send_json(send, 404, b'{"error":"Device not found"}')
+            return
+
+        q = self.streams.subscribe(device_id)
+        disconnected = asyncio.ensure_future(self._wait_disconnect(receive))
+        try:
+            await send({"type": "http.response.start", "status": 200, "headers": EVENT_STREAM_HEADERS})
+            # Сообщаем клиенту интервал переподключения
+            await send({"type": "http.response.body", "body": b"retry: 3000\n\n", "more_body": True})
+            while True:
+                get = asyncio.ensure_future(q.get())
+                done, _ = await asyncio.wait(
+                    {get, disconnected}, timeout=HEARTBEAT_INTERVAL, return_when=asyncio.FIRST_COMPLETED
+                )
+                if disconnected in done:
+                    get.cancel()
+                    break
+                if get in done:
+                    chunk = get.result()
+                else:
+                    get.cancel()
+                    chunk = ": keep-alive\n\n"
+                await send({"type": "http.response.body", "body": chunk.encode("utf-8"), "more_body": True})
+        finally:
+            disconnected.cancel()
+            self.streams.unsubscribe(q, device_id)
+
+    @staticmethod
+    async def _wait_disconnect(receive):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    @staticmethod
+    async def _send_json(send, status, body):
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def _wsgi(self, scope, body, send):
+        """Выполнение Flask-маршрута в пуле потоков с потоковой передачей ответа."""
+        loop = asyncio.get_running_loop()
+        environ = wsgi_environ(scope, body)
+        status, headers, iterable, iterator, chunk = await loop.run_in_executor(
+            self.executor, self._start_wsgi, environ
+        )
+        try:
+            await send({"type": "http.response.start", "status": status, "headers": headers})
+            while chunk is not None:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                chunk = await loop.run_in_executor(self.executor, next, iterator, None)
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(iterable, "close"):
+                await loop.run_in_executor(self.executor, iterable.close)
+
+    def _start_wsgi(self, environ):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = [
+                (name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers
+            ]
+
+        iterable = self.flask_app(environ, start_response)
+        iterator = iter(iterable)
+        # Первый фрагмент получаем в том же потоке: обычно это весь ответ
+        chunk = next(iterator, None)
+        return response["status"], response["headers"], iterable, iterator, chunk
+
+
+application = Application(create_app(), threads=Config.ASGI_THREADS)
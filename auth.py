@@ -1,7 +1,23 @@
-from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required
-from werkzeug.security import check_password_hash, generate_password_hash
+from flask_login import LoginManager, UserMixin
+from werkzeug.security import check_password_hash
 from functools import wraps
 from flask import request, Response
+from collections import OrderedDict
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import threading
+import time
+from config import Config
+from models import db, UserAccount, ApiToken
+
+logger = logging.getLogger(__name__)
+
+# Префикс API-токенов (упрощает поиск утекших токенов в логах и репозиториях)
+TOKEN_PREFIX = "wsm_"
 
 # Простой пользовательский класс
 class User(UserMixin):
@@ -9,47 +25,226 @@ class User(UserMixin):
         self.id = id
         self.username = username
         self.password_hash = password_hash
-    
+
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
-# Словарь для хранения пользователей (в реальном приложении это была бы база данных)
-users = {
-    'admin': User(1, 'admin', generate_password_hash('admin'))  # Используйте более надежный пароль!
-}
+# Хэш пароля 'admin', вычисленный заранее: generate_password_hash при импорте
+# занимал больше 100 мс запуска приложения
+DEFAULT_ADMIN_HASH = (
+    "pbkdf2:sha256:260000$Mago01IcIQotn9zj$"
+    "077e82dc153c21441150c9c469b954b55dfa3d8f3ea8e38b9829d6506db05777"
+)
+
+
+def hash_token(token):
+    """SHA-256 API-токена: токен случайный и длинный, медленный хэш не нужен."""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class UserStore:
+    """Пользователи из базы данных с индексами по id и имени, API-токены.
+
+    Пользователи читаются целиком при первом обращении и затем раз в ttl
+    секунд (так изменения из других процессов тоже становятся видны), поэтому
+    поиск пользователя на каждом запросе - обращение к словарю. Если
+    пользователей нет, создается администратор admin/admin. API-токены
+    проверяются по базе на каждом запросе, чтобы отзыв токена сразу
+    действовал во всех процессах.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._by_id = {}
+        self._by_username = {}
+        self._loaded_at = None
+
+    def _ensure_loaded(self):
+        loaded_at = self._loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at < self.ttl:
+            return
+        with self._lock:
+            if self._loaded_at is loaded_at:
+                self._load()
+
+    def _load(self):
+        """Чтение пользователей и токенов (вызывается под блокировкой)."""
+        try:
+            UserAccount.__table__.create(db.engine, checkfirst=True)
+            ApiToken.__table__.create(db.engine, checkfirst=True)
+            if not db.session.query(UserAccount.id).first():
+                self._create_default_admin()
+            accounts = UserAccount.query.all()
+        except SQLAlchemyError:
+            db.session.rollback()
+            logger.exception("❌ Failed to load users from database")
+            if self._loaded_at is None:
+                # Без базы остается только администратор по умолчанию
+                accounts = [UserAccount(id=1, username="admin", password_hash=DEFAULT_ADMIN_HASH)]
+            else:
+                self._loaded_at = time.monotonic()
+                return
+
+        users = [User(account.id, account.username, account.password_hash) for account in accounts]
+        self._by_id = {user.id: user for user in users}
+        self._by_username = {user.username: user for user in users}
+        self._loaded_at = time.monotonic()
+
+    def _create_default_admin(self):
+        db.session.add(UserAccount(username="admin", password_hash=DEFAULT_ADMIN_HASH))  # Используйте более надежный пароль!
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Администратора одновременно создал другой процесс
+            db.session.rollback()
+
+    def invalidate(self):
+        """Перечитать пользователей при следующем обращении."""
+        self._loaded_at = None
+
+    def get(self, user_id):
+        self._ensure_loaded()
+        return self._by_id.get(user_id)
+
+    def get_by_username(self, username):
+        self._ensure_loaded()
+        return self._by_username.get(username)
+
+    def get_by_token(self, token):
+        """Пользователь по API-токену или None.
+
+        Токен ищется в базе (по уникальному индексу) на каждом запросе:
+        отозванный токен перестает действовать сразу во всех процессах.
+        """
+        if not token or not token.startswith(TOKEN_PREFIX):
+            return None
+        self._ensure_loaded()
+        try:
+            user_id = (db.session.query(ApiToken.user_id)
+                       .filter_by(token_hash=hash_token(token)).scalar())
+        except SQLAlchemyError:
+            db.session.rollback()
+            logger.exception("❌ Failed to check API token")
+            return None
+        return self._by_id.get(user_id) if user_id is not None else None
+
+    def tokens(self, user):
+        """API-токены пользователя (без самих токенов)."""
+        rows = ApiToken.query.filter_by(user_id=user.id).order_by(ApiToken.id).all()
+        return [{"id": row.id, "name": row.name, "created_at": row.created_at} for row in rows]
+
+    def create_token(self, user, name):
+        """Создание API-токена. Токен возвращается только один раз."""
+        token = TOKEN_PREFIX + secrets.token_urlsafe(32)
+        row = ApiToken(user_id=user.id, name=name, token_hash=hash_token(token), created_at=time.time())
+        db.session.add(row)
+        db.session.commit()
+        return {"id": row.id, "name": row.name, "created_at": row.created_at, "token": token}
+
+    def revoke_token(self, user, token_id):
+        """Удаление API-токена пользователя. False, если токен не найден."""
+        row = ApiToken.query.filter_by(id=token_id, user_id=user.id).first()
+        if row is None:
+            return False
+        db.session.delete(row)
+        db.session.commit()
+        return True
+
+
+class CredentialCache:
+    """Ограниченный кэш успешно проверенных пар логин/пароль.
+
+    Проверка пароля (pbkdf2) занимает десятки миллисекунд, поэтому
+    повторные запросы с HTTP Basic Auth в течение ttl секунд сверяются
+    с кэшем. Пароли не хранятся: ключ - HMAC пары логин/пароль на случайном
+    ключе процесса. Неудачные попытки не кэшируются.
+    """
+
+    def __init__(self, size=1024, ttl=300):
+        self.size = size
+        self.ttl = ttl
+        self._key = os.urandom(32)
+        self._lock = threading.Lock()
+        # ключ -> (хэш пароля пользователя, срок действия)
+        self._entries = OrderedDict()
+
+    def _digest(self, username, password):
+        message = f"{username}\0{password}".encode("utf-8")
+        return hmac.new(self._key, message, hashlib.sha256).digest()
+
+    def check(self, user, password):
+        """Проверка пароля пользователя с использованием кэша."""
+        key = self._digest(user.username, password)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            # Запись недействительна, если пароль пользователя сменился
+            if entry is not None and entry[0] == user.password_hash and entry[1] > now:
+                self._entries.move_to_end(key)
+                return True
+        if not user.check_password(password):
+            return False
+        with self._lock:
+            self._entries[key] = (user.password_hash, now + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Пользователи хранятся в базе данных (см. models.UserAccount)
+user_store = UserStore(ttl=Config.AUTH_CACHE_TTL)
+credential_cache = CredentialCache(size=Config.AUTH_CACHE_SIZE, ttl=Config.AUTH_CACHE_TTL)
 
 # Функция для инициализации авторизации
 def init_auth(app):
     login_manager = LoginManager()
     login_manager.init_app(app)
     login_manager.login_view = 'login'
-    
+
     @login_manager.user_loader
     def load_user(user_id):
-        for user in users.values():
-            if str(user.id) == user_id:
-                return user
-        return None
+        try:
+            return user_store.get(int(user_id))
+        except ValueError:
+            return None
+
+    # Запросы без сессии (скрипты) авторизуются API-токеном или HTTP Basic Auth
+    login_manager.request_loader(load_user_from_request)
+
+def load_user_from_request(request):
+    """Пользователь из заголовка Authorization: Bearer <токен> или Basic."""
+    header = request.headers.get("Authorization", "")
+    if header[:7].lower() == "bearer ":
+        return user_store.get_by_token(header[7:].strip())
+    auth = request.authorization
+    if auth and auth.username is not None:
+        return check_auth(auth.username, auth.password)
+    return None
 
 # Функция для HTTP Basic Auth
 def basic_auth_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        auth = request.authorization
-        if not auth or not check_auth(auth.username, auth.password):
+        if load_user_from_request(request) is None:
             return authenticate()
         return f(*args, **kwargs)
     return decorated
 
 def check_auth(username, password):
-    user = users.get(username)
-    if user and user.check_password(password):
-        login_user(user)
-        return True
-    return False
+    """Пользователь с таким логином и паролем или None."""
+    user = user_store.get_by_username(username)
+    if user and password and credential_cache.check(user, password):
+        return user
+    return None
 
 def authenticate():
     return Response(
         'Требуется авторизация', 401,
         {'WWW-Authenticate': 'Basic realm="Login Required"'}
-    )
\ No newline at end of file
+    )
@@ -0,0 +1,193 @@
+"""Сквозной бенчмарк: имитируемый парк водоматов, прием сообщений и API.
+
+Приложение работает в одном процессе с локальной заменой брокера
+(benchmarks/loadgen.py), без сети и без базы данных. Измеряются:
+- память на устройство (tracemalloc после begin/state/settings/config);
+- скорость приема сообщений state/info и denomination/info;
+- задержка API p50/p99 при параллельных запросах;
+- время от отправки команды до ответа устройства (PUT settings?wait=).
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_e2e [--devices 1000] [--messages 50000] [--api-threads 8]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["PERSIST_ENABLED"] = "false"
+os.environ["JOURNAL_ENABLED"] = "false"
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from app import create_app
+from mqtt import client as mqtt_client
+from benchmarks.loadgen import LocalBroker
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def wait_processed(target, timeout=120):
+    """Ожидание, пока рабочие потоки обработают target сообщений."""
+    deadline = time.monotonic() + timeout
+    while mqtt_client.ingest_pipeline.stats()["processed"] < target:
+        if time.monotonic() > deadline:
+            raise RuntimeError("ingest did not catch up")
+        time.sleep(0.001)
+
+
+def feed(broker, messages):
+    """Подача сообщений с учетом заполненности очередей (как при нормальной работе брокера)."""
+    pipeline = mqtt_client.ingest_pipeline
+    limit = pipeline.queue_size * 0.8
+    for i, (topic, payload) in enumerate(messages):
+        if i % 500 == 0:
+            while max(pipeline.stats()["queue_depth"]) > limit:
+                time.sleep(0.0005)
+        broker.deliver(topic, payload)
+
+
+def bench_memory(broker, devices):
+    processed = mqtt_client.ingest_pipeline.stats()["processed"]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    messages = []
+    for device in devices:
+        messages.append(device.begin())
+        messages.append(device.state_info())
+        messages.append((device.topic("setting"), dict(device.settings)))
+        messages.append((device.topic("config"), dict(device.config)))
+    feed(broker, messages)
+    wait_processed(processed + len(messages))
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / len(devices)
+
+
+def bench_ingest(broker, devices, count):
+    messages = []
+    for i in range(count):
+        device = devices[i % len(devices)]
+        messages.append(device.denomination() if i % 10 == 0 else device.state_info())
+
+    processed = mqtt_client.ingest_pipeline.stats()["processed"]
+    start = time.perf_counter()
+    feed(broker, messages)
+    wait_processed(processed + count)
+    return count / (time.perf_counter() - start)
+
+
+def logged_in_client(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = "1"
+    return client
+
+
+def bench_api(app, devices, threads, requests_per_thread):
+    """Параллельные GET-запросы типичной смеси страниц списка и устройства."""
+    latencies = {}
+    lock = threading.Lock()
+
+    def worker(index):
+        client = logged_in_client(app)
+        local = {}
+        for i in range(requests_per_thread):
+            device = devices[(index * requests_per_thread + i) % len(devices)]
+            if i % 10 == 0:
+                name, url = "summary", "/api/devices/summary?per_page=100"
+            elif i % 2:
+                name, url = "state", f"/api/devices/{device.device_id}/state/info"
+            else:
+                name, url = "settings", f"/api/devices/{device.device_id}/settings"
+            start = time.perf_counter()
+            client.get(url)
+            local.setdefault(name, []).append(time.perf_counter() - start)
+        with lock:
+            for name, values in local.items():
+                latencies.setdefault(name, []).extend(values)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    total = sum(len(values) for values in latencies.values())
+    return latencies, total / elapsed
+
+
+def bench_acks(app, devices, threads, count):
+    """Время от PUT настроек до ответа устройства setting/ack."""
+    rtts = []
+    failed = [0]
+    lock = threading.Lock()
+
+    def worker(index):
+        client = logged_in_client(app)
+        for i in range(index, count, threads):
+            device = devices[i % len(devices)]
+            start = time.perf_counter()
+            response = client.put(f"/api/devices/{device.device_id}/settings?wait=5",
+                                  json={"maxPayment": 500 + i})
+            elapsed = time.perf_counter() - start
+            with lock:
+                if response.status_code == 200:
+                    rtts.append(elapsed)
+                else:
+                    failed[0] += 1
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return rtts, failed[0]
+
+
+def ms(seconds):
+    return f"{seconds * 1000:7.2f} ms"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--api-threads", type=int, default=8)
+    parser.add_argument("--api-requests", type=int, default=500, help="запросов на поток")
+    parser.add_argument("--acks", type=int, default=500)
+    args = parser.parse_args()
+
+    app = create_app(start=False)
+    mqtt_client.ingest_pipeline.start()
+    broker = LocalBroker(mqtt_client.on_message)
+    mqtt_client.client.publish = broker.publish
+    devices = broker.add_devices(args.devices)
+
+    per_device = bench_memory(broker, devices)
+    print(f"devices:        {args.devices}")
+    print(f"memory/device:  {per_device / 1024:7.1f} KiB")
+
+    rate = bench_ingest(broker, devices, args.messages)
+    print(f"ingest:         {rate:,.0f} msg/s")
+
+    latencies, throughput = bench_api(app, devices, args.api_threads, args.api_requests)
+    print(f"api:            {throughput:,.0f} req/s with {args.api_threads} threads")
+    for name, values in sorted(latencies.items()):
+        print(f"  {name:<12} p50 {ms(percentile(values, 50))}  p99 {ms(percentile(values, 99))}")
+
+    rtts, failed = bench_acks(app, devices, args.api_threads, args.acks)
+    print(f"ack rtt:        p50 {ms(percentile(rtts, 50))}  p99 {ms(percentile(rtts, 99))}"
+          f"  ({len(rtts)} acked, {failed} failed)")
+
+    stats = mqtt_client.ingest_pipeline.stats()
+    print(f"dropped:        {stats['dropped']}, handler errors: {stats['errors']}")
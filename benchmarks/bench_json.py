@@ -0,0 +1,61 @@
+"""Микро-бенчмарк разбора и сериализации JSON на сообщениях state/info.
+
+Сравнивает прежний путь json.loads(payload.decode("utf-8")), разбор bytes
+стандартным модулем и orjson (если установлен), а также сериализацию
+ответа API.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_json
+"""
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.loadgen import SimulatedDevice
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+rng = random.Random(1)
+STATES = [SimulatedDevice(str(100000 + i), rng).state_info()[1] for i in range(100)]
+PAYLOADS = [json.dumps(state).encode("utf-8") for state in STATES]
+
+
+def bench(fn, items, rounds=200):
+    def run():
+        for item in items:
+            fn(item)
+    seconds = min(timeit.repeat(run, number=rounds, repeat=5))
+    return len(items) * rounds / seconds
+
+
+def report(title, results):
+    print(title)
+    baseline = results[0][1]
+    for name, rate in results:
+        print(f"  {name:<28} {rate:>12,.0f} msg/s ({rate / baseline:.2f}x)")
+
+
+if __name__ == "__main__":
+    decode = [
+        ("json.loads(decode())", bench(lambda p: json.loads(p.decode("utf-8")), PAYLOADS)),
+        ("json.loads(bytes)", bench(json.loads, PAYLOADS)),
+    ]
+    encode = [
+        ("json.dumps().encode()", bench(lambda s: json.dumps(s).encode("utf-8"), STATES)),
+    ]
+    if orjson is not None:
+        decode.append(("orjson.loads(bytes)", bench(orjson.loads, PAYLOADS)))
+        encode.append(("orjson.dumps()", bench(orjson.dumps, STATES)))
+    else:
+        print("orjson is not installed, only the standard json module is measured")
+
+    print(f"payload size: {sum(map(len, PAYLOADS)) / len(PAYLOADS):.0f} bytes on average")
+    report("decode", decode)
+    report("encode", encode)
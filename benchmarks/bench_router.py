@@ -0,0 +1,85 @@
+"""Микро-бенчмарк маршрутизации MQTT-топиков.
+
+Сравнивает прежнюю цепочку startswith/split/endswith из on_message
+с таблицей маршрутов TopicRouter на типичной смеси топиков.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_router
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mqtt.router import TopicRouter, parse_topic
+
+SUFFIXES = [
+    "/server/state/info",
+    "/server/setting",
+    "/server/config",
+    "/server/setting/ack",
+    "/server/config/ack",
+    "/server/reboot/ack",
+    "/server/denomination/info",
+    "/server/display",
+    "/server/payment/ack",
+    "/server/action/ack",
+]
+
+# Типичный поток: в основном state/info, изредка прием денег и ответы
+TOPICS = (
+    [f"wsm/{1000 + i}/server/state/info" for i in range(80)]
+    + [f"wsm/{1000 + i}/server/denomination/info" for i in range(10)]
+    + [f"wsm/{1000 + i}{suffix}" for i, suffix in enumerate(SUFFIXES[1:])]
+)
+
+counts = dict.fromkeys(SUFFIXES, 0)
+
+
+def legacy_dispatch(topic):
+    """Копия прежней логики разбора топика из on_message."""
+    if topic.startswith("wsm/"):
+        parts = topic.split("/")
+        if len(parts) < 3:
+            return
+        device_id = parts[1]
+        for suffix in SUFFIXES:
+            if topic.endswith(suffix):
+                counts[suffix] += 1
+                return device_id
+
+
+def make_handler(suffix):
+    def handler(device_id, payload, received_at):
+        counts[suffix] += 1
+    return handler
+
+
+router = TopicRouter()
+for suffix in SUFFIXES:
+    router.register(suffix[1:], make_handler(suffix))
+
+
+def routed_dispatch(topic):
+    parsed = parse_topic(topic)
+    if parsed is None:
+        return
+    device_id, route = parsed
+    router.dispatch(device_id, route, None, 0)
+    return device_id
+
+
+def bench(fn, rounds=2000):
+    def run():
+        for topic in TOPICS:
+            fn(topic)
+    seconds = min(timeit.repeat(run, number=rounds, repeat=5))
+    return len(TOPICS) * rounds / seconds
+
+
+if __name__ == "__main__":
+    before = bench(legacy_dispatch)
+    after = bench(routed_dispatch)
+    print(f"endswith chain: {before:,.0f} msg/s")
+    print(f"topic router:   {after:,.0f} msg/s ({after / before:.2f}x)")
@@ -0,0 +1,68 @@
+"""Бенчмарк холодного запуска приложения.
+
+Каждое измерение выполняется в отдельном процессе интерпретатора:
+- import - импорт модуля app (без сетевых подключений и потоков);
+- create_app - импорт и create_app() с запуском MQTT при недоступном брокере.
+
+Брокер указывается на неотвечающий адрес, поэтому блокирующий connect()
+задержал бы запуск до таймаута TCP. Если медиана превышает бюджет,
+бенчмарк завершается с кодом 1.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_startup [--budget-ms 1000] [--runs 5]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    "import": "import app",
+    "create_app": "import app; app.create_app()",
+}
+
+SNIPPET = """
+import time
+start = time.perf_counter()
+{code}
+print(time.perf_counter() - start)
+"""
+
+
+def measure(code, runs):
+    env = dict(
+        os.environ,
+        MQTT_BROKER="10.255.255.1",
+        MQTT_PORT="1883",
+        PERSIST_ENABLED="false",
+        LOG_LEVEL="WARNING",
+    )
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", SNIPPET.format(code=code)],
+            cwd=ROOT, env=env, capture_output=True, text=True, check=True
+        ).stdout
+        timings.append(float(output.strip().splitlines()[-1]) * 1000)
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget-ms", type=float, default=1000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    over_budget = False
+    for name, code in SCENARIOS.items():
+        timings = measure(code, args.runs)
+        median = statistics.median(timings)
+        over_budget |= median > args.budget_ms
+        print(f"{name:<11} median {median:7.1f} ms, max {max(timings):7.1f} ms")
+
+    if over_budget:
+        print(f"over budget of {args.budget_ms:.0f} ms")
+        sys.exit(1)
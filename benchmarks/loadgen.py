@@ -0,0 +1,182 @@
+"""Генератор нагрузки: имитация водоматов и локальная замена MQTT-брокера.
+
+LocalBroker подменяет публикацию MQTT-клиента приложения: команды
+client/*/set и client/*/get доставляются имитируемым устройствам, а их
+ответы и телеметрия приходят в приложение через тот же on_message,
+что и сообщения от настоящего брокера.
+"""
+import json
+import queue
+import random
+import threading
+import time
+import paho.mqtt.client as mqtt
+from mqtt.pending import RESPONSE_TOPICS
+
+# Задержка ответа устройства на команду (в секундах)
+DEVICE_RESPONSE_DELAY = 0.001
+
+# Режимы работы и флаги ошибок из раздела 3.8 протокола обмена
+OPERATING_MODES = ("WAIT", "WAIT", "WAIT", "WAIT", "SALEMONEY", "SPILL", "BLOCK", "INCASS", "SERVIS")
+ERROR_FLAGS = ("lowLevelSensor", "ServerBlock", "pour", "reserv",
+               "coinValidator", "billValidator", "PayPass", "Card")
+
+
+def make_message(topic, payload):
+    """Сообщение в том виде, в каком его передает paho."""
+    msg = mqtt.MQTTMessage(topic=topic.encode("utf-8"))
+    msg.payload = payload
+    return msg
+
+
+def device_time():
+    """Время в формате контроллера: "21.09.2024T11:28:05"."""
+    return time.strftime("%d.%m.%YT%H:%M:%S")
+
+
+class SimulatedDevice:
+    """Водомат, отвечающий по протоколу обмена."""
+
+    def __init__(self, device_id, rng):
+        self.device_id = device_id
+        self.rng = rng
+        self.settings = {
+            "maxPayment": 20000,
+            "minPayPass": 100,
+            "maxPayPass": 20000,
+            "deltaPayPass": 100,
+            "tariffPerLiter_1": 100,
+            "tariffPerLiter_2": 200,
+            "pulsesPerLiter_1": 450,
+            "pulsesPerLiter_2": 450,
+            "pulsesPerLiter_3": 450,
+            "timeOnePay": 300,
+            "litersInFullTank": 75000,
+            "timeServisMode": 600,
+            "spillTimer": 0,
+            "spillAmount": 0,
+        }
+        self.config = {
+            "pppos_apn": "internet",
+            "wifi_STA_ssid": "Vodomat",
+            "wifi_STA_pass": "wsm-admin",
+            "ntp_server": "pool.ntp.org",
+            "timeZone": 3,
+            "broker_uri": "mqtt://mqtt.example.com",
+            "broker_port": 1883,
+            "broker_user": device_id,
+            "broker_pass": "qwertyu",
+            "OTA_server": "http://",
+            "OTA_port": 80,
+            "bill_table": [5, 10, 20, 50, 100, 200, 500, 1000],
+            "coinValidatorType": "protocol",
+            "coinPulsePrice": 1,
+            "coin_table": [50, 100, 100, 200, 500, 1000],
+        }
+
+    def topic(self, suffix):
+        return f"wsm/{self.device_id}/server/{suffix}"
+
+    def begin(self):
+        return self.topic("begin"), {
+            "time": device_time(),
+            "free_memory": 51200,
+            "free_eeprom": 51200,
+            "cpu_temperature": 42.5,
+            "wifi_signal": self.rng.randint(-90, -40),
+            "gsm_signal": self.rng.randint(-110, -60),
+            "active_connection": "wifi",
+        }
+
+    def state_info(self):
+        mode = self.rng.choice(OPERATING_MODES)
+        errors = {flag: False for flag in ERROR_FLAGS}
+        errors["lowLevelSensor"] = self.rng.random() < 0.05
+        errors["ServerBlock"] = mode == "BLOCK"
+        return self.topic("state/info"), {
+            "created": device_time(),
+            "summaInBox": self.rng.randint(0, 100000),
+            "litersInTank": self.rng.randint(0, 75000),
+            "operatingMode": mode,
+            "tankLowLevelSensor": errors["lowLevelSensor"],
+            "tankHighLevelSensor": False,
+            "depositBoxSensor": False,
+            "doorSensor": mode == "INCASS",
+            "coinState": 0,
+            "billState": 0,
+            "errors": errors,
+        }
+
+    def denomination(self):
+        return self.topic("denomination/info"), {
+            "created": device_time(),
+            "coin": self.rng.choice((0, 50, 100, 200, 500, 1000)),
+            "bill": self.rng.choice((0, 0, 500, 1000, 2000)),
+        }
+
+    def respond(self, command, payload):
+        """Ответ устройства на команду client/<command> или None."""
+        response_topic = RESPONSE_TOPICS.get(command)
+        if response_topic is None:
+            return None
+        request_id = payload.get("request_id")
+        if command == "setting/get":
+            response = dict(self.settings, request_id=request_id, last_update=device_time())
+        elif command == "config/get":
+            response = dict(self.config, request_id=request_id, last_update=device_time())
+        elif command == "display/get":
+            response = {"request_id": request_id, "line_1": "OPLATA PayPass", "line_2": "VODA 1.00 L"}
+        else:
+            response = {"request_id": request_id, "code": 0}
+            if command == "payment/set" and isinstance(payload.get("addQRcode"), dict):
+                response["order_id"] = payload["addQRcode"].get("order_id")
+        return self.topic(response_topic), response
+
+
+class LocalBroker:
+    """Замена брокера в одном процессе.
+
+    publish() вызывается кодом приложения вместо client.publish();
+    ответы устройств доставляются отдельным потоком, как сетевой поток paho.
+    """
+
+    def __init__(self, on_message, response_delay=DEVICE_RESPONSE_DELAY):
+        self.on_message = on_message
+        self.response_delay = response_delay
+        self.devices = {}
+        self.published = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="local-broker", daemon=True)
+        self._thread.start()
+
+    def add_devices(self, count, seed=1):
+        rng = random.Random(seed)
+        for i in range(count):
+            device_id = str(100000 + i)
+            self.devices[device_id] = SimulatedDevice(device_id, rng)
+        return list(self.devices.values())
+
+    def deliver(self, topic, payload):
+        """Доставка сообщения устройства в приложение."""
+        self.on_message(None, None, make_message(topic, json.dumps(payload).encode("utf-8")))
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.published += 1
+        self._queue.put((time.monotonic() + self.response_delay, topic, payload))
+        return mqtt.MQTTMessageInfo(self.published)
+
+    def _run(self):
+        while True:
+            due, topic, payload = self._queue.get()
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            parts = topic.split("/", 3)
+            if len(parts) < 4 or parts[2] != "client":
+                continue
+            device = self.devices.get(parts[1])
+            if device is None:
+                continue
+            response = device.respond(parts[3], json.loads(payload))
+            if response is not None:
+                self.deliver(*response)
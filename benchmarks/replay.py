@@ -0,0 +1,91 @@
+"""Воспроизведение журнала сообщений через конвейер приема.
+
+Сообщения из журнала (mqtt/journal.py) подаются в ingest_pipeline с исходными
+метками времени - так же, как их подавал on_message. Приложение работает без
+брокера и без базы данных; команды, которые отправили бы обработчики,
+только подсчитываются. Подходит для отладки (состояние устройства после
+воспроизведения) и для замера скорости приема на реальном трафике.
+
+Запуск из корня проекта:
+    python -m benchmarks.replay [--journal journal] [--device 123] [--since 1700000000]
+                                [--until ...] [--speed 0] [--show-state]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["PERSIST_ENABLED"] = "false"
+# Воспроизводимые сообщения не должны снова попасть в журнал
+os.environ["JOURNAL_ENABLED"] = "false"
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from app import create_app
+from mqtt import client as mqtt_client
+from mqtt.journal import JournalReader
+from benchmarks.bench_e2e import wait_processed
+
+
+def replay(records, speed):
+    """Подача записей в конвейер приема.
+
+    speed=0 - без пауз (с учетом заполненности очередей), иначе с исходными
+    интервалами между сообщениями, ускоренными в speed раз.
+    """
+    pipeline = mqtt_client.ingest_pipeline
+    limit = pipeline.queue_size * 0.8
+    count = 0
+    first_at = started = None
+    for received_at, topic, payload in records:
+        if first_at is None:
+            first_at, started = received_at, time.monotonic()
+        if speed:
+            delay = (received_at - first_at) / speed - (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+        elif count % 500 == 0:
+            while max(pipeline.stats()["queue_depth"]) > limit:
+                time.sleep(0.0005)
+        while not pipeline.submit(topic, payload, received_at):
+            time.sleep(0.0005)
+        count += 1
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--journal", default=os.getenv("JOURNAL_DIR", "journal"), help="каталог журнала")
+    parser.add_argument("--device", help="только сообщения устройства")
+    parser.add_argument("--since", type=float, help="начало диапазона (unix time)")
+    parser.add_argument("--until", type=float, help="конец диапазона (unix time)")
+    parser.add_argument("--speed", type=float, default=0, help="ускорение относительно исходного темпа; 0 - без пауз")
+    parser.add_argument("--show-state", action="store_true", help="вывести состояние устройств после воспроизведения")
+    args = parser.parse_args()
+
+    app = create_app(start=False)
+    mqtt_client.ingest_pipeline.start()
+    published = []
+    mqtt_client.client.publish = lambda topic, payload, qos=0: published.append(topic)
+
+    reader = JournalReader(args.journal)
+    processed = mqtt_client.ingest_pipeline.stats()["processed"]
+    started = time.perf_counter()
+    count = replay(reader.read(args.device, args.since, args.until), args.speed)
+    wait_processed(processed + count)
+    elapsed = time.perf_counter() - started
+
+    stats = mqtt_client.ingest_pipeline.stats()
+    print(f"messages:       {count}")
+    print(f"elapsed:        {elapsed:.2f} s ({count / elapsed if elapsed else 0:,.0f} msg/s)")
+    print(f"devices:        {len(mqtt_client.devices)}")
+    print(f"commands:       {len(published)} (not sent)")
+    print(f"dropped:        {stats['dropped']}, handler errors: {stats['errors']}")
+
+    if args.show_state:
+        device_ids = [args.device] if args.device else mqtt_client.devices.ids()
+        for device_id in device_ids:
+            state = mqtt_client.get_device_state(device_id)
+            print(f"{device_id}: {json.dumps(state, ensure_ascii=False, default=str)}")
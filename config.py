@@ -10,10 +10,120 @@ class Config:
     MQTT_USERNAME = os.getenv("MQTT_USERNAME", "user")
     MQTT_PASSWORD = os.getenv("MQTT_PASSWORD", "pass")
     FLASK_PORT = int(os.getenv("FLASK_PORT", 5000))
+
+    # Логирование: уровень, вывод JSON-строками и ограничение частоты
+    # однотипных сообщений (не чаще одного раза в LOG_SAMPLE_INTERVAL секунд на топик)
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+    LOG_JSON = os.getenv("LOG_JSON", "false").lower() in ("1", "true", "yes")
+    LOG_SAMPLE_INTERVAL = float(os.getenv("LOG_SAMPLE_INTERVAL", 0))
     
     # Secret key для сессий и токенов
     SECRET_KEY = os.getenv("SECRET_KEY", secrets.token_hex(16))
+    # Сколько секунд доверять проверенному паролю (без повторного хэширования)
+    # и как часто перечитывать пользователей из базы (API-токены проверяются по базе всегда)
+    AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", 300))
+    # Максимальное число проверенных пар логин/пароль в кэше
+    AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", 1024))
+
+    # Через сколько секунд без сообщений устройство считается не в сети
+    DEVICE_OFFLINE_AFTER = int(os.getenv("DEVICE_OFFLINE_AFTER", 300))
+    # Через сколько секунд без сообщений устройство удаляется из памяти (0 - не удалять)
+    DEVICE_EVICT_AFTER = int(os.getenv("DEVICE_EVICT_AFTER", 30 * 24 * 3600))
+
+    # Обработка входящих MQTT-сообщений: число рабочих потоков и размер очереди каждого
+    INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 2))
+    INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 10000))
+
+    # Сколько секунд хранить отправленные команды в ожидании ответа
+    REQUEST_TTL = int(os.getenv("REQUEST_TTL", 300))
+    # Максимальное время ожидания ответа в запросах с ?wait= (в секундах)
+    ACK_WAIT_MAX = float(os.getenv("ACK_WAIT_MAX", 30))
+    # Очередь команд устройству: QoS публикации, не больше OUTBOUND_RATE команд
+    # в секунду (с запасом OUTBOUND_BURST; 0 - без ограничения) и OUTBOUND_MAX_IN_FLIGHT без ответа,
+    # до OUTBOUND_QUEUE_SIZE команд в очереди. Команда без ответа повторяется через
+    # OUTBOUND_RETRY_TIMEOUT секунд с удвоением задержки (до OUTBOUND_RETRY_MAX_DELAY),
+    # всего до OUTBOUND_MAX_ATTEMPTS попыток
+    MQTT_COMMAND_QOS = int(os.getenv("MQTT_COMMAND_QOS", 1))
+    OUTBOUND_RATE = float(os.getenv("OUTBOUND_RATE", 5))
+    OUTBOUND_BURST = int(os.getenv("OUTBOUND_BURST", 10))
+    OUTBOUND_MAX_IN_FLIGHT = int(os.getenv("OUTBOUND_MAX_IN_FLIGHT", 4))
+    OUTBOUND_QUEUE_SIZE = int(os.getenv("OUTBOUND_QUEUE_SIZE", 50))
+    OUTBOUND_RETRY_TIMEOUT = float(os.getenv("OUTBOUND_RETRY_TIMEOUT", 10))
+    OUTBOUND_RETRY_MAX_DELAY = float(os.getenv("OUTBOUND_RETRY_MAX_DELAY", 60))
+    OUTBOUND_MAX_ATTEMPTS = int(os.getenv("OUTBOUND_MAX_ATTEMPTS", 3))
+
+    # Одинаковые запросы настроек/конфигурации/дисплея объединяются: пока запрос
+    # ждет ответа (не дольше COALESCE_IN_FLIGHT_TIMEOUT) или ответ моложе COALESCE_TTL
+    # секунд, новый запрос в устройство не отправляется
+    COALESCE_TTL = float(os.getenv("COALESCE_TTL", 10))
+    COALESCE_IN_FLIGHT_TIMEOUT = float(os.getenv("COALESCE_IN_FLIGHT_TIMEOUT", 10))
+
+    # Количество последних записей о принятых номиналах, хранимых для каждого устройства (0 - не хранить)
+    DENOMINATION_CAPACITY = int(os.getenv("DENOMINATION_CAPACITY", 10000))
+    # Сколько последних изменений состояния хранить на устройство (0 - не хранить)
+    STATE_HISTORY_SIZE = int(os.getenv("STATE_HISTORY_SIZE", 100))
+    # Агрегаты показателей: сколько минутных (6 ч), часовых (31 сутки)
+    # и суточных корзин хранить на устройство
+    ROLLUP_MINUTE_BUCKETS = int(os.getenv("ROLLUP_MINUTE_BUCKETS", 360))
+    ROLLUP_HOUR_BUCKETS = int(os.getenv("ROLLUP_HOUR_BUCKETS", 744))
+    ROLLUP_DAY_BUCKETS = int(os.getenv("ROLLUP_DAY_BUCKETS", 400))
+
+    # Массовая отправка команд: число устройств, одновременно ожидающих ответа,
+    # QoS публикации и время ожидания ответа от каждого устройства (в секундах)
+    BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 20))
+    BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 100))
+    BATCH_QOS = int(os.getenv("BATCH_QOS", 1))
+    BATCH_ACK_TIMEOUT = float(os.getenv("BATCH_ACK_TIMEOUT", 10))
+
+    # Режим процесса: standalone - все в одном процессе; ingest - единственный
+    # процесс с подключением к брокеру, пишет сообщения в общее хранилище;
+    # web - веб-воркер без подключения к брокеру, читает общее хранилище
+    PROCESS_ROLE = os.getenv("PROCESS_ROLE", "standalone").lower()
+    # Общее хранилище (SQLite в режиме WAL), интервал его опроса веб-воркерами
+    # и сколько секунд хранить журнал сообщений
+    SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", "shared_state.db")
+    SHARED_POLL_INTERVAL_MS = int(os.getenv("SHARED_POLL_INTERVAL_MS", 100))
+    SHARED_LOG_RETENTION = int(os.getenv("SHARED_LOG_RETENTION", 3600))
+
+    # Журнал сырых MQTT-сообщений (выгрузка по устройству, воспроизведение):
+    # по умолчанию выключен, так как занимает место на диске (см. README);
+    # каталог, размер и возраст сегмента, сколько секунд хранить сегменты
+    JOURNAL_ENABLED = os.getenv("JOURNAL_ENABLED", "false").lower() in ("1", "true", "yes")
+    JOURNAL_DIR = os.getenv("JOURNAL_DIR", "journal")
+    JOURNAL_SEGMENT_BYTES = int(os.getenv("JOURNAL_SEGMENT_BYTES", 64 * 1024 * 1024))
+    JOURNAL_SEGMENT_SECONDS = int(os.getenv("JOURNAL_SEGMENT_SECONDS", 3600))
+    JOURNAL_RETENTION = int(os.getenv("JOURNAL_RETENTION", 2 * 86400))
+
+    # Задержка между попытками подключения к брокеру: от минимальной,
+    # удваиваясь после каждой неудачи, до максимальной (в секундах)
+    MQTT_RECONNECT_MIN_DELAY = int(os.getenv("MQTT_RECONNECT_MIN_DELAY", 1))
+    MQTT_RECONNECT_MAX_DELAY = int(os.getenv("MQTT_RECONNECT_MAX_DELAY", 120))
+
+    # Обслуживание MQTT-соединения: thread - поток paho (loop_start),
+    # asyncio - цикл событий ASGI-приложения (asgi.py)
+    MQTT_LOOP = os.getenv("MQTT_LOOP", "thread").lower()
+    # Число потоков, в которых ASGI-приложение выполняет обычные Flask-маршруты
+    ASGI_THREADS = int(os.getenv("ASGI_THREADS", 32))
+
+    # Токен для доступа к /metrics (Authorization: Bearer <токен>); пусто - доступ как к API
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+    # Реализация JSON: auto - orjson, если установлен; json - стандартный модуль
+    JSON_BACKEND = os.getenv("JSON_BACKEND", "auto").lower()
+    # Максимальный размер MQTT-сообщения (в байтах); более крупные отбрасываются
+    MQTT_MAX_PAYLOAD = int(os.getenv("MQTT_MAX_PAYLOAD", 65536))
 
     # Добавляем параметр БД
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL", "sqlite:///wsm_viewer.db")
-    SQLALCHEMY_TRACK_MODIFICATIONS = False  # Отключаем предупреждения
\ No newline at end of file
+    SQLALCHEMY_TRACK_MODIFICATIONS = False  # Отключаем предупреждения
+
+    # Сохранение телеметрии в БД: запись пачками по PERSIST_BATCH_SIZE сообщений
+    # или раз в PERSIST_FLUSH_INTERVAL_MS миллисекунд
+    PERSIST_ENABLED = os.getenv("PERSIST_ENABLED", "true").lower() in ("1", "true", "yes")
+    PERSIST_BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", 500))
+    PERSIST_FLUSH_INTERVAL_MS = int(os.getenv("PERSIST_FLUSH_INTERVAL_MS", 1000))
+    PERSIST_QUEUE_SIZE = int(os.getenv("PERSIST_QUEUE_SIZE", 10000))
+    # Сколько секунд хранить историю сообщений в БД (0 - не удалять)
+    TELEMETRY_RETENTION = int(os.getenv("TELEMETRY_RETENTION", 30 * 24 * 3600))
+    # Как часто сохранять измененные часовые и суточные агрегаты (в секундах)
+    ROLLUP_FLUSH_INTERVAL = float(os.getenv("ROLLUP_FLUSH_INTERVAL", 60))
\ No newline at end of file
@@ -0,0 +1,50 @@
+"""Процесс приема MQTT-сообщений для запуска в несколько процессов.
+
+Единственный процесс с подключением к брокеру: пишет входящие сообщения
+в общее хранилище и публикует команды веб-воркеров (PROCESS_ROLE=web).
+
+    python ingest.py
+"""
+import os
+import threading
+
+# Режим нужно задать до импорта настроек
+os.environ["PROCESS_ROLE"] = "ingest"
+
+from flask import Flask
+from config import Config
+from logging_setup import setup_logging
+from models import db
+from mqtt.client import devices, restore_devices, restore_denominations, restore_rollups, start_mqtt
+from mqtt.persistence import (
+    load_denominations, load_snapshots, load_last_seen, load_rollups, telemetry_writer, rollup_writer
+)
+
+
+def create_ingest_app():
+    """Приложение без маршрутов - только для доступа к базе данных."""
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    db.init_app(app)
+    return app
+
+
+def main():
+    setup_logging(Config.LOG_LEVEL, Config.LOG_JSON, Config.LOG_SAMPLE_INTERVAL)
+
+    app = create_ingest_app()
+    if Config.PERSIST_ENABLED:
+        with app.app_context():
+            db.create_all()
+            restore_devices(load_snapshots(), load_last_seen())
+            restore_denominations(load_denominations(devices.ids(), Config.DENOMINATION_CAPACITY))
+            restore_rollups(load_rollups(devices))
+        telemetry_writer.start(app)
+        rollup_writer.start(app, devices)
+
+    start_mqtt()
+    threading.Event().wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+# Поля LogRecord, которые не попадают в JSON как дополнительные
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматирование записей в одну JSON-строку для сборщика логов."""
+
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                data[key] = value
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SampleFilter(logging.Filter):
+    """Ограничение частоты записей с одинаковым ключом sample_key.
+
+    Запись с extra={"sample_key": ...} пропускается не чаще одного раза
+    в interval секунд; количество отброшенных записей добавляется
+    в следующую пропущенную как поле suppressed.
+    """
+
+    def __init__(self, interval):
+        super().__init__()
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._state = {}
+
+    def filter(self, record):
+        key = getattr(record, "sample_key", None)
+        if key is None or self.interval <= 0:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            last, suppressed = self._state.get(key, (0.0, 0))
+            if now - last < self.interval:
+                self._state[key] = (last, suppressed + 1)
+                return False
+            self._state[key] = (now, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который откладывает форматирование до потока вывода.
+
+    Стандартный prepare() форматирует сообщение в вызывающем потоке,
+    а нам нужно, чтобы MQTT-поток только клал запись в очередь.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+_listener = None
+
+
+def setup_logging(level="INFO", json_lines=False, sample_interval=0):
+    """Настройка логирования: асинхронный вывод через очередь."""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler()
+    if json_lines:
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter(
+            "%(asctime)s %(levelname)s [%(name)s] %(message)s"
+        ))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(SampleFilter(sample_interval))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    # Дописываем оставшиеся в очереди записи при завершении процесса
+    atexit.register(_listener.stop)
@@ -0,0 +1,205 @@
+import bisect
+import threading
+
+# Границы корзин гистограмм по умолчанию (в секундах)
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # Последняя ячейка - значения больше верхней границы (+Inf)
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class _Metric:
+    """Метрика с необязательными метками.
+
+    Дочерние значения для набора меток создаются один раз и кэшируются,
+    поэтому горячий путь только увеличивает счетчики уже созданного объекта.
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def _render_child(self, values, child):
+        yield f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def _render_child(self, values, child):
+        with child._lock:
+            counts = list(child.counts)
+            total = child.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else _format_value(float(bound))
+            labels = _format_labels(self.labelnames, values, f'le="{le}"')
+            yield f"{self.name}_bucket{labels} {cumulative}"
+        labels = _format_labels(self.labelnames, values)
+        yield f"{self.name}_sum{labels} {_format_value(total)}"
+        yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Gauge:
+    """Значение, вычисляемое в момент запроса метрик.
+
+    callback возвращает число или словарь {значение метки: число}.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, callback, labelname=None):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labelname = labelname
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        value = self.callback()
+        if self.labelname is None:
+            lines.append(f"{self.name} {_format_value(value)}")
+        else:
+            for label, item in sorted(value.items()):
+                lines.append(f'{self.name}{{{self.labelname}="{label}"}} {_format_value(item)}')
+        return lines
+
+
+class Registry:
+    """Набор метрик приложения и их вывод в текстовом формате Prometheus."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, callback, labelname=None):
+        return self.register(Gauge(name, documentation, callback, labelname))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Общий реестр метрик приложения
+registry = Registry()
+
+# Метрики приема MQTT-сообщений
+mqtt_messages = registry.counter(
+    "wsm_mqtt_messages_total", "MQTT messages received by topic route", ["route"])
+mqtt_dropped = registry.counter(
+    "wsm_mqtt_dropped_total", "MQTT messages dropped because the ingest queue was full")
+mqtt_oversized = registry.counter(
+    "wsm_mqtt_oversized_total", "MQTT messages dropped because the payload exceeded MQTT_MAX_PAYLOAD")
+mqtt_decode_errors = registry.counter(
+    "wsm_mqtt_decode_errors_total", "MQTT messages with invalid JSON payload")
+mqtt_handle_seconds = registry.histogram(
+    "wsm_mqtt_handle_seconds", "Time spent handling one MQTT message")
+mqtt_queue_wait_seconds = registry.histogram(
+    "wsm_mqtt_queue_wait_seconds", "Time an MQTT message waited in the ingest queue")
+
+# Метрики команд устройствам
+commands_published = registry.counter(
+    "wsm_commands_published_total", "Commands published to devices", ["command"])
+commands_coalesced = registry.counter(
+    "wsm_commands_coalesced_total", "Device data requests served by an in-flight or recent request", ["command"])
+ack_rtt_seconds = registry.histogram(
+    "wsm_ack_rtt_seconds", "Time from command publish to device response", ["command"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+
+# Метрики HTTP API
+http_requests = registry.counter(
+    "wsm_http_requests_total", "HTTP API requests", ["endpoint", "status"])
+http_request_seconds = registry.histogram(
+    "wsm_http_request_seconds", "HTTP API request latency", ["endpoint"])
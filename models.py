@@ -0,0 +1,69 @@
+from flask_sqlalchemy import SQLAlchemy
+
+# Общий объект базы данных (инициализируется в app.py через db.init_app)
+db = SQLAlchemy()
+
+
+class DeviceSnapshot(db.Model):
+    """Последнее известное значение раздела устройства (state, settings, ...)"""
+    __tablename__ = "device_snapshots"
+
+    device_id = db.Column(db.String(64), primary_key=True)
+    slot = db.Column(db.String(32), primary_key=True)
+    payload = db.Column(db.Text, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False)
+
+
+class TelemetryRecord(db.Model):
+    """История сообщений от устройств.
+
+    Состояние (kind="state_changes") хранится как изменения: только
+    изменившиеся поля относительно предыдущего сообщения.
+    """
+    __tablename__ = "telemetry"
+
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.String(64), nullable=False)
+    kind = db.Column(db.String(32), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    received_at = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (
+        db.Index("ix_telemetry_device_time", "device_id", "received_at"),
+        db.Index("ix_telemetry_device_kind_time", "device_id", "kind", "received_at"),
+        db.Index("ix_telemetry_time", "received_at"),
+    )
+
+
+class RollupBucket(db.Model):
+    """Часовой или суточный агрегат показателей устройства (см. mqtt/rollups.py)"""
+    __tablename__ = "rollups"
+
+    device_id = db.Column(db.String(64), primary_key=True)
+    resolution = db.Column(db.String(16), primary_key=True)
+    start = db.Column(db.Integer, primary_key=True)
+    payload = db.Column(db.Text, nullable=False)
+
+    __table_args__ = (
+        db.Index("ix_rollups_resolution_start", "resolution", "start"),
+    )
+
+
+class UserAccount(db.Model):
+    """Пользователь панели управления"""
+    __tablename__ = "users"
+
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(64), nullable=False, unique=True)
+    password_hash = db.Column(db.String(255), nullable=False)
+
+
+class ApiToken(db.Model):
+    """API-токен для скриптов и интеграций (хранится только SHA-256 токена)"""
+    __tablename__ = "api_tokens"
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, index=True)
+    name = db.Column(db.String(64), nullable=False)
+    token_hash = db.Column(db.String(64), nullable=False, unique=True)
+    created_at = db.Column(db.Float, nullable=False)
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import threading
+import paho.mqtt.client as mqtt
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncioMqttLoop:
+    """Обслуживание сокета paho в цикле asyncio вместо потока loop_start().
+
+    Чтение и запись сокета выполняются по готовности через add_reader/add_writer,
+    а входящие сообщения попадают в тот же on_message и те же обработчики,
+    что и в обычном режиме. Колбэки сокета paho может вызвать из любого потока
+    (например, publish из Flask-маршрута), поэтому из других потоков
+    регистрация в цикле выполняется через call_soon_threadsafe.
+    """
+
+    def __init__(self, client, loop):
+        self.client = client
+        self.loop = loop
+        self._task = None
+        self._loop_thread = None
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    def _call(self, callback, *args):
+        if threading.get_ident() == self._loop_thread:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def _remove(self, callback, sock):
+        # Сокет мог быть закрыт до того, как цикл событий дошел до вызова
+        try:
+            callback(sock)
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._call(self.loop.add_reader, sock, client.loop_read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._call(self._remove, self.loop.remove_reader, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._call(self.loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._call(self._remove, self.loop.remove_writer, sock)
+
+    def start(self, host, port, keepalive=60):
+        """Запуск подключения к брокеру (вызывается из цикла событий)."""
+        if self._task is None:
+            self._loop_thread = threading.get_ident()
+            self._task = self.loop.create_task(self._run(host, port, keepalive))
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        self._task = None
+        self.client.disconnect()
+
+    async def _run(self, host, port, keepalive):
+        delay = Config.MQTT_RECONNECT_MIN_DELAY
+        while True:
+            try:
+                # Установка TCP-соединения блокирующая - выполняем ее вне цикла событий
+                await self.loop.run_in_executor(None, self.client.connect, host, port, keepalive)
+                logger.info("🔌 Connecting to MQTT broker %s:%s (asyncio)", host, port)
+            except Exception as e:
+                logger.error("❌ Failed to connect to MQTT broker: %s", e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, Config.MQTT_RECONNECT_MAX_DELAY)
+                continue
+
+            delay = Config.MQTT_RECONNECT_MIN_DELAY
+            # Keep-alive и повторная отправка сообщений QoS > 0
+            while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+                await asyncio.sleep(1)
+            logger.warning("⚠️ Disconnected from MQTT broker, reconnecting")
@@ -0,0 +1,254 @@
+import fnmatch
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from mqtt.client import devices, fleet_summary, pending_requests, send_command
+from mqtt.commands import (
+    settings_command,
+    config_command,
+    reboot_command,
+    free_payment_command,
+    clear_payment_command,
+    action_command
+)
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних заданий хранить для запросов статуса
+MAX_JOBS = 100
+
+# Команды, доступные для массовой отправки: подготовка команды из payload
+# задания. Команда проверяется и сериализуется один раз на все устройства
+COMMANDS = {
+    "settings": settings_command,
+    "config": config_command,
+    "reboot": lambda payload: reboot_command(payload.get("delay", 400)),
+    "payment_free": lambda payload: free_payment_command(payload.get("amount", 0)),
+    "payment_clear": clear_payment_command,
+    "action": lambda payload: action_command(payload.get("pour"), payload.get("blocking")),
+}
+
+
+# Условия where и их типы (как в фильтрах /api/devices/summary)
+WHERE_FIELDS = {
+    "online": bool,
+    "blocked": bool,
+    "has_errors": bool,
+    "mode": str,
+}
+
+
+def selector_error(selector):
+    """Текст ошибки для некорректного селектора или None.
+
+    Селектор должен явно выбирать устройства: "all": true или хотя бы одно
+    из условий devices, pattern, where. Неизвестные ключи отклоняются,
+    чтобы опечатка не превратилась в команду всему парку.
+    """
+    if not isinstance(selector, dict) or not selector:
+        return "Selector is required"
+    unknown = set(selector) - {"all", "devices", "pattern", "where"}
+    if unknown:
+        return f"Unknown selector keys: {', '.join(sorted(unknown))}"
+    if "all" in selector and not isinstance(selector["all"], bool):
+        return "selector.all must be true or false"
+    if "devices" in selector and (not isinstance(selector["devices"], list)
+                                  or not all(isinstance(d, str) for d in selector["devices"])):
+        return "selector.devices must be a list of device ids"
+    if "pattern" in selector and (not isinstance(selector["pattern"], str) or not selector["pattern"]):
+        return "selector.pattern must be a non-empty string"
+    if "where" in selector:
+        where = selector["where"]
+        if not isinstance(where, dict) or not where:
+            return "selector.where must be a non-empty object"
+        for name, value in where.items():
+            expected = WHERE_FIELDS.get(name)
+            if expected is None:
+                return f"Unknown selector.where keys: {name}, expected: {', '.join(WHERE_FIELDS)}"
+            if not isinstance(value, expected):
+                return f"selector.where.{name} must be {'true or false' if expected is bool else 'a string'}"
+    if selector.get("all") is not True and not any(key in selector for key in ("devices", "pattern", "where")):
+        return 'Selector must set "all": true or one of devices, pattern, where'
+    return None
+
+
+def select_devices(selector):
+    """Список устройств по селектору (проверенному selector_error).
+
+    Поля селектора (условия объединяются через И):
+    all - все устройства, devices - явный список device_id,
+    pattern - шаблон device_id (например "12*"),
+    where - условия по сводке: online, blocked, has_errors, mode.
+    Без "all": true и без условий не выбирается ни одно устройство.
+    """
+    if selector.get("all") is not True and not any(key in selector for key in ("devices", "pattern", "where")):
+        return []
+    selected = devices.ids()
+
+    if selector.get("devices") is not None:
+        wanted = set(selector["devices"])
+        selected = [device_id for device_id in selected if device_id in wanted]
+
+    if selector.get("pattern"):
+        selected = fnmatch.filter(selected, selector["pattern"])
+
+    where = selector.get("where")
+    if where:
+        rows, _ = fleet_summary.query(
+            online=where.get("online"),
+            blocked=where.get("blocked"),
+            mode=where.get("mode"),
+            has_errors=where.get("has_errors"),
+            per_page=len(fleet_summary) or 1
+        )
+        matched = {row["device_id"] for row in rows}
+        selected = [device_id for device_id in selected if device_id in matched]
+
+    return sorted(selected)
+
+
+class BatchJob:
+    """Массовая отправка одной команды на группу устройств.
+
+    prepared - команда, подготовленная функцией из COMMANDS.
+    """
+
+    def __init__(self, command, prepared, device_ids, concurrency, qos, ack_timeout):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.command = command
+        self.prepared = prepared
+        self.concurrency = concurrency
+        self.qos = qos
+        self.ack_timeout = ack_timeout
+        self.created_at = time.time()
+        self.finished_at = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        # device_id -> результат отправки на устройство
+        self.results = OrderedDict(
+            (device_id, {"status": "queued", "request_id": None, "code": None})
+            for device_id in device_ids
+        )
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout):
+        return self._done.wait(timeout)
+
+    def run(self):
+        """Отправка команды с ограничением числа одновременно ожидающих ответа устройств."""
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency,
+                                    thread_name_prefix=f"batch-{self.job_id}") as executor:
+                for device_id in self.results:
+                    executor.submit(self._run_device, device_id)
+        finally:
+            self.finished_at = time.time()
+            self._done.set()
+            logger.info("📦 Batch %s (%s) finished: %s", self.job_id, self.command, self.counts())
+
+    def _run_device(self, device_id):
+        result = self.results[device_id]
+        try:
+            if device_id not in devices:
+                request_id = None
+            else:
+                request_id = send_command(device_id, self.prepared, self.qos)
+        except Exception as e:
+            logger.exception("❌ Batch %s: failed to send to %s", self.job_id, device_id)
+            with self._lock:
+                result.update(status="failed", error=str(e))
+            return
+
+        if request_id is None:
+            with self._lock:
+                result.update(status="failed", error="Device not found")
+            return
+
+        with self._lock:
+            result.update(status="sent", request_id=request_id)
+
+        pending = pending_requests.get(request_id)
+        response = pending.wait(self.ack_timeout) if pending else None
+        with self._lock:
+            if response is None:
+                result["status"] = "timeout"
+            else:
+                result["code"] = response.get("code")
+                result["status"] = "acked" if response.get("code") == 0 else "error"
+
+    def counts(self):
+        with self._lock:
+            counts = {}
+            for result in self.results.values():
+                counts[result["status"]] = counts.get(result["status"], 0) + 1
+            return counts
+
+    def to_dict(self, include_devices=True):
+        data = {
+            "job_id": self.job_id,
+            "command": self.command,
+            "payload": self.prepared.payload,
+            "qos": self.qos,
+            "concurrency": self.concurrency,
+            "status": "done" if self.done else "running",
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "total": len(self.results),
+            "counts": self.counts(),
+        }
+        if include_devices:
+            with self._lock:
+                data["devices"] = {device_id: dict(result) for device_id, result in self.results.items()}
+        return data
+
+
+class BatchJobs:
+    """Реестр массовых заданий."""
+
+    def __init__(self, max_jobs=MAX_JOBS):
+        self.max_jobs = max_jobs
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+
+    def start(self, command, prepared, device_ids, concurrency=None, qos=None, ack_timeout=None):
+        """Создание и запуск задания в фоновом потоке."""
+        if concurrency is None:
+            concurrency = Config.BATCH_CONCURRENCY
+        concurrency = max(1, min(concurrency, Config.BATCH_MAX_CONCURRENCY))
+        job = BatchJob(
+            command,
+            prepared,
+            device_ids,
+            concurrency=concurrency,
+            qos=Config.BATCH_QOS if qos is None else qos,
+            ack_timeout=Config.BATCH_ACK_TIMEOUT if ack_timeout is None else ack_timeout
+        )
+        with self._lock:
+            self._jobs[job.job_id] = job
+            # Удаляем самые старые завершенные задания
+            while len(self._jobs) > self.max_jobs:
+                oldest_id, oldest = next(iter(self._jobs.items()))
+                if not oldest.done:
+                    break
+                del self._jobs[oldest_id]
+
+        threading.Thread(target=job.run, name=f"batch-{job.job_id}", daemon=True).start()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+
+batch_jobs = BatchJobs()
@@ -1,262 +1,554 @@
 import paho.mqtt.client as mqtt
-import json
+import logging
 import time
 from config import Config
+from serializer import loads, DecodeError
+from metrics import (
+    registry,
+    mqtt_messages,
+    mqtt_dropped,
+    mqtt_oversized,
+    mqtt_decode_errors,
+    commands_published,
+    commands_coalesced,
+    ack_rtt_seconds
+)
+from mqtt.events import event_bus
+from mqtt.pending import PendingRequests
+from mqtt.coalesce import RequestCoalescer
+from mqtt.commands import (
+    SETTINGS_REQUEST,
+    CONFIG_REQUEST,
+    DISPLAY_REQUEST,
+    settings_command,
+    config_command,
+    reboot_command,
+    qrcode_payment_command,
+    free_payment_command,
+    clear_payment_command,
+    action_command
+)
+from mqtt.outbound import OutboundQueue
+from mqtt.persistence import telemetry_writer
+from mqtt.ingest import IngestPipeline
+from mqtt.router import TopicRouter, parse_topic
+from mqtt.summary import FleetSummary
+from mqtt.liveness import LivenessTracker
+from mqtt.registry import DeviceRegistry, SLOTS
+from mqtt.state_history import state_metadata
+from mqtt.journal import JournalWriter, JournalReader
+from mqtt.shared_state import SharedLogWriter, SharedLogFollower, OutboxPublisher, OutboxRelay
 
-# Словарь для хранения данных об устройствах
-devices = {}
+logger = logging.getLogger(__name__)
+
+# Реестр устройств и их данных
+devices = DeviceRegistry(
+    denomination_capacity=Config.DENOMINATION_CAPACITY,
+    state_history_size=Config.STATE_HISTORY_SIZE,
+    rollup_resolutions=(
+        ("minute", 60, Config.ROLLUP_MINUTE_BUCKETS),
+        ("hour", 3600, Config.ROLLUP_HOUR_BUCKETS),
+        ("day", 86400, Config.ROLLUP_DAY_BUCKETS),
+    )
+)
+
+# Сводка по парку устройств для списка на главной странице
+fleet_summary = FleetSummary()
+
+# Реестр отправленных команд, ожидающих ответа от устройств
+pending_requests = PendingRequests(ttl=Config.REQUEST_TTL)
+
+def publish_command(topic, payload, qos):
+    """Передача команды клиенту MQTT (в режиме web - в общее хранилище)."""
+    return client.publish(topic, payload, qos=qos)
+
+# Очереди команд устройствам: QoS, повторы без ответа и ограничение скорости
+outbound = OutboundQueue(
+    publish_command,
+    qos=Config.MQTT_COMMAND_QOS,
+    rate=Config.OUTBOUND_RATE,
+    burst=Config.OUTBOUND_BURST,
+    max_in_flight=Config.OUTBOUND_MAX_IN_FLIGHT,
+    queue_size=Config.OUTBOUND_QUEUE_SIZE,
+    retry_timeout=Config.OUTBOUND_RETRY_TIMEOUT,
+    retry_max_delay=Config.OUTBOUND_RETRY_MAX_DELAY,
+    max_attempts=Config.OUTBOUND_MAX_ATTEMPTS
+)
+
+# Команды, после которых ранее полученный ответ на запрос данных устарел
+INVALIDATES = {
+    "setting/set": "setting/get",
+    "config/set": "config/get",
+}
+
+# Разделы с ответом устройства на команду: очищаются перед отправкой,
+# чтобы прежний ответ не был принят за ответ на новую команду
+ACK_SLOTS = {
+    "setting/set": "setting_ack",
+    "config/set": "config_ack",
+    "reboot/set": "reboot_ack",
+    "payment/set": "payment_ack",
+    "action/set": "action_ack",
+}
+
+# Объединение одинаковых запросов данных у устройства
+request_coalescer = RequestCoalescer(
+    pending_requests,
+    ttl=Config.COALESCE_TTL,
+    in_flight_timeout=Config.COALESCE_IN_FLIGHT_TIMEOUT
+)
+
+def set_slot(device_id, slot, value):
+    """Запись раздела устройства с увеличением его версии."""
+    devices.set(device_id, slot, value)
+
+def handle_liveness_transition(transition):
+    """Переход устройства в сеть или из сети."""
+    device_id = transition["device_id"]
+    fleet_summary.set_online(device_id, transition["online"])
+    logger.info("%s Device %s is %s", "🟢" if transition["online"] else "🔴",
+                device_id, "online" if transition["online"] else "offline")
+    event_bus.publish(device_id, "liveness", transition)
+
+def evict_device(device_id):
+    """Удаление давно молчащего устройства из памяти."""
+    devices.remove(device_id)
+    fleet_summary.remove(device_id)
+    request_coalescer.invalidate(device_id)
+    outbound.remove(device_id)
+    logger.info("🗑️ Device %s evicted after %d s of silence", device_id, Config.DEVICE_EVICT_AFTER)
+    event_bus.publish(device_id, "removed", {"device_id": device_id})
+
+# Время последнего сообщения и переходы в сеть/из сети
+liveness = LivenessTracker(
+    offline_after=Config.DEVICE_OFFLINE_AFTER,
+    evict_after=Config.DEVICE_EVICT_AFTER,
+    on_transition=handle_liveness_transition,
+    on_evict=evict_device
+)
+
+def restore_devices(snapshots, last_seen=None):
+    """Заполнение кэша устройств из сохраненных снимков.
+
+    last_seen - время последнего сохранения по устройствам; до первого
+    сообщения восстановленные устройства считаются не в сети.
+    """
+    last_seen = last_seen or {}
+    now = time.time()
+    for device_id, slots in snapshots.items():
+        record, _ = devices.get_or_create(device_id)
+        for slot, payload in slots.items():
+            if slot in SLOTS:
+                set_slot(device_id, slot, payload)
+        if record.state:
+            fleet_summary.update_state(device_id, record.state)
+        liveness.track(device_id, last_seen.get(device_id, now))
+    logger.info("💾 Restored %d devices from database", len(snapshots))
+
+def restore_rollups(rows):
+    """Восстановление сохраненных агрегатов устройств (после restore_devices)."""
+    for device_id, resolution, start, values in rows:
+        record = devices.get(device_id)
+        if record is not None:
+            record.rollups.restore(resolution, start, values)
+
+def restore_denominations(rows):
+    """Восстановление истории номиналов и выручки за сутки (после restore_devices)."""
+    for device_id, payload, received_at in rows:
+        record = devices.get(device_id)
+        if record is not None:
+            record.denomination.append(payload, received_at)
+            fleet_summary.add_cash(device_id, payload, received_at)
+
+def publish_update(device_id, kind, payload, received_at=None):
+    """Рассылка обновления устройства подписчикам и запись в историю."""
+    event_bus.publish(device_id, kind, payload)
+    telemetry_writer.record(device_id, kind, payload, received_at)
 
 def on_connect(client, userdata, flags, rc):
     """При подключении подписываемся на все устройства."""
     if rc == 0:
-        print("✅ Connected to MQTT broker, subscribing to wsm/#")
+        logger.info("✅ Connected to MQTT broker, subscribing to wsm/#")
         client.subscribe("wsm/#")
     else:
-        print(f"❌ Failed to connect, return code {rc}")
+        logger.error("❌ Failed to connect, return code %s", rc)
 
 def on_message(client, userdata, msg):
-    """Обработка входящих MQTT-сообщений."""
-    topic = msg.topic
+    """Прием MQTT-сообщения: только постановка в очередь обработки."""
+    if len(msg.payload) > Config.MQTT_MAX_PAYLOAD:
+        mqtt_oversized.inc()
+        logger.warning("⚠️ Payload of %d bytes exceeds limit, message dropped: %s",
+                       len(msg.payload), msg.topic, extra={"sample_key": "oversized"})
+        return
+    received_at = time.time()
+    if journal is not None:
+        journal.append(msg.topic, msg.payload, received_at)
+    if shared_log is not None:
+        shared_log.append(msg.topic, msg.payload, received_at)
+    if not ingest_pipeline.submit(msg.topic, msg.payload, received_at):
+        mqtt_dropped.inc()
+        logger.warning("⚠️ Ingest queue is full, message dropped: %s", msg.topic,
+                       extra={"sample_key": "ingest_drop"})
+
+def handle_message(topic, raw_payload, received_at):
+    """Обработка входящих MQTT-сообщений (выполняется в рабочем потоке)."""
     try:
-        payload = json.loads(msg.payload.decode("utf-8"))
-    except json.JSONDecodeError:
-        print(f"⚠️ JSON Decode Error: {msg.payload}")
+        payload = loads(raw_payload)
+    except DecodeError:
+        mqtt_decode_errors.inc()
+        logger.warning("⚠️ JSON Decode Error in %s: %r", topic, raw_payload[:200],
+                       extra={"sample_key": topic})
+        return
+    if not isinstance(payload, dict):
+        logger.warning("⚠️ Unexpected payload in %s: %r", topic, payload,
+                       extra={"sample_key": topic})
         return
 
-    print(f"📥 Received message: {topic} → {payload}")
-
-    if topic.startswith("wsm/"):
-        parts = topic.split("/")
-        if len(parts) < 3:
-            return
-
-        device_id = parts[1]
-
-        if device_id not in devices:
-            devices[device_id] = {
-                "settings": {}, 
-                "config": {}, 
-                "state": {}, 
-                "reboot_ack": None,
-                "setting_ack": None,
-                "config_ack": None,
-                "payment_ack": None,
-                "action_ack": None,
-                "display": None,
-                "denomination": []
-            }
-
-        request_id = payload.get("request_id", 234)
-
-        # Обработка состояния оборудования
-        if topic.endswith("/server/state/info"):
-            devices[device_id]["state"] = payload
-            print(f"🆕 State updated for {device_id}")
-
-        # Обработка настроек устройства
-        elif topic.endswith("/server/setting"):
-            payload["request_id"] = request_id
-            payload["received_at"] = time.time()  # Добавляем временную метку
-            devices[device_id]["settings"] = payload
-            print(f"⚙️ Settings received for {device_id}")
-
-        # Обработка конфигурации устройства
-        elif topic.endswith("/server/config"):
-            payload["request_id"] = request_id
-            payload["received_at"] = time.time()  # Добавляем временную метку
-            devices[device_id]["config"] = payload
-            print(f"🔧 Config received for {device_id}")
-
-        # Обработка подтверждения настроек
-        elif topic.endswith("/server/setting/ack"):
-            devices[device_id]["setting_ack"] = payload
-            print(f"⚙️ Settings ACK received for {device_id}: {payload}")
-
-        # Обработка подтверждения конфигурации
-        elif topic.endswith("/server/config/ack"):
-            devices[device_id]["config_ack"] = payload
-            print(f"🔧 Config ACK received for {device_id}: {payload}")
-
-        # Обработка подтверждения перезагрузки
-        elif topic.endswith("/server/reboot/ack"):
-            devices[device_id]["reboot_ack"] = payload
-            print(f"🔄 Reboot ACK received for {device_id}")
-            request_device_settings(device_id)
-            request_device_config(device_id)
-            
-        # Обработка приема денег
-        elif topic.endswith("/server/denomination/info"):
-            if "denomination" not in devices[device_id]:
-                devices[device_id]["denomination"] = []
-            devices[device_id]["denomination"].append(payload)
-            print(f"💰 Denomination received for {device_id}: {payload}")
-            
-        # Обработка информации с дисплея
-        elif topic.endswith("/server/display"):
-            devices[device_id]["display"] = payload
-            print(f"📺 Display info received for {device_id}: {payload}")
-
-        # Обработка подтверждения платежа
-        elif topic.endswith("/server/payment/ack"):
-            devices[device_id]["payment_ack"] = payload
-            print(f"💰 Payment ACK received for {device_id}: {payload}")
-
-        # Обработка подтверждения действия
-        elif topic.endswith("/server/action/ack"):
-            devices[device_id]["action_ack"] = payload
-            print(f"🔄 Action ACK received for {device_id}: {payload}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("📥 Received message: %s → %s", topic, payload, extra={"sample_key": topic})
+
+    parsed = parse_topic(topic)
+    if parsed is None:
+        return
+    device_id, route = parsed
+    _route_messages.get(route, _other_messages).inc()
+
+    _, created = devices.get_or_create(device_id)
+    if created:
+        event_bus.publish(device_id, "device", {"device_id": device_id})
+
+    fleet_summary.touch(device_id, received_at)
+    liveness.touch(device_id, received_at)
+    router.dispatch(device_id, route, payload, received_at)
+
+    # Сопоставление ответа с отправленной командой
+    response_id = payload.get("request_id")
+    if response_id is not None and route.startswith("server/"):
+        request = pending_requests.resolve(device_id, route[len("server/"):], response_id, payload)
+        if request is not None:
+            outbound.acknowledged(device_id, response_id)
+            ack_rtt_seconds.labels(request.command).observe(request.answered_at - request.created_at)
+
+# Обработчики входящих сообщений по маршруту топика
+router = TopicRouter()
+
+@router.route("server/state/info")
+def handle_state_info(device_id, payload, received_at):
+    """Обработка состояния оборудования.
+
+    Устройство присылает состояние целиком; в историю и в базу попадают
+    только изменившиеся поля, а повтор без изменений не рассылается.
+    """
+    record = devices.get(device_id)
+    if record is None:
+        # Устройство удалено (liveness) после get_or_create в handle_message
+        return
+    record.rollups.add_state(payload, received_at)
+    applied = devices.apply_state(device_id, payload, received_at)
+    if applied is None:
+        return
+    version, changes, removed = applied
+    fleet_summary.update_state(device_id, payload)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("🆕 State updated for %s: %s", device_id, ", ".join(changes),
+                     extra={"sample_key": f"state:{device_id}"})
+    delta = {"version": version, **state_metadata(payload), "changes": changes}
+    if removed:
+        delta["removed"] = removed
+    event_bus.publish(device_id, "state", payload)
+    event_bus.publish(device_id, "state_changes", delta)
+    telemetry_writer.record(device_id, "state_changes", delta, received_at, snapshot=("state", payload))
+
+@router.route("server/setting")
+def handle_settings(device_id, payload, received_at):
+    """Обработка настроек устройства."""
+    payload["request_id"] = payload.get("request_id", 234)
+    payload["received_at"] = received_at  # Добавляем временную метку
+    set_slot(device_id, "settings", payload)
+    logger.info("⚙️ Settings received for %s", device_id)
+    publish_update(device_id, "settings", payload, received_at)
+
+@router.route("server/config")
+def handle_config(device_id, payload, received_at):
+    """Обработка конфигурации устройства."""
+    payload["request_id"] = payload.get("request_id", 234)
+    payload["received_at"] = received_at  # Добавляем временную метку
+    set_slot(device_id, "config", payload)
+    logger.info("🔧 Config received for %s", device_id)
+    publish_update(device_id, "config", payload, received_at)
+
+@router.route("server/setting/ack")
+def handle_settings_ack(device_id, payload, received_at):
+    """Обработка подтверждения настроек."""
+    set_slot(device_id, "setting_ack", payload)
+    logger.info("⚙️ Settings ACK received for %s: %s", device_id, payload)
+    publish_update(device_id, "setting_ack", payload, received_at)
+
+@router.route("server/config/ack")
+def handle_config_ack(device_id, payload, received_at):
+    """Обработка подтверждения конфигурации."""
+    set_slot(device_id, "config_ack", payload)
+    logger.info("🔧 Config ACK received for %s: %s", device_id, payload)
+    publish_update(device_id, "config_ack", payload, received_at)
+
+@router.route("server/reboot/ack")
+def handle_reboot_ack(device_id, payload, received_at):
+    """Обработка подтверждения перезагрузки."""
+    set_slot(device_id, "reboot_ack", payload)
+    logger.info("🔄 Reboot ACK received for %s", device_id)
+    publish_update(device_id, "reboot_ack", payload, received_at)
+    # После перезагрузки данные устройства запрашиваются заново, без кэша;
+    # в режиме web повторные запросы отправляет процесс приема
+    request_coalescer.invalidate(device_id)
+    if Config.PROCESS_ROLE != "web":
+        request_device_settings(device_id)
+        request_device_config(device_id)
+
+@router.route("server/denomination/info")
+def handle_denomination(device_id, payload, received_at):
+    """Обработка приема денег."""
+    record = devices.get(device_id)
+    if record is None:
+        return
+    record.denomination.append(payload, received_at)
+    record.rollups.add_payment(payload, received_at)
+    fleet_summary.add_cash(device_id, payload, received_at)
+    logger.info("💰 Denomination received for %s: %s", device_id, payload)
+    publish_update(device_id, "denomination", payload, received_at)
+
+@router.route("server/display")
+def handle_display(device_id, payload, received_at):
+    """Обработка информации с дисплея."""
+    set_slot(device_id, "display", payload)
+    logger.info("📺 Display info received for %s: %s", device_id, payload)
+    publish_update(device_id, "display", payload, received_at)
+
+@router.route("server/payment/ack")
+def handle_payment_ack(device_id, payload, received_at):
+    """Обработка подтверждения платежа."""
+    set_slot(device_id, "payment_ack", payload)
+    logger.info("💰 Payment ACK received for %s: %s", device_id, payload)
+    publish_update(device_id, "payment_ack", payload, received_at)
+
+@router.route("server/action/ack")
+def handle_action_ack(device_id, payload, received_at):
+    """Обработка подтверждения действия."""
+    set_slot(device_id, "action_ack", payload)
+    logger.info("🔄 Action ACK received for %s: %s", device_id, payload)
+    publish_update(device_id, "action_ack", payload, received_at)
+
+# Счетчики сообщений по маршрутам создаются заранее; неизвестные маршруты
+# считаются вместе, чтобы число меток было ограничено
+_route_messages = {route: mqtt_messages.labels(route) for route in router.routes()}
+_other_messages = mqtt_messages.labels("other")
+
+def new_request_id(device_id, command):
+    """Регистрация команды и выдача уникального request_id."""
+    commands_published.labels(command).inc()
+    return pending_requests.allocate(device_id, command).request_id
+
+def send_command(device_id, command, qos=None):
+    """Отправка подготовленной команды (mqtt.commands.PreparedCommand) устройству.
+
+    Проверка и сериализация уже выполнены при подготовке команды, здесь
+    в шаблон подставляется только request_id. Прежний ответ устройства
+    на команду (раздел *_ack) очищается. Возвращает request_id.
+    """
+    request_id = new_request_id(device_id, command.command)
+    invalidates = INVALIDATES.get(command.command)
+    if invalidates is not None:
+        request_coalescer.invalidate(device_id, invalidates)
+    ack_slot = ACK_SLOTS.get(command.command)
+    if ack_slot is not None:
+        set_slot(device_id, ack_slot, None)
+    outbound.submit(device_id, command.command, request_id,
+                    f"wsm/{device_id}/client/{command.command}", command.render(request_id), qos)
+    return request_id
+
+def coalesced_request(device_id, command, slot=None):
+    """Запрос данных у устройства (client/*/get) с объединением одинаковых запросов.
+
+    Если запрос уже ждет ответа или ответ получен недавно, возвращается его
+    request_id без отправки. При отправке нового запроса у раздела slot
+    сбрасывается метка received_at, чтобы до ответа он считался устаревшим.
+    """
+    def publish(request_id):
+        if slot is not None and "received_at" in (devices.read(device_id, slot) or {}):
+            devices.update(device_id, slot, received_at=0)
+        commands_published.labels(command.command).inc()
+        logger.info("📤 Requesting %s for %s...", command.command, device_id)
+        outbound.submit(device_id, command.command, request_id,
+                        f"wsm/{device_id}/client/{command.command}", command.render(request_id))
+
+    request, coalesced = request_coalescer.request(device_id, command.command, publish)
+    if coalesced:
+        commands_coalesced.labels(command.command).inc()
+        logger.debug("🔁 %s for %s coalesced into request %s", command.command, device_id, request.request_id)
+    return request.request_id
 
 def request_device_settings(device_id):
     """Запрос настроек у устройства."""
     if device_id in devices:
-        topic = f"wsm/{device_id}/client/setting/get"
-        payload = json.dumps({"request_id": 234, "fields": []})
-        print(f"📤 Requesting settings for {device_id}...")
-        client.publish(topic, payload)
+        return coalesced_request(device_id, SETTINGS_REQUEST, slot="settings")
 
 def request_device_config(device_id):
     """Запрос конфигурации у устройства."""
     if device_id in devices:
-        topic = f"wsm/{device_id}/client/config/get"
-        payload = json.dumps({"request_id": 234, "fields": []})
-        print(f"📤 Requesting config for {device_id}...")
-        client.publish(topic, payload)
+        return coalesced_request(device_id, CONFIG_REQUEST, slot="config")
 
-def update_device_settings(device_id, new_settings):
+def update_device_settings(device_id, new_settings, qos=None):
     """Отправка обновленных настроек в устройство."""
-    if device_id in devices and "settings" in devices[device_id]:
-        topic = f"wsm/{device_id}/client/setting/set"
-        
-        # Замена None на числовые значения для всех полей
-        for key in new_settings:
-            if new_settings[key] is None:
-                new_settings[key] = 0
-                
-        new_settings["request_id"] = devices[device_id]["settings"].get("request_id", 234)
-        payload = json.dumps(new_settings)
-        print(f"📤 Sending updated settings to {device_id}: {new_settings}")
-        client.publish(topic, payload)
-
-def update_device_config(device_id, new_config):
+    if device_id in devices:
+        command = settings_command(new_settings)
+        logger.info("📤 Sending updated settings to %s: %s", device_id, command.payload)
+        return send_command(device_id, command, qos)
+
+def update_device_config(device_id, new_config, qos=None):
     """Отправка обновленной конфигурации в устройство."""
-    if device_id in devices and "config" in devices[device_id]:
-        topic = f"wsm/{device_id}/client/config/set"
-        
-        # Преобразование строк в массивы для таблиц номиналов если нужно
-        for key in ['bill_table', 'coin_table']:
-            if key in new_config and isinstance(new_config[key], str):
-                try:
-                    new_config[key] = [int(x.strip()) for x in new_config[key].split(',') if x.strip()]
-                except ValueError:
-                    print(f"⚠️ Error converting {key} to array, using empty array")
-                    new_config[key] = []
-                    
-        # Замена None на значения по умолчанию
-        for key in new_config:
-            if new_config[key] is None:
-                if key in ['broker_port', 'OTA_port', 'timeZone', 'coinPulsePrice']:
-                    new_config[key] = 0
-                elif key in ['broker_uri', 'OTA_server', 'wifi_STA_ssid', 'wifi_STA_pass', 'ntp_server', 'broker_user', 'broker_pass']:
-                    new_config[key] = ""
-        
-        new_config["request_id"] = devices[device_id]["config"].get("request_id", 234)
-        payload = json.dumps(new_config)
-        print(f"📤 Sending updated config to {device_id}: {new_config}")
-        client.publish(topic, payload)
-
-def send_reboot_command(device_id, delay):
+    if device_id in devices:
+        command = config_command(new_config)
+        logger.info("📤 Sending updated config to %s", device_id)
+        return send_command(device_id, command, qos)
+
+def send_reboot_command(device_id, delay, qos=None):
     """Отправка команды на перезагрузку устройства."""
     if device_id in devices:
-        topic = f"wsm/{device_id}/client/reboot/set"
-        payload = json.dumps({"request_id": 234, "delay": delay})
-        print(f"📤 Sending reboot command to {device_id} with delay {delay}")
-        client.publish(topic, payload)
+        command = reboot_command(delay)
+        logger.info("📤 Sending reboot command to %s with delay %s", device_id, delay)
+        return send_command(device_id, command, qos)
 
 def get_device_state(device_id):
     """Получение последнего состояния устройства."""
-    return devices.get(device_id, {}).get("state", {})
+    return devices.read(device_id, "state", {})
 
 def request_display_info(device_id):
     """Запрос информации с дисплея устройства."""
     if device_id in devices:
-        topic = f"wsm/{device_id}/client/display/get"
-        payload = json.dumps({"request_id": 234, "fields": ["line_1", "line_2"]})
-        print(f"📤 Requesting display info for {device_id}...")
-        client.publish(topic, payload)
+        return coalesced_request(device_id, DISPLAY_REQUEST)
 
-def send_qrcode_payment(device_id, order_id, amount):
+def send_qrcode_payment(device_id, order_id, amount, qos=None):
     """Отправка оплаты QR-кодом в устройство."""
     if device_id in devices:
-        topic = f"wsm/{device_id}/client/payment/set"
-        payload = json.dumps({
-            "request_id": 234,
-            "addQRcode": {
-                "order_id": order_id,
-                "amount": amount
-            }
-        })
-        print(f"📤 Sending QR code payment to {device_id}: {amount} kopecks, order_id: {order_id}")
-        client.publish(topic, payload)
-
-def send_free_payment(device_id, amount):
+        command = qrcode_payment_command(order_id, amount)
+        logger.info("📤 Sending QR code payment to %s: %s kopecks, order_id: %s", device_id, amount, order_id)
+        return send_command(device_id, command, qos)
+
+def send_free_payment(device_id, amount, qos=None):
     """Отправка свободного начисления в устройство."""
     if device_id in devices:
-        topic = f"wsm/{device_id}/client/payment/set"
-        payload = json.dumps({
-            "request_id": 234,
-            "addFree": {
-                "amount": amount
-            }
-        })
-        print(f"📤 Sending free payment to {device_id}: {amount} kopecks")
-        client.publish(topic, payload)
-
-def clear_payment(device_id, clear_options=None):
-    """Отправка команды обнуления оплаты."""
+        command = free_payment_command(amount)
+        logger.info("📤 Sending free payment to %s: %s kopecks", device_id, amount)
+        return send_command(device_id, command, qos)
+
+def clear_payment(device_id, clear_options=None, qos=None):
+    """Отправка команды обнуления оплаты (не указанные флаги считаются true)."""
     if device_id in devices:
-        if clear_options is None:
-            clear_options = {
-                "CoinClear": True,
-                "BillClear": True,
-                "PrevClear": True,
-                "FreeClear": True,
-                "QRcodeClear": True,
-                "PayPassClear": True
-            }
-        
-        topic = f"wsm/{device_id}/client/payment/set"
-        payload = json.dumps({
-            "request_id": 234,
-            **clear_options
-        })
-        print(f"📤 Clearing payment for {device_id}")
-        client.publish(topic, payload)
-
-def send_action_command(device_id, pour=None, blocking=None):
+        command = clear_payment_command(clear_options)
+        logger.info("📤 Clearing payment for %s", device_id)
+        return send_command(device_id, command, qos)
+
+def send_action_command(device_id, pour=None, blocking=None, qos=None):
     """Отправка команды действия (пролив воды/блокировка)."""
     if device_id in devices:
-        topic = f"wsm/{device_id}/client/action/set"
-        payload = {"request_id": 234}
-        
-        if pour in ["Start", "Stop"]:
-            payload["Pour"] = pour
-            
-        if blocking is not None:
-            payload["Blocking"] = blocking
-            
-        print(f"📤 Sending action command to {device_id}: {payload}")
-        client.publish(topic, json.dumps(payload))
-
-# Инициализация MQTT-клиента
-client = mqtt.Client()
-client.username_pw_set(Config.MQTT_USERNAME, Config.MQTT_PASSWORD)
-client.on_connect = on_connect
-client.on_message = on_message
-
-# Подключение к брокеру
-try:
-    client.connect(Config.MQTT_BROKER, Config.MQTT_PORT, 60)
-    client.loop_start()
-    print(f"🔌 Connecting to MQTT broker {Config.MQTT_BROKER}:{Config.MQTT_PORT}")
-except Exception as e:
-    print(f"❌ Failed to connect to MQTT broker: {e}")
\ No newline at end of file
+        command = action_command(pour, blocking)
+        logger.info("📤 Sending action command to %s: %s", device_id, command.payload)
+        return send_command(device_id, command, qos)
+
+# Очередь и рабочие потоки обработки входящих сообщений
+ingest_pipeline = IngestPipeline(
+    handle_message,
+    workers=Config.INGEST_WORKERS,
+    queue_size=Config.INGEST_QUEUE_SIZE
+)
+
+# Журнал сообщений в общем хранилище (только в процессе приема)
+shared_log = None
+if Config.PROCESS_ROLE == "ingest":
+    shared_log = SharedLogWriter(Config.SHARED_STATE_PATH, retention=Config.SHARED_LOG_RETENTION)
+
+# Журнал сырых сообщений пишет процесс с подключением к брокеру,
+# читают (выгрузка через API) все процессы
+journal = None
+journal_reader = None
+if Config.JOURNAL_ENABLED:
+    journal_reader = JournalReader(Config.JOURNAL_DIR)
+    if Config.PROCESS_ROLE != "web":
+        journal = JournalWriter(
+            Config.JOURNAL_DIR,
+            segment_bytes=Config.JOURNAL_SEGMENT_BYTES,
+            segment_seconds=Config.JOURNAL_SEGMENT_SECONDS,
+            retention=Config.JOURNAL_RETENTION
+        )
+
+shared_follower = None
+outbox_relay = None
+if Config.PROCESS_ROLE == "web":
+    # Веб-воркер не подключается к брокеру: состояние устройств читается
+    # из общего хранилища, а команды передаются процессу приема
+    client = OutboxPublisher(Config.SHARED_STATE_PATH)
+    shared_follower = SharedLogFollower(
+        Config.SHARED_STATE_PATH,
+        handle_message,
+        poll_interval=Config.SHARED_POLL_INTERVAL_MS / 1000
+    )
+else:
+    # Инициализация MQTT-клиента (подключение - в start_mqtt)
+    client = mqtt.Client()
+    client.username_pw_set(Config.MQTT_USERNAME, Config.MQTT_PASSWORD)
+    client.reconnect_delay_set(Config.MQTT_RECONNECT_MIN_DELAY, Config.MQTT_RECONNECT_MAX_DELAY)
+    client.on_connect = on_connect
+    client.on_message = on_message
+
+    if Config.PROCESS_ROLE == "ingest":
+        # Публикация команд, поставленных веб-воркерами
+        outbox_relay = OutboxRelay(
+            Config.SHARED_STATE_PATH,
+            client.publish,
+            poll_interval=Config.SHARED_POLL_INTERVAL_MS / 1000,
+            max_age=Config.REQUEST_TTL
+        )
+
+# Показатели, вычисляемые при запросе /metrics
+registry.gauge("wsm_devices", "Known devices", lambda: len(devices))
+registry.gauge("wsm_fleet_devices", "Devices by fleet summary status", fleet_summary.counts, "status")
+registry.gauge("wsm_ingest_queue_depth", "Messages waiting in ingest queues",
+               lambda: sum(ingest_pipeline.stats()["queue_depth"]))
+if journal is not None:
+    registry.gauge("wsm_journal_dropped", "Messages not journaled because the journal queue was full",
+                   lambda: journal.dropped)
+registry.gauge("wsm_outbound_commands", "Outbound commands by state",
+               lambda: {key: value for key, value in outbound.stats().items()
+                        if key in ("queued", "in_flight")}, "state")
+
+_started = False
+
+def start_mqtt():
+    """Запуск обработки сообщений и подключения к брокеру.
+
+    Импорт модуля не открывает сетевых соединений и не запускает потоков;
+    это делает create_app() или ingest.py. Подключение выполняется в потоке
+    paho (connect_async), поэтому недоступный брокер не задерживает запуск,
+    а повторные попытки идут с экспоненциальной задержкой.
+    """
+    global _started
+    if _started:
+        return
+    _started = True
+
+    ingest_pipeline.start()
+    liveness.start()
+    if journal is not None:
+        journal.start()
+    if shared_log is not None:
+        shared_log.start()
+    if shared_follower is not None:
+        shared_follower.start()
+        return
+    if outbox_relay is not None:
+        outbox_relay.start()
+
+    # В режиме asyncio подключается asgi.py при запуске цикла событий
+    if Config.MQTT_LOOP != "asyncio":
+        client.connect_async(Config.MQTT_BROKER, Config.MQTT_PORT, 60)
+        client.loop_start()
+        logger.info("🔌 Connecting to MQTT broker %s:%s", Config.MQTT_BROKER, Config.MQTT_PORT)
\ No newline at end of file
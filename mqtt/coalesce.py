@@ -0,0 +1,56 @@
+import threading
+import time
+
+
+class RequestCoalescer:
+    """Объединение одинаковых запросов данных у устройства (client/*/get).
+
+    Пока запрос к устройству ожидает ответа (не дольше in_flight_timeout
+    секунд), новые вызовы получают его request_id без повторной отправки.
+    Ответ, полученный не раньше чем ttl секунд назад, возвращается
+    повторным вызовам как есть. Команды, меняющие данные устройства,
+    сбрасывают кэш через invalidate().
+    """
+
+    def __init__(self, pending_requests, ttl=10, in_flight_timeout=10):
+        self.pending_requests = pending_requests
+        self.ttl = ttl
+        self.in_flight_timeout = in_flight_timeout
+        self._lock = threading.Lock()
+        # (device_id, команда) -> последний отправленный PendingRequest
+        self._latest = {}
+
+    def request(self, device_id, command, publish):
+        """Запрос command у устройства.
+
+        publish(request_id) отправляет сообщение и вызывается только для
+        нового запроса. Возвращает (PendingRequest, объединен ли запрос).
+        """
+        key = (device_id, command)
+        now = time.time()
+        with self._lock:
+            latest = self._latest.get(key)
+            if latest is not None and self._reusable(latest, now):
+                return latest, True
+            request = self.pending_requests.allocate(device_id, command)
+            self._latest[key] = request
+        try:
+            publish(request.request_id)
+        except Exception:
+            self.invalidate(device_id, command)
+            raise
+        return request, False
+
+    def _reusable(self, request, now):
+        if request.done:
+            return now - request.answered_at < self.ttl
+        return now - request.created_at < self.in_flight_timeout
+
+    def invalidate(self, device_id, command=None):
+        """Следующий запрос (или все запросы устройства) будет отправлен заново."""
+        with self._lock:
+            if command is not None:
+                self._latest.pop((device_id, command), None)
+                return
+            for key in [key for key in self._latest if key[0] == device_id]:
+                del self._latest[key]
@@ -0,0 +1,276 @@
+"""Команды сервера контроллеру (client/*) и их схемы.
+
+Схемы составлены по документу «Описание протокола обмена» (разделы 3.2-3.14).
+Полезная нагрузка проверяется и приводится к типам протокола один раз
+в prepare(); результат сериализуется в шаблон, в который при отправке
+подставляется только request_id. Поэтому одна и та же команда для группы
+устройств (или повторная отправка) не требует повторной проверки
+и сериализации.
+"""
+from serializer import dumps
+
+
+class CommandError(ValueError):
+    """Некорректная полезная нагрузка команды."""
+
+
+class Int:
+    """Целое в диапазоне [minimum, maximum]; None и "" заменяются на 0."""
+
+    def __init__(self, minimum, maximum):
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def __call__(self, name, value):
+        if value is None or value == "":
+            value = 0
+        if isinstance(value, bool):
+            raise CommandError(f"{name} must be an integer")
+        if isinstance(value, str):
+            try:
+                value = int(value.strip())
+            except ValueError:
+                raise CommandError(f"{name} must be an integer") from None
+        elif isinstance(value, float):
+            if not value.is_integer():
+                raise CommandError(f"{name} must be an integer")
+            value = int(value)
+        elif not isinstance(value, int):
+            raise CommandError(f"{name} must be an integer")
+        if not self.minimum <= value <= self.maximum:
+            raise CommandError(f"{name} must be between {self.minimum} and {self.maximum}")
+        return value
+
+
+class Str:
+    """Строка не длиннее max_length символов (буфер прошивки char[max_length + 1]); None -> ""."""
+
+    def __init__(self, max_length):
+        self.max_length = max_length
+
+    def __call__(self, name, value):
+        if value is None:
+            return ""
+        if not isinstance(value, str):
+            raise CommandError(f"{name} must be a string")
+        if len(value) > self.max_length:
+            raise CommandError(f"{name} must be at most {self.max_length} characters")
+        return value
+
+
+class Bool:
+    def __call__(self, name, value):
+        if isinstance(value, bool):
+            return value
+        if value in (0, 1):
+            return bool(value)
+        raise CommandError(f"{name} must be true or false")
+
+
+class Choice:
+    def __init__(self, *values):
+        self.values = values
+
+    def __call__(self, name, value):
+        if value not in self.values:
+            raise CommandError(f"{name} must be one of: {', '.join(map(str, self.values))}")
+        return value
+
+
+class IntList:
+    """Список целых (или строка "5,10,20") не длиннее max_length элементов."""
+
+    def __init__(self, max_length, item):
+        self.max_length = max_length
+        self.item = item
+
+    def __call__(self, name, value):
+        if value is None:
+            return []
+        if isinstance(value, str):
+            value = [part.strip() for part in value.split(",") if part.strip()]
+        if not isinstance(value, (list, tuple)):
+            raise CommandError(f"{name} must be a list of integers")
+        if len(value) > self.max_length:
+            raise CommandError(f"{name} must have at most {self.max_length} items")
+        return [self.item(f"{name}[{i}]", item) for i, item in enumerate(value)]
+
+
+class Object:
+    """Вложенный объект со своей схемой."""
+
+    def __init__(self, fields, required=()):
+        self.fields = fields
+        self.required = required
+
+    def __call__(self, name, value):
+        if not isinstance(value, dict):
+            raise CommandError(f"{name} must be an object")
+        return normalize(self.fields, value, self.required, prefix=f"{name}.")
+
+
+UINT8 = Int(0, 0xFF)
+UINT16 = Int(0, 0xFFFF)
+UINT32 = Int(0, 0xFFFFFFFF)
+
+
+def normalize(fields, payload, required=(), prefix=""):
+    """Проверка и приведение полей по схеме. Поля вне схемы отбрасываются."""
+    if not isinstance(payload, dict):
+        raise CommandError("Payload must be an object")
+    for name in required:
+        if payload.get(name) is None:
+            raise CommandError(f"{prefix}{name} is required")
+    return {
+        name: fields[name](prefix + name, value)
+        for name, value in payload.items()
+        if name in fields
+    }
+
+
+class Command:
+    """Команда client/<name>: схема полей и подготовка шаблона сообщения.
+
+    at_least_one - хотя бы одно из перечисленных полей должно присутствовать.
+    """
+
+    def __init__(self, name, fields, required=(), at_least_one=()):
+        self.name = name
+        self.fields = fields
+        self.required = required
+        self.at_least_one = at_least_one
+
+    def prepare(self, payload):
+        """Проверенная и сериализованная команда (PreparedCommand)."""
+        payload = normalize(self.fields, payload, self.required)
+        if self.at_least_one and not any(name in payload for name in self.at_least_one):
+            raise CommandError(f"One of {', '.join(self.at_least_one)} is required")
+        return PreparedCommand(self.name, payload)
+
+
+class PreparedCommand:
+    """Команда, готовая к отправке: JSON без request_id, который подставляется в render()."""
+
+    __slots__ = ("command", "payload", "_head", "_tail")
+
+    def __init__(self, command, payload):
+        self.command = command
+        self.payload = payload
+        body = dumps(payload)
+        self._head = b'{"request_id":'
+        # body начинается с "{": поля команды идут после request_id
+        self._tail = b"}" if body == b"{}" else b"," + body[1:]
+
+    def render(self, request_id):
+        return self._head + str(request_id).encode() + self._tail
+
+    def to_dict(self, request_id):
+        return {"request_id": request_id, **self.payload}
+
+
+# 3.4 Отправка "настроек проекта" (значения в копейках, 0.01 литра, секундах)
+SETTINGS_FIELDS = {
+    "maxPayment": UINT16,
+    "minPayPass": UINT16,
+    "maxPayPass": UINT16,
+    "deltaPayPass": UINT16,
+    "tariffPerLiter_1": UINT16,
+    "tariffPerLiter_2": UINT16,
+    "pulsesPerLiter_1": UINT16,
+    "pulsesPerLiter_2": UINT16,
+    "pulsesPerLiter_3": UINT16,
+    "timeOnePay": UINT16,
+    "litersInFullTank": UINT32,
+    "timeServisMode": UINT16,
+    "spillTimer": UINT16,
+    "spillAmount": UINT16,
+}
+
+# 3.2 Отправка "конфигурации устройства"
+CONFIG_FIELDS = {
+    "pppos_apn": Str(31),
+    "wifi_STA_ssid": Str(31),
+    "wifi_STA_pass": Str(31),
+    "ntp_server": Str(31),
+    "timeZone": Int(-12, 14),
+    "broker_uri": Str(95),
+    "broker_port": UINT32,
+    "broker_user": Str(31),
+    "broker_pass": Str(31),
+    "OTA_server": Str(95),
+    "OTA_port": UINT32,
+    "bill_table": IntList(24, UINT16),
+    "coinValidatorType": Choice("protocol", "impulse"),
+    "coinPulsePrice": UINT8,
+    "coin_table": IntList(16, UINT16),
+}
+
+# 3.12-3.14 Оплата: QR-код, свободное начисление или обнуление
+PAYMENT_CLEAR_FLAGS = ("CoinClear", "BillClear", "PrevClear", "FreeClear", "QRcodeClear", "PayPassClear")
+PAYMENT_FIELDS = {
+    "addQRcode": Object({"order_id": Str(63), "amount": UINT32}, required=("order_id",)),
+    "addFree": Object({"amount": UINT32}),
+    **{flag: Bool() for flag in PAYMENT_CLEAR_FLAGS},
+}
+
+# 3.14 Команда: пролив воды и блокировка. В протоколе указаны "Start" и "Stop";
+# панель управляет двумя кранами раздельно ("Start_1", "Start_2")
+POUR_VALUES = ("Start", "Start_1", "Start_2", "Stop")
+ACTION_FIELDS = {
+    "Pour": Choice(*POUR_VALUES),
+    "Blocking": Bool(),
+}
+
+COMMANDS = {
+    "setting/set": Command("setting/set", SETTINGS_FIELDS),
+    "config/set": Command("config/set", CONFIG_FIELDS),
+    "reboot/set": Command("reboot/set", {"delay": UINT32}, required=("delay",)),
+    "payment/set": Command("payment/set", PAYMENT_FIELDS,
+                           at_least_one=("addQRcode", "addFree") + PAYMENT_CLEAR_FLAGS),
+    "action/set": Command("action/set", ACTION_FIELDS, at_least_one=("Pour", "Blocking")),
+}
+
+# Запросы данных у контроллера (3.3, 3.5, 3.11) не меняются и готовятся один раз
+SETTINGS_REQUEST = PreparedCommand("setting/get", {"fields": []})
+CONFIG_REQUEST = PreparedCommand("config/get", {"fields": []})
+DISPLAY_REQUEST = PreparedCommand("display/get", {"fields": ["line_1", "line_2"]})
+
+
+def prepare(command, payload):
+    """Проверка и подготовка команды client/<command>."""
+    return COMMANDS[command].prepare(payload)
+
+
+def settings_command(settings):
+    return prepare("setting/set", settings)
+
+
+def config_command(config):
+    return prepare("config/set", config)
+
+
+def reboot_command(delay=400):
+    return prepare("reboot/set", {"delay": delay})
+
+
+def qrcode_payment_command(order_id, amount):
+    return prepare("payment/set", {"addQRcode": {"order_id": order_id, "amount": amount}})
+
+
+def free_payment_command(amount):
+    return prepare("payment/set", {"addFree": {"amount": amount}})
+
+
+def clear_payment_command(options=None):
+    """Обнуление оплаты; не указанные флаги считаются true."""
+    options = options or {}
+    return prepare("payment/set", {flag: options.get(flag, True) for flag in PAYMENT_CLEAR_FLAGS})
+
+
+def action_command(pour=None, blocking=None):
+    payload = {}
+    if pour is not None:
+        payload["Pour"] = pour
+    if blocking is not None:
+        payload["Blocking"] = blocking
+    return prepare("action/set", payload)
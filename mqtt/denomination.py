@@ -0,0 +1,107 @@
+import threading
+import time
+from array import array
+
+
+def _amount(value):
+    """Сумма в копейках; некорректные значения считаем нулем."""
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class DenominationBuffer:
+    """Кольцевой буфер принятых номиналов одного устройства.
+
+    Хранит последние `capacity` записей в компактных массивах, которые растут
+    только до заполнения буфера, поэтому объем памяти ограничен (при capacity=0
+    записи не хранятся). Каждой записи присваивается сквозной номер (seq),
+    который служит курсором для постраничной выдачи.
+    Метки времени (время получения сервером) не убывают, что позволяет
+    искать границы диапазона бинарным поиском.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._timestamps = array("d")
+        self._coins = array("q")
+        self._bills = array("q")
+        self._created = []
+        # Общее количество записей, добавленных за все время
+        self._count = 0
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    def append(self, payload, received_at=None):
+        """Добавление записи из сообщения server/denomination/info."""
+        if self.capacity <= 0:
+            return
+        if received_at is None:
+            received_at = time.time()
+        with self._lock:
+            # Время получения не должно убывать, иначе сломается бинарный поиск
+            if self._count:
+                last = self._timestamps[(self._count - 1) % self.capacity]
+                received_at = max(received_at, last)
+            coin = _amount(payload.get("coin"))
+            bill = _amount(payload.get("bill"))
+            created = payload.get("created")
+            if self._count < self.capacity:
+                self._timestamps.append(received_at)
+                self._coins.append(coin)
+                self._bills.append(bill)
+                self._created.append(created)
+            else:
+                i = self._count % self.capacity
+                self._timestamps[i] = received_at
+                self._coins[i] = coin
+                self._bills[i] = bill
+                self._created[i] = created
+            self._count += 1
+
+    def _first_seq(self):
+        return max(0, self._count - self.capacity)
+
+    def _bisect(self, ts):
+        """Первый seq, у которого время получения >= ts."""
+        lo, hi = self._first_seq(), self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._timestamps[mid % self.capacity] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _entry(self, seq):
+        i = seq % self.capacity
+        return {
+            "seq": seq,
+            "created": self._created[i],
+            "coin": self._coins[i],
+            "bill": self._bills[i],
+            "received_at": self._timestamps[i],
+        }
+
+    def query(self, since=None, until=None, cursor=None, limit=100):
+        """Выборка записей по времени получения [since, until) и курсору.
+
+        Возвращает (записи, следующий курсор или None).
+        """
+        with self._lock:
+            start = self._first_seq()
+            end = self._count
+            if cursor is not None:
+                start = max(start, cursor)
+            if since is not None:
+                start = max(start, self._bisect(since))
+            if until is not None:
+                end = min(end, self._bisect(until))
+
+            stop = min(end, start + limit)
+            entries = [self._entry(seq) for seq in range(start, stop)]
+            next_cursor = stop if stop < end else None
+            return entries, next_cursor
@@ -0,0 +1,82 @@
+import queue
+import threading
+from serializer import dumps
+
+# Максимальное количество неотправленных событий на одного подписчика.
+# Медленный клиент не должен задерживать обработку MQTT-сообщений,
+# поэтому при переполнении его очереди лишние события отбрасываются.
+SUBSCRIBER_QUEUE_SIZE = 256
+
+# Интервал отправки keep-alive комментариев в поток (в секундах)
+HEARTBEAT_INTERVAL = 15
+
+
+class EventBus:
+    """Раздача событий устройств подписчикам Server-Sent Events."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # device_id -> множество очередей; None - подписчики на все устройства
+        self._subscribers = {}
+
+    def subscribe(self, device_id=None, q=None):
+        """Регистрирует подписчика и возвращает его очередь.
+
+        Вместо очереди можно передать любой объект с методом put_nowait().
+        """
+        if q is None:
+            q = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(device_id, set()).add(q)
+        return q
+
+    def unsubscribe(self, q, device_id=None):
+        """Удаляет подписчика."""
+        with self._lock:
+            subscribers = self._subscribers.get(device_id)
+            if subscribers is not None:
+                subscribers.discard(q)
+                if not subscribers:
+                    del self._subscribers[device_id]
+
+    def publish(self, device_id, event, data):
+        """Отправка события всем подписчикам устройства и всего парка."""
+        if not self._subscribers:
+            return
+
+        with self._lock:
+            targets = list(self._subscribers.get(device_id, ()))
+            targets.extend(self._subscribers.get(None, ()))
+        if not targets:
+            return
+
+        # Сериализуем один раз для всех подписчиков
+        message = format_event(event, {"device_id": device_id, "data": data})
+        for q in targets:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                pass
+
+    def stream(self, device_id=None):
+        """Генератор SSE-потока для одного HTTP-клиента."""
+        q = self.subscribe(device_id)
+        try:
+            # Сообщаем клиенту интервал переподключения
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    yield q.get(timeout=HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+        finally:
+            self.unsubscribe(q, device_id)
+
+
+def format_event(event, data):
+    """Форматирование события в формате text/event-stream."""
+    return f"event: {event}\ndata: {dumps(data).decode('utf-8')}\n\n"
+
+
+# Общая шина событий приложения
+event_bus = EventBus()
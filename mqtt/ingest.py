@@ -0,0 +1,78 @@
+import logging
+import queue
+import threading
+import time
+from metrics import mqtt_handle_seconds, mqtt_queue_wait_seconds
+
+logger = logging.getLogger(__name__)
+
+
+class IngestPipeline:
+    """Обработка входящих MQTT-сообщений вне сетевого потока paho.
+
+    Callback paho только кладет сырое сообщение (topic, payload, время
+    получения) в ограниченную очередь, а разбор JSON и обновление данных
+    выполняют рабочие потоки. Сообщения одного устройства всегда попадают
+    в одну и ту же очередь, поэтому порядок их обработки сохраняется.
+    """
+
+    def __init__(self, handler, workers=2, queue_size=10000):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(self.workers)]
+        self._threads = []
+        self.received = 0
+        self.dropped = 0
+        # Счетчики ведутся отдельно для каждого потока, чтобы не нужна была блокировка
+        self._processed = [0] * self.workers
+        self._errors = [0] * self.workers
+
+    def start(self):
+        """Запуск рабочих потоков."""
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, args=(i,), name=f"mqtt-ingest-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, topic, payload, received_at=None):
+        """Постановка сообщения в очередь. Возвращает False, если очередь заполнена."""
+        self.received += 1
+        if received_at is None:
+            received_at = time.time()
+        parts = topic.split("/", 2)
+        key = parts[1] if len(parts) > 1 else topic
+        try:
+            self._queues[hash(key) % self.workers].put_nowait((topic, payload, received_at))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _run(self, index):
+        q = self._queues[index]
+        while True:
+            topic, payload, received_at = q.get()
+            started = time.perf_counter()
+            mqtt_queue_wait_seconds.observe(max(0.0, time.time() - received_at))
+            try:
+                self.handler(topic, payload, received_at)
+            except Exception:
+                self._errors[index] += 1
+                logger.exception("❌ Error handling message %s", topic)
+            self._processed[index] += 1
+            mqtt_handle_seconds.observe(time.perf_counter() - started)
+
+    def stats(self):
+        """Состояние очередей и счетчики сообщений."""
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "queue_depth": [q.qsize() for q in self._queues],
+            "received": self.received,
+            "processed": sum(self._processed),
+            "dropped": self.dropped,
+            "errors": sum(self._errors),
+        }
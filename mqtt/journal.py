@@ -0,0 +1,389 @@
+"""Журнал сырых MQTT-сообщений в сегментированных файлах.
+
+Каждое входящее сообщение дописывается в текущий сегмент (NNNNNNNNNNNNN.seg,
+имя - время первой записи в миллисекундах) как запись
+<received_at: double><длина топика: uint16><длина сообщения: uint32><топик><сообщение>.
+Сегмент закрывается по размеру или возрасту; для закрытого сегмента рядом
+пишется индекс (.idx): границы по времени и смещения записей каждого
+устройства. Поэтому выборка по устройству и диапазону времени читает только
+нужные сегменты и записи. Открытый сегмент (без индекса) читается целиком.
+
+Журнал пишет процесс с подключением к брокеру, читать его может любой процесс.
+"""
+import bisect
+import csv
+import io
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from mqtt.router import parse_topic
+from serializer import loads, dumps, DecodeError
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct("<dHI")
+
+SEGMENT_SUFFIX = ".seg"
+INDEX_SUFFIX = ".idx"
+
+# Как часто удалять сегменты старше срока хранения (в секундах)
+TRIM_INTERVAL = 60
+
+# Сколько индексов закрытых сегментов держать в памяти читателя
+INDEX_CACHE_SIZE = 16
+
+# Размер фрагмента потоковой выгрузки (в байтах)
+EXPORT_CHUNK = 65536
+
+
+def segment_name(started_at):
+    return f"{int(started_at * 1000):013d}"
+
+
+def read_records(f, offset=0, end=None):
+    """Последовательное чтение записей файла сегмента с offset.
+
+    Возвращает (смещение, received_at, топик, сообщение). Чтение
+    останавливается на неполной записи (сегмент дописывается или запись
+    оборвана аварийным завершением).
+    """
+    f.seek(offset)
+    while end is None or offset < end:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return
+        received_at, topic_length, payload_length = HEADER.unpack(header)
+        body = f.read(topic_length + payload_length)
+        if len(body) < topic_length + payload_length:
+            return
+        yield offset, received_at, body[:topic_length].decode("utf-8", "replace"), body[topic_length:]
+        offset += HEADER.size + topic_length + payload_length
+
+
+class SegmentIndex:
+    """Индекс сегмента: границы по времени и смещения записей по устройствам."""
+
+    __slots__ = ("start", "end", "count", "size", "devices")
+
+    def __init__(self, start):
+        self.start = start
+        self.end = start
+        self.count = 0
+        self.size = 0
+        # device_id -> (array времен, array смещений)
+        self.devices = {}
+
+    def add(self, offset, received_at, topic, length):
+        parsed = parse_topic(topic)
+        if parsed is not None:
+            entry = self.devices.get(parsed[0])
+            if entry is None:
+                entry = self.devices[parsed[0]] = (array("d"), array("Q"))
+            entry[0].append(received_at)
+            entry[1].append(offset)
+        self.end = max(self.end, received_at)
+        self.count += 1
+        self.size = offset + length
+
+    def to_bytes(self):
+        return dumps({
+            "start": self.start,
+            "end": self.end,
+            "count": self.count,
+            "size": self.size,
+            "devices": {device_id: [times.tolist(), offsets.tolist()]
+                        for device_id, (times, offsets) in self.devices.items()},
+        })
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = loads(data)
+        index = cls(data["start"])
+        index.end = data["end"]
+        index.count = data["count"]
+        index.size = data["size"]
+        index.devices = {device_id: (array("d", times), array("Q", offsets))
+                         for device_id, (times, offsets) in data["devices"].items()}
+        return index
+
+
+def build_index(path, start):
+    """Индекс сегмента по его содержимому (для сегментов без .idx)."""
+    index = SegmentIndex(start)
+    with open(path, "rb") as f:
+        for offset, received_at, topic, payload in read_records(f):
+            index.add(offset, received_at, topic, HEADER.size + len(topic.encode("utf-8")) + len(payload))
+    return index
+
+
+def write_index(path, index):
+    """Атомарная запись индекса: читатель видит либо полный индекс, либо никакого."""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(index.to_bytes())
+    os.replace(tmp, path)
+
+
+class JournalWriter:
+    """Запись входящих сообщений в журнал.
+
+    Как и SharedLogWriter, сообщения пишутся пачками из отдельного потока,
+    чтобы сетевой поток paho не ждал диска. Сегмент закрывается, когда
+    превышает segment_bytes или старше segment_seconds; сегменты старше
+    retention секунд удаляются.
+    """
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024, segment_seconds=3600,
+                 retention=7 * 86400, batch_size=500, flush_interval=0.2, queue_size=10000):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.retention = retention
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._file = None
+        self._path = None
+        self._index = None
+        self._trimmed_at = 0
+        self.dropped = 0
+        self.written = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._recover()
+        self._thread = threading.Thread(target=self._run, name="journal-writer", daemon=True)
+        self._thread.start()
+        logger.info("📼 Message journal: %s", os.path.abspath(self.directory))
+
+    def append(self, topic, payload, received_at):
+        """Постановка сообщения в очередь записи (не блокирует вызывающий поток)."""
+        try:
+            self._queue.put_nowait((topic, payload, received_at))
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self):
+        return {"written": self.written, "dropped": self.dropped, "queue_depth": self._queue.qsize()}
+
+    def _recover(self):
+        """Закрытие сегментов, оставшихся открытыми после предыдущего запуска."""
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(SEGMENT_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            index_path = path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+            if os.path.exists(index_path):
+                continue
+            index = build_index(path, int(name[:-len(SEGMENT_SUFFIX)]) / 1000)
+            # Обрезаем неполную последнюю запись
+            if os.path.getsize(path) > index.size:
+                os.truncate(path, index.size)
+            write_index(index_path, index)
+            logger.info("📼 Recovered journal segment %s (%d messages)", name, index.count)
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=TRIM_INTERVAL)]
+            except queue.Empty:
+                batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while batch and len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            try:
+                if batch:
+                    self._write(batch)
+                    self.written += len(batch)
+                self._trim()
+            except Exception:
+                logger.exception("❌ Failed to write %d messages to journal", len(batch))
+
+    def _write(self, batch):
+        for topic, payload, received_at in batch:
+            if self._file is not None and (
+                    self._index.size >= self.segment_bytes
+                    or received_at - self._index.start >= self.segment_seconds):
+                self._close_segment()
+            if self._file is None:
+                self._open_segment(received_at)
+            encoded = topic.encode("utf-8")
+            record = HEADER.pack(received_at, len(encoded), len(payload)) + encoded + bytes(payload)
+            self._file.write(record)
+            self._index.add(self._index.size, received_at, topic, len(record))
+        self._file.flush()
+
+    def _open_segment(self, started_at):
+        name = segment_name(started_at)
+        self._path = os.path.join(self.directory, name + SEGMENT_SUFFIX)
+        # Имя совпадает с предыдущим сегментом, если он закрыт в ту же миллисекунду
+        while os.path.exists(self._path):
+            started_at += 0.001
+            name = segment_name(started_at)
+            self._path = os.path.join(self.directory, name + SEGMENT_SUFFIX)
+        self._file = open(self._path, "wb")
+        self._index = SegmentIndex(int(name) / 1000)
+
+    def _close_segment(self):
+        self._file.close()
+        write_index(self._path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX, self._index)
+        self._file = self._path = self._index = None
+
+    def _trim(self):
+        """Удаление сегментов, все записи которых старше срока хранения."""
+        now = time.time()
+        if now - self._trimmed_at < TRIM_INTERVAL:
+            return
+        self._trimmed_at = now
+        cutoff = now - self.retention
+        segments = list_segments(self.directory)
+        # Записи сегмента не позже начала следующего сегмента
+        for (start, name), (next_start, _) in zip(segments, segments[1:]):
+            if next_start >= cutoff:
+                break
+            for suffix in (SEGMENT_SUFFIX, INDEX_SUFFIX):
+                try:
+                    os.remove(os.path.join(self.directory, name + suffix))
+                except FileNotFoundError:
+                    pass
+
+
+def list_segments(directory):
+    """Сегменты журнала по возрастанию времени: [(начало, имя без расширения)]."""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(
+        (int(name[:-len(SEGMENT_SUFFIX)]) / 1000, name[:-len(SEGMENT_SUFFIX)])
+        for name in names
+        if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit()
+    )
+
+
+class JournalReader:
+    """Чтение журнала по устройству и диапазону времени без загрузки его в память."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()
+
+    def _load_index(self, name):
+        """Индекс закрытого сегмента или None, если сегмент еще пишется."""
+        with self._lock:
+            index = self._indexes.get(name)
+            if index is not None:
+                self._indexes.move_to_end(name)
+                return index
+        try:
+            with open(os.path.join(self.directory, name + INDEX_SUFFIX), "rb") as f:
+                index = SegmentIndex.from_bytes(f.read())
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self._indexes[name] = index
+            while len(self._indexes) > INDEX_CACHE_SIZE:
+                self._indexes.popitem(last=False)
+        return index
+
+    def read(self, device_id=None, since=None, until=None):
+        """Записи (received_at, топик, сообщение) в диапазоне [since, until).
+
+        device_id=None - сообщения всех устройств (и чужие топики).
+        """
+        segments = list_segments(self.directory)
+        for i, (start, name) in enumerate(segments):
+            if until is not None and start >= until:
+                break
+            if since is not None and i + 1 < len(segments) and segments[i + 1][0] < since:
+                continue
+            path = os.path.join(self.directory, name + SEGMENT_SUFFIX)
+            index = self._load_index(name)
+            try:
+                f = open(path, "rb")
+            except FileNotFoundError:
+                # Сегмент удален по сроку хранения во время чтения
+                continue
+            with f:
+                if index is not None and device_id is not None:
+                    records = self._read_indexed(f, index, device_id, since)
+                else:
+                    records = read_records(f, end=index.size if index is not None else None)
+                for _, received_at, topic, payload in records:
+                    if since is not None and received_at < since:
+                        continue
+                    if until is not None and received_at >= until:
+                        break
+                    if device_id is not None and index is None:
+                        parsed = parse_topic(topic)
+                        if parsed is None or parsed[0] != device_id:
+                            continue
+                    yield received_at, topic, payload
+
+    @staticmethod
+    def _read_indexed(f, index, device_id, since):
+        entry = index.devices.get(device_id)
+        if entry is None:
+            return
+        times, offsets = entry
+        first = bisect.bisect_left(times, since) if since is not None else 0
+        for offset in offsets[first:]:
+            yield from read_records(f, offset, offset + 1)
+
+
+def export_ndjson(records):
+    """Потоковая выгрузка записей журнала в NDJSON (по строке на сообщение).
+
+    Сообщение, которое не разбирается как JSON, выгружается строкой.
+    """
+    chunk = bytearray()
+    for received_at, topic, payload in records:
+        try:
+            message = loads(payload)
+        except DecodeError:
+            message = bytes(payload).decode("utf-8", "replace")
+        chunk += dumps({"received_at": received_at, "topic": topic, "payload": message})
+        chunk += b"\n"
+        if len(chunk) >= EXPORT_CHUNK:
+            yield bytes(chunk)
+            chunk.clear()
+    if chunk:
+        yield bytes(chunk)
+
+
+def export_csv(records):
+    """Потоковая выгрузка записей журнала в CSV (received_at, topic, payload)."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(("received_at", "topic", "payload"))
+    for received_at, topic, payload in records:
+        writer.writerow((f"{received_at:.6f}", topic, bytes(payload).decode("utf-8", "replace")))
+        if buffer.tell() >= EXPORT_CHUNK:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+# Форматы выгрузки: (функция, MIME-тип)
+EXPORT_FORMATS = {
+    "ndjson": (export_ndjson, "application/x-ndjson"),
+    "csv": (export_csv, "text/csv"),
+}
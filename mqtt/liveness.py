@@ -0,0 +1,165 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних переходов в сети/не в сети хранить для API
+TRANSITIONS_MAX = 1000
+
+
+class LivenessTracker:
+    """Отслеживание активности устройств.
+
+    touch() только запоминает время последнего сообщения (O(1)). Для каждого
+    устройства в куче лежит запись со сроком ближайшей проверки; поток
+    проверки достает записи с истекшим сроком и либо переносит срок (если
+    устройство с тех пор присылало сообщения), либо отмечает устройство как
+    не в сети, а после evict_after секунд молчания удаляет его (O(log n)).
+    """
+
+    def __init__(self, offline_after=300, evict_after=0, on_transition=None, on_evict=None):
+        self.offline_after = offline_after
+        self.evict_after = evict_after
+        self.on_transition = on_transition
+        self.on_evict = on_evict
+        self._cond = threading.Condition()
+        self._last_seen = {}
+        self._online = set()
+        # (срок проверки, device_id); записи, срок которых не совпадает
+        # с _deadlines, устарели и пропускаются
+        self._heap = []
+        self._deadlines = {}
+        self._seq = itertools.count(1)
+        self._transitions = deque(maxlen=TRANSITIONS_MAX)
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="liveness-sweeper", daemon=True)
+        self._thread.start()
+
+    def touch(self, device_id, received_at):
+        """Отметка о сообщении от устройства."""
+        with self._cond:
+            if received_at <= self._last_seen.get(device_id, 0):
+                return
+            self._last_seen[device_id] = received_at
+            went_online = (device_id not in self._online
+                           and time.time() - received_at < self.offline_after)
+            if went_online:
+                self._online.add(device_id)
+                transition = self._record(device_id, True, received_at)
+            # Срок проверки переносится только при появлении в сети (в куче
+            # мог лежать более поздний срок удаления); иначе его перенесет поток проверки
+            if went_online or device_id not in self._deadlines:
+                self._schedule(device_id, received_at + self.offline_after)
+        if went_online and self.on_transition is not None:
+            self.on_transition(transition)
+
+    def track(self, device_id, last_seen):
+        """Учет устройства без нового сообщения (например, восстановленного из базы).
+
+        Устройство считается не в сети до первого сообщения.
+        """
+        with self._cond:
+            if device_id in self._last_seen:
+                return
+            self._last_seen[device_id] = last_seen
+            self._schedule(device_id, last_seen + self.offline_after)
+
+    def _schedule(self, device_id, deadline):
+        """Постановка проверки (вызывается под блокировкой)."""
+        self._deadlines[device_id] = deadline
+        heapq.heappush(self._heap, (deadline, device_id))
+        if self._heap[0][1] == device_id:
+            self._cond.notify()
+
+    def _record(self, device_id, online, at):
+        transition = {
+            "seq": next(self._seq),
+            "device_id": device_id,
+            "online": online,
+            "at": at,
+        }
+        self._transitions.append(transition)
+        return transition
+
+    def is_online(self, device_id):
+        return device_id in self._online
+
+    def last_seen(self, device_id):
+        return self._last_seen.get(device_id)
+
+    def status(self, device_id):
+        """Состояние устройства или None, если оно не отслеживается."""
+        with self._cond:
+            if device_id not in self._last_seen:
+                return None
+            return {
+                "device_id": device_id,
+                "online": device_id in self._online,
+                "last_seen": self._last_seen[device_id],
+            }
+
+    def transitions(self, since=0, limit=100):
+        """Переходы с порядковым номером больше since: (список, последний номер)."""
+        with self._cond:
+            items = [t for t in self._transitions if t["seq"] > since][:limit]
+        cursor = items[-1]["seq"] if items else since
+        return items, cursor
+
+    def counts(self):
+        with self._cond:
+            online = len(self._online)
+            return {"online": online, "offline": len(self._last_seen) - online}
+
+    def _run(self):
+        while True:
+            with self._cond:
+                timeout = self._heap[0][0] - time.time() if self._heap else None
+                if timeout is None or timeout > 0:
+                    self._cond.wait(timeout)
+                    continue
+                events = self._sweep(time.time())
+            for kind, payload in events:
+                try:
+                    if kind == "transition" and self.on_transition is not None:
+                        self.on_transition(payload)
+                    elif kind == "evict" and self.on_evict is not None:
+                        self.on_evict(payload)
+                except Exception:
+                    logger.exception("❌ Liveness callback failed for %s", payload)
+
+    def _sweep(self, now):
+        """Обработка записей с истекшим сроком (вызывается под блокировкой)."""
+        events = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, device_id = heapq.heappop(self._heap)
+            if self._deadlines.get(device_id) != deadline:
+                continue
+            del self._deadlines[device_id]
+            last_seen = self._last_seen[device_id]
+
+            if now - last_seen < self.offline_after:
+                # Устройство присылало сообщения - переносим проверку
+                self._schedule(device_id, last_seen + self.offline_after)
+                continue
+
+            if device_id in self._online:
+                self._online.discard(device_id)
+                events.append(("transition", self._record(device_id, False, now)))
+
+            if not self.evict_after:
+                # Без удаления устройство проверяется снова только после нового сообщения
+                continue
+            if now - last_seen >= self.evict_after:
+                del self._last_seen[device_id]
+                events.append(("evict", device_id))
+            else:
+                self._schedule(device_id, last_seen + self.evict_after)
+        return events
@@ -0,0 +1,309 @@
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Команды, которые нельзя повторять без подтверждения: устройство могло
+# выполнить команду, а потерялся только ответ (повторная оплата, перезагрузка).
+# Они отправляются повторно только если сообщение не ушло из клиента
+NON_RETRYABLE = ("payment/set", "reboot/set")
+
+# Сколько последних неудачных команд устройства хранить для API
+FAILED_HISTORY = 20
+
+
+class OutboundQueueFull(Exception):
+    """Очередь команд устройства заполнена."""
+
+
+class OutboundCommand:
+    """Команда в очереди отправки устройству."""
+
+    __slots__ = ("device_id", "command", "request_id", "topic", "payload", "qos", "retry",
+                 "status", "attempts", "created_at", "sent_at", "next_at", "info", "error")
+
+    def __init__(self, device_id, command, request_id, topic, payload, qos):
+        self.device_id = device_id
+        self.command = command
+        self.request_id = request_id
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retry = command not in NON_RETRYABLE
+        # queued -> sending -> sent -> acked / failed
+        self.status = "queued"
+        self.attempts = 0
+        self.created_at = time.time()
+        self.sent_at = None
+        # Когда можно отправить (queued) или когда истекает ожидание ответа (sent)
+        self.next_at = 0
+        # MQTTMessageInfo последней отправки (None для общего хранилища)
+        self.info = None
+        self.error = None
+
+    def to_dict(self):
+        return {
+            "request_id": self.request_id,
+            "command": self.command,
+            "qos": self.qos,
+            "status": self.status,
+            "attempts": self.attempts,
+            "created_at": self.created_at,
+            "sent_at": self.sent_at,
+            # Для QoS 1/2 - получено ли подтверждение брокера (PUBACK/PUBCOMP)
+            "published": self.info.is_published() if self.info is not None else None,
+            "error": self.error,
+        }
+
+
+class _DeviceQueue:
+    __slots__ = ("queued", "in_flight", "tokens", "refilled_at", "failed_recent",
+                 "sent", "acked", "failed", "retries", "rejected")
+
+    def __init__(self, burst):
+        self.queued = deque()
+        # request_id -> OutboundCommand, отправленные и ожидающие ответа
+        self.in_flight = {}
+        self.tokens = burst
+        self.refilled_at = time.monotonic()
+        self.failed_recent = deque(maxlen=FAILED_HISTORY)
+        self.sent = 0
+        self.acked = 0
+        self.failed = 0
+        self.retries = 0
+        self.rejected = 0
+
+
+class OutboundQueue:
+    """Очереди команд устройствам с повторной отправкой и ограничением скорости.
+
+    Для каждого устройства: не больше queue_size команд в очереди (иначе
+    OutboundQueueFull), не больше max_in_flight команд без ответа и не
+    чаще rate команд в секунду (с запасом burst; rate=0 - без ограничения).
+    Команда без ответа устройства отправляется повторно с тем же request_id через retry_timeout,
+    2 * retry_timeout, ... (не больше retry_max_delay), всего до max_attempts раз.
+    Если сообщение не удалось передать клиенту MQTT (нет соединения),
+    повторяется любая команда.
+
+    Пока очередь устройства пуста и лимиты позволяют, команда отправляется
+    сразу в вызывающем потоке; остальное отправляет поток очереди.
+    """
+
+    def __init__(self, publish, qos=1, rate=5.0, burst=10, max_in_flight=4, queue_size=50,
+                 retry_timeout=10.0, retry_max_delay=60.0, max_attempts=3):
+        self.publish = publish
+        self.qos = qos
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.queue_size = queue_size
+        self.retry_timeout = retry_timeout
+        self.retry_max_delay = retry_max_delay
+        self.max_attempts = max_attempts
+        self._cond = threading.Condition()
+        self._queues = {}
+        # Устройства с командами в очереди или без ответа
+        self._active = set()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="outbound-queue", daemon=True)
+            self._thread.start()
+
+    def submit(self, device_id, command, request_id, topic, payload, qos=None):
+        """Постановка команды в очередь устройства. Возвращает OutboundCommand."""
+        self.start()
+        cmd = OutboundCommand(device_id, command, request_id, topic, payload,
+                              self.qos if qos is None else qos)
+        with self._cond:
+            queue = self._queues.get(device_id)
+            if queue is None:
+                queue = self._queues[device_id] = _DeviceQueue(self.burst)
+            if len(queue.queued) >= self.queue_size:
+                queue.rejected += 1
+                raise OutboundQueueFull(f"Command queue for {device_id} is full")
+            self._active.add(device_id)
+            send_now = not queue.queued and self._can_send(queue, time.monotonic())
+            if send_now:
+                self._take(queue, cmd)
+            else:
+                queue.queued.append(cmd)
+                self._cond.notify()
+        if send_now:
+            self._send(cmd)
+        return cmd
+
+    def acknowledged(self, device_id, request_id):
+        """Ответ устройства на команду: команда снимается с ожидания."""
+        with self._cond:
+            queue = self._queues.get(device_id)
+            cmd = queue.in_flight.pop(request_id, None) if queue is not None else None
+            if cmd is None:
+                return
+            cmd.status = "acked"
+            queue.acked += 1
+            if queue.queued:
+                self._cond.notify()
+
+    def remove(self, device_id):
+        """Удаление очереди устройства (например, при удалении устройства)."""
+        with self._cond:
+            self._queues.pop(device_id, None)
+            self._active.discard(device_id)
+
+    def stats(self, device_id=None):
+        """Состояние очереди устройства (или None) либо сводка по всем устройствам."""
+        with self._cond:
+            if device_id is not None:
+                queue = self._queues.get(device_id)
+                if queue is None:
+                    return None
+                return {
+                    "device_id": device_id,
+                    "queued": [cmd.to_dict() for cmd in queue.queued],
+                    "in_flight": [cmd.to_dict() for cmd in queue.in_flight.values()],
+                    "failed_recent": list(queue.failed_recent),
+                    **self._counters(queue),
+                }
+            totals = {"devices": len(self._queues), "active": len(self._active),
+                      "queued": 0, "in_flight": 0, "sent": 0, "acked": 0,
+                      "failed": 0, "retries": 0, "rejected": 0}
+            for queue in self._queues.values():
+                totals["queued"] += len(queue.queued)
+                totals["in_flight"] += len(queue.in_flight)
+                for name, value in self._counters(queue).items():
+                    totals[name] += value
+            return totals
+
+    @staticmethod
+    def _counters(queue):
+        return {"sent": queue.sent, "acked": queue.acked, "failed": queue.failed,
+                "retries": queue.retries, "rejected": queue.rejected}
+
+    def _refill(self, queue, now):
+        queue.tokens = min(self.burst, queue.tokens + (now - queue.refilled_at) * self.rate)
+        queue.refilled_at = now
+
+    def _can_send(self, queue, now):
+        """Можно ли отправить следующую команду (вызывается под блокировкой)."""
+        if len(queue.in_flight) >= self.max_in_flight:
+            return False
+        if self.rate <= 0:
+            return True
+        self._refill(queue, now)
+        return queue.tokens >= 1
+
+    def _take(self, queue, cmd):
+        """Перевод команды в отправку (вызывается под блокировкой)."""
+        queue.tokens -= 1
+        queue.in_flight[cmd.request_id] = cmd
+        cmd.attempts += 1
+        if cmd.attempts > 1:
+            queue.retries += 1
+        cmd.status = "sending"
+
+    def _retry_delay(self, attempts):
+        return min(self.retry_timeout * 2 ** (attempts - 1), self.retry_max_delay)
+
+    def _send(self, cmd):
+        """Передача команды клиенту MQTT (без блокировки очереди)."""
+        try:
+            info = self.publish(cmd.topic, cmd.payload, cmd.qos)
+            rc = getattr(info, "rc", 0)
+            error = None if rc == 0 else f"publish failed with rc={rc}"
+        except Exception as e:
+            info, error = None, str(e)
+
+        with self._cond:
+            queue = self._queues.get(cmd.device_id)
+            if queue is None:
+                return
+            if error is None:
+                cmd.info = info
+                cmd.sent_at = time.time()
+                queue.sent += 1
+                # Ответ устройства мог прийти раньше, чем завершилась отправка
+                if cmd.status == "sending":
+                    cmd.status = "sent"
+                    cmd.next_at = time.monotonic() + self._retry_delay(cmd.attempts)
+                return
+            # Сообщение не ушло из клиента - повторяем любую команду
+            queue.in_flight.pop(cmd.request_id, None)
+            cmd.error = error
+            if cmd.attempts >= self.max_attempts:
+                self._fail(queue, cmd)
+            else:
+                logger.warning("⚠️ Failed to publish %s to %s (%s), will retry",
+                               cmd.command, cmd.device_id, error)
+                cmd.status = "queued"
+                cmd.next_at = time.monotonic() + self._retry_delay(cmd.attempts)
+                queue.queued.appendleft(cmd)
+            self._cond.notify()
+
+    def _fail(self, queue, cmd):
+        """Команда окончательно не доставлена (вызывается под блокировкой)."""
+        cmd.status = "failed"
+        queue.failed += 1
+        queue.failed_recent.append(cmd.to_dict())
+        logger.warning("❌ Command %s (request %s) to %s failed after %d attempts: %s",
+                       cmd.command, cmd.request_id, cmd.device_id, cmd.attempts, cmd.error)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                sends, timeout = self._dispatch(time.monotonic())
+                if not sends:
+                    self._cond.wait(timeout)
+                    continue
+            for cmd in sends:
+                self._send(cmd)
+
+    def _dispatch(self, now):
+        """Повторы по таймауту и отправка из очередей (вызывается под блокировкой).
+
+        Возвращает (команды для отправки, время до следующей проверки).
+        """
+        sends = []
+        wake = None
+        for device_id in list(self._active):
+            queue = self._queues[device_id]
+
+            for cmd in list(queue.in_flight.values()):
+                if cmd.status != "sent":
+                    continue
+                if now < cmd.next_at:
+                    wake = cmd.next_at if wake is None else min(wake, cmd.next_at)
+                    continue
+                # Ответ не пришел вовремя
+                del queue.in_flight[cmd.request_id]
+                cmd.error = "no response from device"
+                if cmd.retry and cmd.attempts < self.max_attempts:
+                    cmd.status = "queued"
+                    cmd.next_at = 0
+                    queue.queued.appendleft(cmd)
+                else:
+                    self._fail(queue, cmd)
+
+            while queue.queued and queue.queued[0].next_at <= now and self._can_send(queue, now):
+                cmd = queue.queued.popleft()
+                self._take(queue, cmd)
+                sends.append(cmd)
+
+            if queue.queued and len(queue.in_flight) < self.max_in_flight:
+                # Ждем пополнения лимита или срока повторной отправки
+                ready = queue.queued[0].next_at
+                if self.rate > 0:
+                    ready = max(ready, now + (1 - queue.tokens) / self.rate)
+                wake = ready if wake is None else min(wake, ready)
+            if not queue.queued and not queue.in_flight:
+                self._active.discard(device_id)
+
+        timeout = None if wake is None else max(0.001, wake - now)
+        return sends, timeout
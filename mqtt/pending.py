@@ -0,0 +1,114 @@
+import random
+import threading
+import time
+from collections import OrderedDict
+
+# Прошивка хранит request_id в 16-битном поле, поэтому идентификаторы
+# выделяются по кругу в диапазоне 1..REQUEST_ID_MAX
+REQUEST_ID_MAX = 0xFFFF
+
+# Топик ответа для каждой команды (client/<command> -> server/<ответ>)
+RESPONSE_TOPICS = {
+    "setting/get": "setting",
+    "setting/set": "setting/ack",
+    "config/get": "config",
+    "config/set": "config/ack",
+    "reboot/set": "reboot/ack",
+    "display/get": "display",
+    "payment/set": "payment/ack",
+    "action/set": "action/ack",
+}
+
+
+class PendingRequest:
+    """Команда, отправленная в устройство и ожидающая ответа."""
+
+    __slots__ = ("request_id", "device_id", "command", "created_at",
+                 "answered_at", "response", "_event")
+
+    def __init__(self, request_id, device_id, command):
+        self.request_id = request_id
+        self.device_id = device_id
+        self.command = command
+        self.created_at = time.time()
+        self.answered_at = None
+        self.response = None
+        self._event = threading.Event()
+
+    @property
+    def done(self):
+        return self._event.is_set()
+
+    def wait(self, timeout):
+        """Ожидание ответа устройства. Возвращает ответ или None по таймауту."""
+        if self._event.wait(timeout):
+            return self.response
+        return None
+
+    def to_dict(self):
+        return {
+            "request_id": self.request_id,
+            "device_id": self.device_id,
+            "command": self.command,
+            "status": "done" if self.done else "pending",
+            "created_at": self.created_at,
+            "answered_at": self.answered_at,
+            "response": self.response,
+        }
+
+
+class PendingRequests:
+    """Реестр команд: выдает уникальные request_id и сопоставляет им ответы."""
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # request_id -> PendingRequest в порядке создания
+        self._requests = OrderedDict()
+        # Случайное начало, чтобы веб-воркеры общего хранилища не выдавали
+        # одинаковые идентификаторы одному устройству
+        self._last_id = random.randrange(REQUEST_ID_MAX)
+
+    def allocate(self, device_id, command):
+        """Регистрирует новую команду и выдает для нее request_id."""
+        with self._lock:
+            self._expire()
+            request_id = self._last_id
+            # Пропускаем идентификаторы, которые еще заняты
+            for _ in range(REQUEST_ID_MAX):
+                request_id = request_id % REQUEST_ID_MAX + 1
+                if request_id not in self._requests:
+                    break
+            else:
+                # Все идентификаторы заняты - вытесняем самую старую команду
+                request_id, _ = self._requests.popitem(last=False)
+            self._last_id = request_id
+            request = PendingRequest(request_id, device_id, command)
+            self._requests[request_id] = request
+            return request
+
+    def resolve(self, device_id, response_topic, request_id, response):
+        """Сопоставляет ответ устройства с командой. Возвращает команду или None."""
+        with self._lock:
+            request = self._requests.get(request_id)
+            if request is None or request.device_id != device_id or request.done:
+                return None
+            if RESPONSE_TOPICS.get(request.command) != response_topic:
+                return None
+            request.response = response
+            request.answered_at = time.time()
+            request._event.set()
+            return request
+
+    def get(self, request_id):
+        with self._lock:
+            return self._requests.get(request_id)
+
+    def _expire(self):
+        """Удаляет устаревшие команды (вызывается под блокировкой)."""
+        deadline = time.time() - self.ttl
+        while self._requests:
+            request = next(iter(self._requests.values()))
+            if request.created_at >= deadline:
+                break
+            self._requests.popitem(last=False)
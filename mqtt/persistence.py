@@ -0,0 +1,350 @@
+import logging
+import queue
+import threading
+import time
+from datetime import date
+from config import Config
+from serializer import DecodeError, dumps, loads
+from mqtt.rollups import PERSISTED_RESOLUTIONS, format_bucket
+from models import db, DeviceSnapshot, RollupBucket, TelemetryRecord
+
+logger = logging.getLogger(__name__)
+
+# Разделы устройства, последнее значение которых сохраняется как снимок
+SNAPSHOT_SLOTS = ("state", "settings", "config", "display")
+
+# Как часто удалять историю старше срока хранения (в секундах)
+TRIM_INTERVAL = 60
+
+
+class TelemetryWriter:
+    """Отложенная запись сообщений устройств в базу данных.
+
+    MQTT-поток только кладет сообщение в очередь; отдельный поток собирает
+    их в пачки (по размеру или по времени) и записывает одной транзакцией.
+    Записи старше retention секунд удаляются (0 - хранить все).
+    """
+
+    def __init__(self, batch_size=500, flush_interval=1.0, queue_size=10000, retention=0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention = retention
+        self._trimmed_at = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._app = None
+        self._thread = None
+        self.dropped = 0
+        self.written = 0
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, app):
+        """Запуск потока записи (требуется контекст Flask-приложения)."""
+        if self._thread is not None:
+            return
+        self._app = app
+        self._thread = threading.Thread(target=self._run, name="telemetry-writer", daemon=True)
+        self._thread.start()
+
+    def record(self, device_id, kind, payload, received_at=None, snapshot=None):
+        """Постановка сообщения в очередь записи (не блокирует вызывающий поток).
+
+        snapshot - (раздел, полное значение) для снимка, если в историю
+        записываются только изменения раздела.
+        """
+        if self._thread is None:
+            return
+        if received_at is None:
+            received_at = time.time()
+        try:
+            self._queue.put_nowait((device_id, kind, payload, received_at, snapshot))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            try:
+                with self._app.app_context():
+                    self._write(batch)
+                self.written += len(batch)
+            except Exception:
+                logger.exception("❌ Failed to persist %d telemetry records", len(batch))
+
+            try:
+                with self._app.app_context():
+                    self._trim()
+            except Exception:
+                logger.exception("❌ Failed to trim telemetry history")
+
+    def _write(self, batch):
+        """Запись пачки сообщений одной транзакцией."""
+        records = []
+        snapshots = {}
+        for device_id, kind, payload, received_at, snapshot in batch:
+            data = dumps(payload).decode()
+            records.append({
+                "device_id": device_id,
+                "kind": kind,
+                "payload": data,
+                "received_at": received_at,
+            })
+            if snapshot is None and kind in SNAPSHOT_SLOTS:
+                snapshot = (kind, payload)
+            if snapshot is not None:
+                # В снимок попадает только последнее значение из пачки
+                slot, value = snapshot
+                snapshots[(device_id, slot)] = {
+                    "device_id": device_id,
+                    "slot": slot,
+                    "payload": value,
+                    "updated_at": received_at,
+                }
+
+        for row in snapshots.values():
+            row["payload"] = dumps(row["payload"]).decode()
+
+        try:
+            db.session.bulk_insert_mappings(TelemetryRecord, records)
+            if snapshots:
+                device_ids = {device_id for device_id, _ in snapshots}
+                existing = set(
+                    db.session.query(DeviceSnapshot.device_id, DeviceSnapshot.slot)
+                    .filter(DeviceSnapshot.device_id.in_(device_ids))
+                    .all()
+                )
+                db.session.bulk_update_mappings(
+                    DeviceSnapshot, [row for key, row in snapshots.items() if key in existing]
+                )
+                db.session.bulk_insert_mappings(
+                    DeviceSnapshot, [row for key, row in snapshots.items() if key not in existing]
+                )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def _trim(self):
+        """Удаление истории старше срока хранения (не чаще раза в TRIM_INTERVAL секунд)."""
+        now = time.time()
+        if not self.retention or now - self._trimmed_at < TRIM_INTERVAL:
+            return
+        self._trimmed_at = now
+        try:
+            TelemetryRecord.query.filter(
+                TelemetryRecord.received_at < now - self.retention
+            ).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+
+class RollupWriter:
+    """Периодическое сохранение измененных часовых и суточных агрегатов.
+
+    Корзина сохраняется целиком (а не приращением), поэтому повторная запись
+    той же корзины безопасна. Корзины старше срока хранения удаляются.
+    """
+
+    def __init__(self, interval=60.0):
+        self.interval = interval
+        self._app = None
+        self._registry = None
+        self._thread = None
+        self.written = 0
+
+    def start(self, app, registry):
+        """Запуск потока записи агрегатов устройств из реестра registry."""
+        if self._thread is not None:
+            return
+        self._app = app
+        self._registry = registry
+        self._thread = threading.Thread(target=self._run, name="rollup-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("❌ Failed to persist rollups")
+
+    def flush(self):
+        rows = {}
+        for device_id in self._registry.ids():
+            record = self._registry.get(device_id)
+            if record is None:
+                continue
+            for resolution, start, values in record.rollups.drain_dirty():
+                rows[(device_id, resolution, start)] = {
+                    "device_id": device_id,
+                    "resolution": resolution,
+                    "start": start,
+                    "payload": dumps(values).decode(),
+                }
+        with self._app.app_context():
+            try:
+                if rows:
+                    self._upsert(rows)
+                self._trim()
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+        self.written += len(rows)
+
+    def _upsert(self, rows):
+        device_ids = {device_id for device_id, _, _ in rows}
+        first = min(start for _, _, start in rows)
+        existing = set(
+            db.session.query(RollupBucket.device_id, RollupBucket.resolution, RollupBucket.start)
+            .filter(RollupBucket.device_id.in_(device_ids), RollupBucket.start >= first)
+            .all()
+        )
+        db.session.bulk_update_mappings(
+            RollupBucket, [row for key, row in rows.items() if key in existing]
+        )
+        db.session.bulk_insert_mappings(
+            RollupBucket, [row for key, row in rows.items() if key not in existing]
+        )
+
+    def _trim(self):
+        now = time.time()
+        for resolution, (width, capacity) in rollup_retention(self._registry).items():
+            RollupBucket.query.filter(
+                RollupBucket.resolution == resolution,
+                RollupBucket.start < now - width * capacity
+            ).delete(synchronize_session=False)
+
+
+def rollup_retention(registry):
+    """{разрешение: (ширина корзины, число корзин)} для сохраняемых агрегатов."""
+    return {
+        name: (width, capacity)
+        for name, width, capacity in registry.rollup_resolutions
+        if name in PERSISTED_RESOLUTIONS
+    }
+
+
+def load_rollups(registry):
+    """Загрузка сохраненных агрегатов в пределах срока хранения.
+
+    Возвращает [(device_id, разрешение, начало, значения)] по возрастанию начала.
+    """
+    now = time.time()
+    rows = []
+    for resolution, (width, capacity) in rollup_retention(registry).items():
+        query = (
+            RollupBucket.query
+            .filter(RollupBucket.resolution == resolution,
+                    RollupBucket.start >= now - width * capacity)
+            .order_by(RollupBucket.start)
+        )
+        for row in query:
+            try:
+                values = loads(row.payload)
+            except DecodeError:
+                continue
+            rows.append((row.device_id, resolution, row.start, values))
+    return rows
+
+
+def query_rollups(device_id, resolution, width, since=None, until=None):
+    """Сохраненные корзины устройства, начало которых попадает в [since, until).
+
+    Формат как у DeviceRollups.query; используется веб-воркером, в памяти
+    которого только корзины из журнала общего хранилища.
+    """
+    query = RollupBucket.query.filter_by(device_id=device_id, resolution=resolution)
+    if since is not None:
+        query = query.filter(RollupBucket.start >= int(since // width) * width)
+    if until is not None:
+        query = query.filter(RollupBucket.start < until)
+    buckets = []
+    for row in query.order_by(RollupBucket.start):
+        try:
+            values = loads(row.payload)
+        except DecodeError:
+            continue
+        buckets.append(format_bucket(row.start, values))
+    return buckets
+
+
+def load_denominations(device_ids, capacity, before=None):
+    """Сохраненные платежи для восстановления истории номиналов и выручки за сутки.
+
+    По каждому устройству загружаются последние capacity записей и все записи
+    за текущие сутки, принятые раньше before. Возвращает
+    [(device_id, payload, время получения)] по возрастанию времени для каждого устройства.
+    """
+    today = time.mktime(date.today().timetuple())
+    rows = []
+    for device_id in device_ids:
+        query = TelemetryRecord.query.filter_by(device_id=device_id, kind="denomination")
+        if before is not None:
+            query = query.filter(TelemetryRecord.received_at < before)
+        # Время capacity-й с конца записи: все более ранние вытеснены из буфера
+        oldest = (
+            query.with_entities(TelemetryRecord.received_at)
+            .order_by(TelemetryRecord.received_at.desc())
+            .offset(max(capacity, 1) - 1)
+            .limit(1)
+            .scalar()
+        )
+        if oldest is not None:
+            query = query.filter(TelemetryRecord.received_at >= min(oldest, today))
+        for row in query.order_by(TelemetryRecord.received_at, TelemetryRecord.id):
+            try:
+                payload = loads(row.payload)
+            except DecodeError:
+                continue
+            rows.append((device_id, payload, row.received_at))
+    return rows
+
+
+def load_snapshots():
+    """Загрузка последних снимков устройств: {device_id: {slot: payload}}."""
+    snapshots = {}
+    for row in DeviceSnapshot.query.all():
+        try:
+            payload = loads(row.payload)
+        except DecodeError:
+            continue
+        snapshots.setdefault(row.device_id, {})[row.slot] = payload
+    return snapshots
+
+
+def load_last_seen():
+    """Время последнего сохраненного снимка по устройствам: {device_id: время}."""
+    rows = (
+        db.session.query(DeviceSnapshot.device_id, db.func.max(DeviceSnapshot.updated_at))
+        .group_by(DeviceSnapshot.device_id)
+        .all()
+    )
+    return dict(rows)
+
+
+# Общий объект записи телеметрии (запускается при старте приложения в app.py)
+telemetry_writer = TelemetryWriter(
+    batch_size=Config.PERSIST_BATCH_SIZE,
+    flush_interval=Config.PERSIST_FLUSH_INTERVAL_MS / 1000,
+    queue_size=Config.PERSIST_QUEUE_SIZE,
+    retention=Config.TELEMETRY_RETENTION
+)
+
+# Общий объект записи агрегатов (запускается вместе с записью телеметрии)
+rollup_writer = RollupWriter(interval=Config.ROLLUP_FLUSH_INTERVAL)
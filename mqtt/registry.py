@@ -0,0 +1,164 @@
+import threading
+from mqtt.denomination import DenominationBuffer
+from mqtt.rollups import DEFAULT_RESOLUTIONS, DeviceRollups
+from mqtt.snapshots import SlotSnapshots
+from mqtt.state_history import StateChangeLog, diff_state, state_metadata
+
+# Разделы устройства, которые заменяются целиком при получении сообщения
+SLOTS = (
+    "settings",
+    "config",
+    "state",
+    "display",
+    "reboot_ack",
+    "setting_ack",
+    "config_ack",
+    "payment_ack",
+    "action_ack",
+)
+
+# Начальные значения разделов (словарь или None)
+_EMPTY_DICT_SLOTS = ("settings", "config", "state")
+
+
+class DeviceRecord:
+    """Данные одного устройства.
+
+    Значения разделов не изменяются на месте: при обновлении раздел
+    заменяется новым объектом (copy-on-write), поэтому читатель всегда
+    получает целостный снимок без блокировки на время его обработки.
+    """
+
+    __slots__ = SLOTS + ("device_id", "denomination", "state_changes", "rollups", "snapshots", "lock")
+
+    def __init__(self, device_id, denomination_capacity, state_history_size, rollup_resolutions):
+        self.device_id = device_id
+        for slot in SLOTS:
+            setattr(self, slot, {} if slot in _EMPTY_DICT_SLOTS else None)
+        self.denomination = DenominationBuffer(denomination_capacity)
+        self.rollups = DeviceRollups(rollup_resolutions)
+        self.snapshots = SlotSnapshots()
+        self.state_changes = StateChangeLog(state_history_size, self.snapshots.version("state"))
+        self.lock = threading.Lock()
+
+
+class DeviceRegistry:
+    """Потокобезопасный реестр устройств.
+
+    Записи создаются под общей блокировкой, а разделы устройства
+    изменяются под блокировкой самого устройства, поэтому обработка
+    сообщений разных устройств не мешает друг другу.
+    """
+
+    def __init__(self, denomination_capacity=10000, state_history_size=100,
+                 rollup_resolutions=DEFAULT_RESOLUTIONS):
+        self.denomination_capacity = denomination_capacity
+        self.state_history_size = state_history_size
+        self.rollup_resolutions = rollup_resolutions
+        self._lock = threading.Lock()
+        self._devices = {}
+
+    def __contains__(self, device_id):
+        return device_id in self._devices
+
+    def __len__(self):
+        return len(self._devices)
+
+    def ids(self):
+        """Список идентификаторов устройств."""
+        return list(self._devices)
+
+    def get(self, device_id):
+        """Запись устройства или None."""
+        return self._devices.get(device_id)
+
+    def get_or_create(self, device_id):
+        """Возвращает (запись, создана ли она только что)."""
+        record = self._devices.get(device_id)
+        if record is not None:
+            return record, False
+        with self._lock:
+            record = self._devices.get(device_id)
+            if record is not None:
+                return record, False
+            record = DeviceRecord(device_id, self.denomination_capacity,
+                                  self.state_history_size, self.rollup_resolutions)
+            self._devices[device_id] = record
+            return record, True
+
+    def remove(self, device_id):
+        with self._lock:
+            return self._devices.pop(device_id, None)
+
+    def read(self, device_id, slot, default=None):
+        """Текущее значение раздела устройства."""
+        record = self._devices.get(device_id)
+        if record is None:
+            return default
+        return getattr(record, slot)
+
+    def set(self, device_id, slot, value):
+        """Замена раздела устройства с увеличением его версии."""
+        record = self._devices.get(device_id)
+        if record is None:
+            return False
+        with record.lock:
+            setattr(record, slot, value)
+            version = record.snapshots.bump(slot)
+            if slot == "state":
+                record.state_changes.reset(version)
+        return True
+
+    def apply_state(self, device_id, state, received_at):
+        """Замена состояния устройства с записью изменившихся полей в историю.
+
+        Возвращает (версия, измененные поля, удаленные поля) или None, если
+        устройства нет или состояние не изменилось (версия при этом не растет).
+        Сообщение, в котором изменились только METADATA_FIELDS, не меняет
+        ни состояние, ни версию.
+        """
+        record = self._devices.get(device_id)
+        if record is None:
+            return None
+        with record.lock:
+            changes, removed = diff_state(record.state, state)
+            if not changes and not removed:
+                return None
+            record.state = state
+            version = record.snapshots.bump("state")
+            record.state_changes.append(version, received_at, changes, removed, state_metadata(state))
+        return version, changes, removed
+
+    def state_changes(self, device_id, since, limit):
+        """Изменения состояния после версии since.
+
+        Возвращает (текущая версия, изменения или None, если история с этой
+        версии неполна, текущее состояние) или None, если устройства нет.
+        """
+        record = self._devices.get(device_id)
+        if record is None:
+            return None
+        with record.lock:
+            return (record.snapshots.version("state"),
+                    record.state_changes.since(since, limit),
+                    record.state)
+
+    def update(self, device_id, slot, **fields):
+        """Замена раздела копией с измененными полями (copy-on-write)."""
+        record = self._devices.get(device_id)
+        if record is None:
+            return False
+        with record.lock:
+            value = dict(getattr(record, slot) or {})
+            value.update(fields)
+            setattr(record, slot, value)
+            record.snapshots.bump(slot)
+        return True
+
+    def serialized(self, device_id, slot):
+        """(etag, JSON-байты) раздела устройства или None, если устройства нет."""
+        record = self._devices.get(device_id)
+        if record is None:
+            return None
+        with record.lock:
+            return record.snapshots.serialized(slot, record)
@@ -0,0 +1,249 @@
+import math
+import threading
+from array import array
+
+# Поля корзины: число сообщений state/info (и из них с ошибками или в режиме
+# BLOCK), минимум и максимум воды в баке, выданная вода (сумма уменьшений
+# litersInTank между соседними сообщениями), число платежей и их суммы
+FIELDS = (
+    "samples",
+    "error_samples",
+    "blocked_samples",
+    "liters_min",
+    "liters_max",
+    "liters_dispensed",
+    "payments",
+    "coins",
+    "bills",
+)
+_WIDTH = len(FIELDS)
+(_SAMPLES, _ERROR_SAMPLES, _BLOCKED_SAMPLES, _LITERS_MIN, _LITERS_MAX,
+ _LITERS_DISPENSED, _PAYMENTS, _COINS, _BILLS) = range(_WIDTH)
+_EMPTY = array("d", [0, 0, 0, math.inf, -math.inf, 0, 0, 0, 0])
+# Поля, которые хранятся как числа с плавающей точкой, но выдаются целыми
+_INT_FIELDS = {"samples", "error_samples", "blocked_samples", "payments", "coins", "bills"}
+
+# Разрешения по умолчанию: (название, ширина корзины в секундах, число корзин)
+DEFAULT_RESOLUTIONS = (
+    ("minute", 60, 360),
+    ("hour", 3600, 744),
+    ("day", 86400, 400),
+)
+
+# Разрешения, корзины которых сохраняются в базу (минутные только в памяти)
+PERSISTED_RESOLUTIONS = ("hour", "day")
+
+
+def _number(value):
+    """Число из поля сообщения или None."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return value
+
+
+def _amount(value):
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def format_bucket(start, values):
+    """Корзина для выдачи: начало и поля (None вместо незаданных минимума и максимума)."""
+    bucket = {"start": start}
+    for name, value in zip(FIELDS, values):
+        if value is None or math.isinf(value):
+            value = None
+        elif name in _INT_FIELDS:
+            value = int(value)
+        bucket[name] = value
+    return bucket
+
+
+class RollupSeries:
+    """Кольцевой буфер корзин одного разрешения.
+
+    Начала корзин и значения полей хранятся в компактных массивах, которые
+    растут только до заполнения буфера. Корзины идут по возрастанию времени
+    (сообщения одного устройства обрабатывает один рабочий поток), поэтому
+    диапазон ищется бинарным поиском. Корзины без сообщений не создаются.
+    """
+
+    __slots__ = ("width", "capacity", "_starts", "_values", "_count", "dirty")
+
+    def __init__(self, width, capacity, persisted=False):
+        self.width = width
+        self.capacity = capacity
+        self._starts = array("q")
+        self._values = array("d")
+        self._count = 0
+        # Начала корзин, измененных после последней записи в базу
+        # (только для разрешений, которые сохраняются)
+        self.dirty = set() if persisted else None
+
+    def _first_seq(self):
+        return max(0, self._count - self.capacity)
+
+    def _find(self, start):
+        """Смещение корзины с началом start или None (поиск с конца)."""
+        for seq in range(self._count - 1, self._first_seq() - 1, -1):
+            i = seq % self.capacity
+            if self._starts[i] == start:
+                return i * _WIDTH
+            if self._starts[i] < start:
+                break
+        return None
+
+    def bucket(self, ts):
+        """Смещение полей корзины для времени ts (при необходимости создается новая).
+
+        None, если корзина старше последней и уже вытеснена или пропущена.
+        """
+        start = int(ts // self.width) * self.width
+        if self._count and start <= self._starts[(self._count - 1) % self.capacity]:
+            offset = self._find(start)
+        else:
+            offset = self._append(start)
+        if offset is not None and self.dirty is not None:
+            self.dirty.add(start)
+        return offset
+
+    def _append(self, start, values=_EMPTY):
+        i = self._count % self.capacity
+        if self._count < self.capacity:
+            self._starts.append(start)
+            self._values.extend(values)
+        else:
+            if self.dirty is not None:
+                self.dirty.discard(self._starts[i])
+            self._starts[i] = start
+            self._values[i * _WIDTH:(i + 1) * _WIDTH] = values
+        self._count += 1
+        return i * _WIDTH
+
+    def restore(self, start, values):
+        """Добавление сохраненной корзины (корзины восстанавливаются по возрастанию)."""
+        if self._count and start <= self._starts[(self._count - 1) % self.capacity]:
+            return
+        self._append(start, array("d", [empty if value is None else value
+                                        for value, empty in zip(values, _EMPTY)]))
+
+    def values(self, start):
+        """Значения полей корзины (None вместо незаданных минимума и максимума)."""
+        offset = self._find(start)
+        if offset is None:
+            return None
+        return [None if math.isinf(value) else value
+                for value in self._values[offset:offset + _WIDTH]]
+
+    def _bisect(self, ts):
+        """Первый seq, у которого начало корзины >= ts."""
+        lo, hi = self._first_seq(), self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._starts[mid % self.capacity] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def query(self, since=None, until=None):
+        """Корзины, начало которых попадает в [since, until)."""
+        start = self._first_seq() if since is None else self._bisect(int(since // self.width) * self.width)
+        end = self._count if until is None else self._bisect(until)
+        buckets = []
+        for seq in range(start, end):
+            i = seq % self.capacity
+            buckets.append(format_bucket(self._starts[i], self._values[i * _WIDTH:(i + 1) * _WIDTH]))
+        return buckets
+
+
+class DeviceRollups:
+    """Агрегаты показателей устройства по минутам, часам и суткам.
+
+    Обновляются по мере прихода сообщений state/info и denomination/info,
+    поэтому запрос за месяц читает несколько сотен корзин вместо сообщений.
+    """
+
+    __slots__ = ("_lock", "_series", "_last_liters")
+
+    def __init__(self, resolutions=DEFAULT_RESOLUTIONS):
+        self._lock = threading.Lock()
+        self._series = {
+            name: RollupSeries(width, capacity, name in PERSISTED_RESOLUTIONS)
+            for name, width, capacity in resolutions
+        }
+        self._last_liters = None
+
+    def add_state(self, state, received_at):
+        """Учет сообщения server/state/info."""
+        errors = state.get("errors")
+        has_errors = isinstance(errors, dict) and any(value is True for value in errors.values())
+        blocked = state.get("operatingMode") == "BLOCK"
+        liters = _number(state.get("litersInTank"))
+        with self._lock:
+            dispensed = 0
+            if liters is not None:
+                if self._last_liters is not None and liters < self._last_liters:
+                    dispensed = self._last_liters - liters
+                self._last_liters = liters
+            for series in self._series.values():
+                offset = series.bucket(received_at)
+                if offset is None:
+                    continue
+                values = series._values
+                values[offset + _SAMPLES] += 1
+                values[offset + _ERROR_SAMPLES] += has_errors
+                values[offset + _BLOCKED_SAMPLES] += blocked
+                if liters is not None:
+                    values[offset + _LITERS_MIN] = min(values[offset + _LITERS_MIN], liters)
+                    values[offset + _LITERS_MAX] = max(values[offset + _LITERS_MAX], liters)
+                    values[offset + _LITERS_DISPENSED] += dispensed
+
+    def add_payment(self, denomination, received_at):
+        """Учет сообщения server/denomination/info."""
+        coin = _amount(denomination.get("coin"))
+        bill = _amount(denomination.get("bill"))
+        with self._lock:
+            for series in self._series.values():
+                offset = series.bucket(received_at)
+                if offset is None:
+                    continue
+                values = series._values
+                values[offset + _PAYMENTS] += 1
+                values[offset + _COINS] += coin
+                values[offset + _BILLS] += bill
+
+    def resolutions(self):
+        """{название: (ширина корзины, число корзин)}."""
+        return {name: (series.width, series.capacity) for name, series in self._series.items()}
+
+    def query(self, resolution, since=None, until=None):
+        """Корзины разрешения resolution в диапазоне [since, until) или None."""
+        series = self._series.get(resolution)
+        if series is None:
+            return None
+        with self._lock:
+            return series.query(since, until)
+
+    def drain_dirty(self):
+        """Измененные корзины для записи в базу: [(разрешение, начало, значения)]."""
+        rows = []
+        with self._lock:
+            for name, series in self._series.items():
+                if not series.dirty:
+                    continue
+                for start in sorted(series.dirty):
+                    values = series.values(start)
+                    if values is not None:
+                        rows.append((name, start, values))
+                series.dirty.clear()
+        return rows
+
+    def restore(self, resolution, start, values):
+        """Восстановление сохраненной корзины."""
+        series = self._series.get(resolution)
+        if series is None or len(values) != _WIDTH:
+            return
+        with self._lock:
+            series.restore(start, values)
@@ -0,0 +1,51 @@
+TOPIC_PREFIX = "wsm"
+
+
+def parse_topic(topic):
+    """Разбор топика wsm/{device_id}/{route} -> (device_id, route).
+
+    route - остаток топика после идентификатора устройства,
+    например "server/state/info". Для чужих топиков возвращает None.
+    """
+    parts = topic.split("/", 2)
+    if len(parts) < 3 or parts[0] != TOPIC_PREFIX or not parts[1]:
+        return None
+    return parts[1], parts[2]
+
+
+class TopicRouter:
+    """Таблица обработчиков MQTT-сообщений по маршруту топика.
+
+    Обработчик вызывается как handler(device_id, payload, received_at).
+    Поиск обработчика - одна операция со словарем, новые маршруты
+    добавляются через register() или декоратор route().
+    """
+
+    def __init__(self):
+        self._handlers = {}
+
+    def register(self, route, handler):
+        if route in self._handlers:
+            raise ValueError(f"Handler for '{route}' is already registered")
+        self._handlers[route] = handler
+
+    def route(self, route):
+        """Декоратор регистрации обработчика."""
+        def decorator(handler):
+            self.register(route, handler)
+            return handler
+        return decorator
+
+    def get(self, route):
+        return self._handlers.get(route)
+
+    def routes(self):
+        return list(self._handlers)
+
+    def dispatch(self, device_id, route, payload, received_at):
+        """Вызов обработчика маршрута. Возвращает False, если маршрут неизвестен."""
+        handler = self._handlers.get(route)
+        if handler is None:
+            return False
+        handler(device_id, payload, received_at)
+        return True
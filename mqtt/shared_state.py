@@ -0,0 +1,298 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Общее хранилище для запуска в несколько процессов.
+#
+# messages - журнал сырых MQTT-сообщений, который пишет процесс приема
+#            и читают веб-воркеры (старые записи удаляются по времени);
+# latest   - последнее сообщение по каждому топику, поэтому новый воркер
+#            восстанавливает состояние устройств и после очистки журнала;
+# outbox   - команды веб-воркеров, которые процесс приема публикует в брокер.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    topic TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    received_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_messages_received_at ON messages (received_at);
+CREATE TABLE IF NOT EXISTS latest (
+    topic TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    payload BLOB NOT NULL,
+    received_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    topic TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    qos INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+# Сколько строк читать из журнала за один запрос
+READ_BATCH = 1000
+
+# Как часто удалять устаревшие записи журнала (в секундах)
+TRIM_INTERVAL = 60
+
+
+def connect(path):
+    """Подключение к общему хранилищу в режиме WAL.
+
+    WAL позволяет нескольким процессам читать базу одновременно с записью.
+    """
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+class SharedLogWriter:
+    """Запись входящих сообщений в общий журнал (процесс приема).
+
+    Как и TelemetryWriter, сообщения пишутся пачками из отдельного потока,
+    чтобы сетевой поток paho не ждал диска.
+    """
+
+    def __init__(self, path, batch_size=500, flush_interval=0.05, queue_size=10000, retention=3600):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention = retention
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._trimmed_at = 0
+        self.dropped = 0
+        self.written = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="shared-log-writer", daemon=True)
+        self._thread.start()
+
+    def append(self, topic, payload, received_at):
+        """Постановка сообщения в очередь записи (не блокирует вызывающий поток)."""
+        try:
+            self._queue.put_nowait((topic, payload, received_at))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        conn = connect(self.path)
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            try:
+                self._write(conn, batch)
+                self.written += len(batch)
+                self._trim(conn)
+            except Exception:
+                logger.exception("❌ Failed to write %d messages to shared log", len(batch))
+
+    def _write(self, conn, batch):
+        """Запись пачки в журнал и обновление последних значений одной транзакцией."""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            last_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM messages").fetchone()[0]
+            conn.executemany(
+                "INSERT INTO messages (topic, payload, received_at) VALUES (?, ?, ?)",
+                [(topic, bytes(payload), received_at) for topic, payload, received_at in batch]
+            )
+            # Для MAX(seq) SQLite возвращает остальные столбцы из той же строки
+            conn.execute(
+                "INSERT OR REPLACE INTO latest (topic, seq, payload, received_at) "
+                "SELECT topic, MAX(seq), payload, received_at FROM messages "
+                "WHERE seq > ? GROUP BY topic",
+                (last_seq,)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _trim(self, conn):
+        now = time.time()
+        if now - self._trimmed_at < TRIM_INTERVAL:
+            return
+        self._trimmed_at = now
+        conn.execute("DELETE FROM messages WHERE received_at < ?", (now - self.retention,))
+
+
+class SharedLogFollower:
+    """Чтение общего журнала веб-воркером.
+
+    При запуске воспроизводит последние значения всех топиков и журнал,
+    затем опрашивает новые записи и передает их в обработчик сообщений
+    в том же порядке, в котором они были приняты.
+    """
+
+    def __init__(self, path, handler, poll_interval=0.1):
+        self.path = path
+        self.handler = handler
+        self.poll_interval = poll_interval
+        self.last_seq = 0
+        self._thread = None
+
+    def resume(self):
+        """Переход к чтению только журнала, когда состояние восстановлено из базы.
+
+        Последние значения топиков не воспроизводятся: снимки устройств берутся
+        из базы, а повторное воспроизведение вытесненных из журнала платежей
+        учло бы их дважды. Возвращает время получения первого сообщения журнала:
+        все, что принято раньше, нужно восстановить из базы.
+        """
+        conn = connect(self.path)
+        try:
+            row = conn.execute("SELECT seq, received_at FROM messages ORDER BY seq LIMIT 1").fetchone()
+            if row is None:
+                last_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM latest").fetchone()[0]
+                self.last_seq = last_seq
+                return time.time()
+            self.last_seq = row[0] - 1
+            return row[1]
+        finally:
+            conn.close()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="shared-log-follower", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        conn = connect(self.path)
+        if not self.last_seq:
+            self._replay(conn)
+        while True:
+            try:
+                if not self._poll(conn):
+                    time.sleep(self.poll_interval)
+            except Exception:
+                logger.exception("❌ Failed to read shared log")
+                time.sleep(self.poll_interval)
+
+    def _replay(self, conn):
+        """Восстановление состояния: последние значения, вытесненные из журнала, и весь журнал."""
+        first_seq = conn.execute("SELECT MIN(seq) FROM messages").fetchone()[0]
+        if first_seq is None:
+            first_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM latest").fetchone()[0]
+        rows = conn.execute(
+            "SELECT seq, topic, payload, received_at FROM latest WHERE seq > ? AND seq < ? "
+            "UNION ALL SELECT seq, topic, payload, received_at FROM messages WHERE seq > ? "
+            "ORDER BY seq",
+            (self.last_seq, first_seq, self.last_seq)
+        ).fetchall()
+        self._apply(rows)
+        logger.info("💾 Replayed %d messages from shared state", len(rows))
+
+    def _poll(self, conn):
+        """Обработка новых записей журнала. Возвращает True, если записи были."""
+        rows = conn.execute(
+            "SELECT seq, topic, payload, received_at FROM messages WHERE seq > ? ORDER BY seq LIMIT ?",
+            (self.last_seq, READ_BATCH)
+        ).fetchall()
+        if rows and rows[0][0] > self.last_seq + 1:
+            # Воркер отстал дольше срока хранения журнала - часть сообщений уже удалена
+            logger.warning("⚠️ Shared log gap after seq %d, resyncing", self.last_seq)
+            self._replay(conn)
+            return True
+        self._apply(rows)
+        return bool(rows)
+
+    def _apply(self, rows):
+        for seq, topic, payload, received_at in rows:
+            try:
+                self.handler(topic, payload, received_at)
+            except Exception:
+                logger.exception("❌ Error handling message %s", topic)
+            self.last_seq = max(self.last_seq, seq)
+
+
+class OutboxPublisher:
+    """Замена MQTT-клиента в веб-воркере: команды кладутся в общую очередь.
+
+    Повторяет сигнатуру client.publish(), поэтому функции отправки команд
+    не зависят от режима запуска.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect(self.path)
+        return conn
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self._conn().execute(
+            "INSERT INTO outbox (topic, payload, qos, created_at) VALUES (?, ?, ?, ?)",
+            (topic, payload, qos, time.time())
+        )
+
+
+class OutboxRelay:
+    """Публикация команд веб-воркеров в брокер (процесс приема)."""
+
+    def __init__(self, path, publish, poll_interval=0.1, max_age=300):
+        self.path = path
+        self.publish = publish
+        self.poll_interval = poll_interval
+        self.max_age = max_age
+        self._thread = None
+        self.relayed = 0
+        self.expired = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="outbox-relay", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        conn = connect(self.path)
+        while True:
+            try:
+                if not self._relay(conn):
+                    time.sleep(self.poll_interval)
+            except Exception:
+                logger.exception("❌ Failed to relay outbox commands")
+                time.sleep(self.poll_interval)
+
+    def _relay(self, conn):
+        rows = conn.execute(
+            "SELECT id, topic, payload, qos, created_at FROM outbox ORDER BY id LIMIT ?",
+            (READ_BATCH,)
+        ).fetchall()
+        if not rows:
+            return False
+
+        deadline = time.time() - self.max_age
+        for _, topic, payload, qos, created_at in rows:
+            # Команды, пролежавшие дольше срока ожидания ответа, уже никому не нужны
+            if created_at < deadline:
+                self.expired += 1
+                continue
+            self.publish(topic, payload, qos=qos)
+            self.relayed += 1
+        conn.execute("DELETE FROM outbox WHERE id <= ?", (rows[-1][0],))
+        return True
@@ -0,0 +1,49 @@
+import itertools
+import os
+from serializer import dumps
+
+# Версии выдаются из общего счетчика, поэтому не повторяются ни между
+# устройствами, ни после удаления и повторного появления устройства.
+# Префикс эпохи отличает ETag разных запусков процесса.
+_versions = itertools.count(1)
+_epoch = os.urandom(4).hex()
+
+
+class SlotSnapshots:
+    """Версии разделов устройства и кэш их JSON-представления.
+
+    Обработчик сообщения сначала записывает новое значение раздела,
+    затем вызывает bump(). Сериализованный ответ кэшируется по версии,
+    поэтому повторные запросы без изменений не требуют повторной сериализации.
+    """
+
+    __slots__ = ("_base", "_slot_versions", "_cache")
+
+    def __init__(self):
+        self._base = next(_versions)
+        self._slot_versions = {}
+        # slot -> (версия, etag, байты JSON)
+        self._cache = {}
+
+    def bump(self, slot):
+        """Отметка об изменении раздела. Возвращает новую версию."""
+        version = next(_versions)
+        self._slot_versions[slot] = version
+        return version
+
+    def version(self, slot):
+        return self._slot_versions.get(slot, self._base)
+
+    def serialized(self, slot, record):
+        """Возвращает (etag, JSON-байты) текущего значения раздела записи."""
+        version = self.version(slot)
+        cached = self._cache.get(slot)
+        if cached is not None and cached[0] == version:
+            return cached[1], cached[2]
+
+        body = dumps(getattr(record, slot))
+        etag = f"{_epoch}-{version}"
+        # Если раздел изменился во время сериализации, не кэшируем результат
+        if self.version(slot) == version:
+            self._cache[slot] = (version, etag, body)
+        return etag, body
@@ -0,0 +1,74 @@
+from collections import deque
+
+_MISSING = object()
+
+# Поля, которые описывают само сообщение (время формирования на устройстве,
+# номер запроса) и меняются в каждом из них; изменением состояния не считаются
+METADATA_FIELDS = ("created", "request_id")
+
+
+def diff_state(old, new):
+    """Изменения полей состояния: (измененные поля {имя: значение}, удаленные поля).
+
+    Сравниваются поля верхнего уровня, кроме METADATA_FIELDS; вложенное
+    значение (например, errors) передается целиком, если оно изменилось.
+    """
+    if old is new:
+        return {}, []
+    changes = {key: value for key, value in new.items()
+               if key not in METADATA_FIELDS and old.get(key, _MISSING) != value}
+    removed = [key for key in old if key not in new and key not in METADATA_FIELDS]
+    return changes, removed
+
+
+def state_metadata(state):
+    """Поля METADATA_FIELDS сообщения, которые хранятся вместе с версией состояния."""
+    return {key: state[key] for key in METADATA_FIELDS if key in state}
+
+
+class StateChangeLog:
+    """Ограниченная история изменений состояния устройства.
+
+    Хранятся только измененные поля и поля METADATA_FIELDS сообщения, которое
+    их изменило, с версией раздела state. base_version -
+    версия, начиная с которой история полна: запрос изменений после более
+    ранней версии требует полного состояния.
+    """
+
+    __slots__ = ("capacity", "base_version", "_entries")
+
+    def __init__(self, capacity, base_version=0):
+        self.capacity = capacity
+        self.base_version = base_version
+        # (версия, время получения, измененные поля, удаленные поля, метаданные)
+        self._entries = deque()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def append(self, version, received_at, changes, removed, metadata=None):
+        if self.capacity <= 0:
+            # История отключена: изменения после любой версии требуют полного состояния
+            self.base_version = version
+            return
+        if len(self._entries) >= self.capacity:
+            self.base_version = self._entries.popleft()[0]
+        self._entries.append((version, received_at, changes, removed, metadata or {}))
+
+    def reset(self, version):
+        """Сброс истории (состояние заменено без вычисления изменений)."""
+        self._entries.clear()
+        self.base_version = version
+
+    def since(self, version, limit):
+        """Изменения с версией больше version или None, если история неполна."""
+        if version < self.base_version:
+            return None
+        items = []
+        for entry in self._entries:
+            if entry[0] <= version:
+                continue
+            items.append(entry)
+            if len(items) >= limit:
+                break
+        return items
@@ -0,0 +1,136 @@
+import threading
+import time
+from datetime import date
+
+# Поля состояния, которые попадают в сводку по парку
+STATE_FIELDS = ("operatingMode", "summaInBox", "litersInTank", "created")
+
+# Допустимые поля сортировки сводки
+SORT_FIELDS = ("device_id", "last_seen", "cash_today", "summaInBox", "litersInTank", "operatingMode")
+
+
+class FleetSummary:
+    """Сводка по всем устройствам, обновляемая по мере поступления сообщений.
+
+    Для каждого устройства хранится небольшая запись с последними
+    показателями, поэтому запрос списка не требует обхода полных данных
+    устройств и отдельных запросов по каждому автомату.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        # Увеличивается при каждом изменении сводки
+        self.version = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _entry(self, device_id):
+        entry = self._entries.get(device_id)
+        if entry is None:
+            entry = {
+                "device_id": device_id,
+                "last_seen": None,
+                "online": False,
+                "blocked": False,
+                "errors": [],
+                "cash_today": 0,
+                "cash_day": None,
+            }
+            for field in STATE_FIELDS:
+                entry[field] = None
+            self._entries[device_id] = entry
+        return entry
+
+    def touch(self, device_id, received_at):
+        """Отметка о любом сообщении от устройства."""
+        with self._lock:
+            self._entry(device_id)["last_seen"] = received_at
+            self.version += 1
+
+    def set_online(self, device_id, online):
+        """Переход устройства в сеть или из сети (от LivenessTracker)."""
+        with self._lock:
+            self._entry(device_id)["online"] = online
+            self.version += 1
+
+    def remove(self, device_id):
+        with self._lock:
+            if self._entries.pop(device_id, None) is not None:
+                self.version += 1
+
+    def update_state(self, device_id, state):
+        """Обновление показателей из сообщения server/state/info."""
+        errors = state.get("errors")
+        with self._lock:
+            entry = self._entry(device_id)
+            for field in STATE_FIELDS:
+                entry[field] = state.get(field)
+            entry["blocked"] = state.get("operatingMode") == "BLOCK"
+            entry["errors"] = [name for name, value in errors.items() if value is True] \
+                if isinstance(errors, dict) else []
+            self.version += 1
+
+    def add_cash(self, device_id, denomination, received_at):
+        """Учет принятых денег за текущие сутки."""
+        try:
+            amount = int(denomination.get("coin") or 0) + int(denomination.get("bill") or 0)
+        except (TypeError, ValueError):
+            return
+        day = date.fromtimestamp(received_at)
+        with self._lock:
+            entry = self._entry(device_id)
+            if entry["cash_day"] != day:
+                entry["cash_day"] = day
+                entry["cash_today"] = 0
+            entry["cash_today"] += amount
+            self.version += 1
+
+    def counts(self):
+        """Число устройств в сети, заблокированных и с ошибками."""
+        counts = {"online": 0, "offline": 0, "blocked": 0, "errors": 0}
+        with self._lock:
+            for entry in self._entries.values():
+                if entry["online"]:
+                    counts["online"] += 1
+                else:
+                    counts["offline"] += 1
+                counts["blocked"] += entry["blocked"]
+                counts["errors"] += bool(entry["errors"])
+        return counts
+
+    def query(self, online=None, blocked=None, mode=None, has_errors=None, search=None,
+              sort="device_id", descending=False, page=1, per_page=50):
+        """Выборка сводки с фильтрацией, сортировкой и постраничной выдачей."""
+        now = time.time()
+        today = date.fromtimestamp(now)
+        with self._lock:
+            rows = []
+            for entry in self._entries.values():
+                row = dict(entry)
+                if row.pop("cash_day") != today:
+                    row["cash_today"] = 0
+                rows.append(row)
+
+        if online is not None:
+            rows = [row for row in rows if row["online"] == online]
+        if blocked is not None:
+            rows = [row for row in rows if row["blocked"] == blocked]
+        if mode is not None:
+            rows = [row for row in rows if row["operatingMode"] == mode]
+        if has_errors is not None:
+            rows = [row for row in rows if bool(row["errors"]) == has_errors]
+        if search:
+            rows = [row for row in rows if search in row["device_id"]]
+
+        if sort not in SORT_FIELDS:
+            sort = "device_id"
+        # Устройства без значения поля всегда в конце списка
+        present = [row for row in rows if row[sort] is not None]
+        missing = [row for row in rows if row[sort] is None]
+        present.sort(key=lambda row: row[sort], reverse=descending)
+        rows = present + missing
+
+        start = (page - 1) * per_page
+        return rows[start:start + per_page], len(rows)
@@ -0,0 +1,42 @@
+"""Сериализация JSON для MQTT-сообщений и ответов API.
+
+Если установлен orjson (и JSON_BACKEND не равен "json"), используется он,
+иначе - стандартный модуль json. loads() принимает bytes, dumps() возвращает bytes.
+"""
+import json
+from flask import Response
+from config import Config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Ошибки разбора (orjson.JSONDecodeError и UnicodeDecodeError - подклассы ValueError)
+DecodeError = ValueError
+
+if orjson is not None and Config.JSON_BACKEND != "json":
+    backend = "orjson"
+
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps(obj):
+        return orjson.dumps(obj)
+else:
+    backend = "json"
+
+    def loads(data):
+        # Стандартный json разбирает bytes медленнее, чем строку: перед разбором
+        # он определяет кодировку (см. benchmarks/bench_json.py)
+        if isinstance(data, (bytes, bytearray)):
+            data = data.decode("utf-8")
+        return json.loads(data)
+
+    def dumps(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def jsonify(obj):
+    """Замена flask.jsonify на выбранной реализации JSON."""
+    return Response(dumps(obj), mimetype="application/json")
@@ -76,16 +76,18 @@ document.addEventListener('DOMContentLoaded', function() {
         hideError();
         
         showMessage('Запрос настроек отправлен...');
+        const sentAt = Date.now();
         
         fetch(`/api/devices/${deviceId}/settings/request`)
             .then(response => response.json())
             .then(data => {
                 showMessage('Запрос настроек отправлен. Ожидание ответа (5 сек)...');
                 
-                // Ждем 5 секунд и пытаемся получить настройки один раз
-                setTimeout(() => {
-                    getDeviceSettings();
-                }, 5000);
+                // Ждем ответ из потока событий, без потока - опрашиваем через 5 секунд
+                waitForEvent('settings', sentAt, settings => {
+                    fillSettingsForm(settings);
+                    showMessage('Настройки успешно получены');
+                }, getDeviceSettings, 5000);
             })
             .catch(error => {
                 console.error('Error:', error);
@@ -159,6 +161,7 @@ document.addEventListener('DOMContentLoaded', function() {
             spillAmount: parseInt(document.getElementById('spillAmount').value) || 0
         };
         
+        const sentAt = Date.now();
         fetch(`/api/devices/${deviceId}/settings`, {
             method: 'PUT',
             headers: {
@@ -175,7 +178,7 @@ document.addEventListener('DOMContentLoaded', function() {
         .then(data => {
             showMessage('Настройки отправлены в устройство, ожидание подтверждения...');
             // Начинаем проверять ACK
-            setTimeout(checkSettingsAck, 1000);
+            waitForAck('setting_ack', sentAt, checkSettingsAck, '✅ Устройство подтвердило получение настроек');
         })
         .catch(error => {
             console.error('Error:', error);
@@ -192,16 +195,18 @@ document.addEventListener('DOMContentLoaded', function() {
         hideError();
         
         showMessage('Запрос конфигурации отправлен...');
+        const sentAt = Date.now();
         
         fetch(`/api/devices/${deviceId}/config/request`)
             .then(response => response.json())
             .then(data => {
                 showMessage('Запрос конфигурации отправлен. Ожидание ответа (5 сек)...');
                 
-                // Ждем 5 секунд и пытаемся получить конфигурацию один раз
-                setTimeout(() => {
-                    getDeviceConfig();
-                }, 5000);
+                // Ждем ответ из потока событий, без потока - опрашиваем через 5 секунд
+                waitForEvent('config', sentAt, config => {
+                    fillConfigForm(config);
+                    showMessage('Конфигурация успешно получена');
+                }, getDeviceConfig, 5000);
             })
             .catch(error => {
                 console.error('Error:', error);
@@ -300,6 +305,7 @@ document.addEventListener('DOMContentLoaded', function() {
             formData.coin_table = [];
         }
         
+        const sentAt = Date.now();
         fetch(`/api/devices/${deviceId}/config`, {
             method: 'PUT',
             headers: {
@@ -316,7 +322,7 @@ document.addEventListener('DOMContentLoaded', function() {
         .then(data => {
             showMessage('Конфигурация отправлена в устройство, ожидание подтверждения...');
             // Начинаем проверять ACK
-            setTimeout(checkConfigAck, 1000);
+            waitForAck('config_ack', sentAt, checkConfigAck, '✅ Устройство подтвердило получение конфигурации');
         })
         .catch(error => {
             console.error('Error:', error);
@@ -340,12 +346,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 return response.json();
             })
             .then(data => {
-                if (data && data.code === 0) {
-                    showMessage('✅ Устройство подтвердило получение настроек');
-                } else {
-                    const errorMessage = getErrorDescription(data.code);
-                    showError(`⚠️ Устройство вернуло ошибку: ${errorMessage} (код ${data.code})`);
-                }
+                handleAck(data, '✅ Устройство подтвердило получение настроек');
             })
             .catch(error => {
                 console.error('Error:', error);
@@ -371,12 +372,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 return response.json();
             })
             .then(data => {
-                if (data && data.code === 0) {
-                    showMessage('✅ Устройство подтвердило получение конфигурации');
-                } else {
-                    const errorMessage = getErrorDescription(data.code);
-                    showError(`⚠️ Устройство вернуло ошибку: ${errorMessage} (код ${data.code})`);
-                }
+                handleAck(data, '✅ Устройство подтвердило получение конфигурации');
             })
             .catch(error => {
                 console.error('Error:', error);
@@ -402,12 +398,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 return response.json();
             })
             .then(data => {
-                if (data && data.code === 0) {
-                    showMessage('✅ Устройство подтвердило получение команды перезагрузки');
-                } else {
-                    const errorMessage = getErrorDescription(data.code);
-                    showError(`⚠️ Устройство вернуло ошибку: ${errorMessage} (код ${data.code})`);
-                }
+                handleAck(data, '✅ Устройство подтвердило получение команды перезагрузки');
             })
             .catch(error => {
                 console.error('Error:', error);
@@ -500,9 +491,134 @@ document.addEventListener('DOMContentLoaded', function() {
             '<span class="badge badge-secondary">Неактивен</span>';
     }
     
-    // Запрос данных о состоянии каждые 5 секунд
-    getDeviceState(); // Первый запрос сразу при загрузке страницы
-    setInterval(getDeviceState, 5000);
+    // Обработка ответа ACK от устройства
+    function handleAck(data, successMessage) {
+        if (!data) {
+            return;
+        }
+        if (data.code === 0) {
+            showMessage(successMessage);
+        } else {
+            const errorMessage = getErrorDescription(data.code);
+            showError(`⚠️ Устройство вернуло ошибку: ${errorMessage} (код ${data.code})`);
+        }
+    }
+    
+    // Поток событий устройства (Server-Sent Events).
+    // Пока поток активен, состояние и ответы устройства приходят без опроса,
+    // при обрыве соединения возвращаемся к периодическим запросам.
+    let eventSource = null;
+    let streamConnected = false;
+    let statePollTimer = null;
+    const pendingEvents = {};
+    const lastEvents = {};
+    
+    function startStatePolling() {
+        if (statePollTimer === null) {
+            getDeviceState();
+            statePollTimer = setInterval(getDeviceState, 5000);
+        }
+    }
+    
+    function stopStatePolling() {
+        if (statePollTimer !== null) {
+            clearInterval(statePollTimer);
+            statePollTimer = null;
+        }
+    }
+    
+    // Ожидание события от устройства: из потока, либо опросом через pollFn
+    function waitForEvent(eventName, since, onEvent, pollFn, timeout) {
+        const last = lastEvents[eventName];
+        if (streamConnected && last && last.receivedAt >= since) {
+            // Ответ пришел раньше, чем завершился HTTP-запрос
+            delete lastEvents[eventName];
+            onEvent(last.data);
+            return;
+        }
+        
+        if (!streamConnected) {
+            setTimeout(pollFn, timeout);
+            return;
+        }
+        
+        const waiter = { onEvent: onEvent, pollFn: pollFn, timer: null };
+        if (timeout !== null) {
+            // Устройство не ответило вовремя - проверяем опросом, чтобы показать ошибку
+            waiter.timer = setTimeout(() => {
+                if (pendingEvents[eventName] === waiter) {
+                    delete pendingEvents[eventName];
+                    pollFn();
+                }
+            }, timeout);
+        }
+        pendingEvents[eventName] = waiter;
+    }
+    
+    // Ожидание ACK от устройства
+    function waitForAck(eventName, since, pollFn, successMessage) {
+        if (!streamConnected) {
+            setTimeout(pollFn, 1000);
+            return;
+        }
+        showMessage('Ожидание подтверждения от устройства...');
+        // Если ACK не пришел из потока за 5 секунд (или поток оборвался), проверяем опросом
+        waitForEvent(eventName, since, data => handleAck(data, successMessage), pollFn, 5000);
+    }
+    
+    function dispatchStreamEvent(eventName, data) {
+        lastEvents[eventName] = { data: data, receivedAt: Date.now() };
+        const waiter = pendingEvents[eventName];
+        if (waiter) {
+            delete pendingEvents[eventName];
+            clearTimeout(waiter.timer);
+            delete lastEvents[eventName];
+            waiter.onEvent(data);
+        }
+    }
+    
+    function connectEventStream() {
+        if (!window.EventSource) {
+            startStatePolling();
+            return;
+        }
+        
+        eventSource = new EventSource(`/api/devices/${deviceId}/events`);
+        
+        eventSource.onopen = function() {
+            streamConnected = true;
+            stopStatePolling();
+            getDeviceState(); // Актуальное состояние на момент подключения
+        };
+        
+        eventSource.onerror = function() {
+            // EventSource переподключается сам, а пока опрашиваем сервер
+            streamConnected = false;
+            startStatePolling();
+            
+            // Переводим ожидающие ответы на опрос
+            Object.keys(pendingEvents).forEach(eventName => {
+                const waiter = pendingEvents[eventName];
+                delete pendingEvents[eventName];
+                clearTimeout(waiter.timer);
+                setTimeout(waiter.pollFn, 1000);
+            });
+        };
+        
+        eventSource.addEventListener('state', event => {
+            updateDeviceStateUI(JSON.parse(event.data).data);
+        });
+        
+        ['settings', 'config', 'display', 'setting_ack', 'config_ack',
+         'reboot_ack', 'payment_ack', 'action_ack'].forEach(eventName => {
+            eventSource.addEventListener(eventName, event => {
+                dispatchStreamEvent(eventName, JSON.parse(event.data).data);
+            });
+        });
+    }
+    
+    // Получение состояния через поток событий (с опросом каждые 5 секунд при обрыве)
+    connectEventStream();
     
     // Обработчики кнопок
     document.getElementById('btn-request-settings').addEventListener('click', requestDeviceSettings);
@@ -513,6 +629,7 @@ document.addEventListener('DOMContentLoaded', function() {
     document.getElementById('btn-reboot').addEventListener('click', function() {
         const delay = prompt('Введите задержку перезагрузки (мс):', '400');
         if (delay !== null) {
+            const sentAt = Date.now();
             fetch(`/api/devices/${deviceId}/reboot`, {
                 method: 'POST',
                 headers: {
@@ -524,7 +641,7 @@ document.addEventListener('DOMContentLoaded', function() {
             .then(data => {
                 showMessage('Команда перезагрузки отправлена, ожидание подтверждения...');
                 // Начинаем проверять ACK перезагрузки
-                setTimeout(checkRebootAck, 1000);
+                waitForAck('reboot_ack', sentAt, checkRebootAck, '✅ Устройство подтвердило получение команды перезагрузки');
             })
             .catch(error => {
                 console.error('Error:', error);
@@ -548,16 +665,15 @@ document.addEventListener('DOMContentLoaded', function() {
     function requestDisplayInfo() {
         document.getElementById('display-info').classList.add('d-none');
         document.getElementById('display-loading').classList.remove('d-none');
+        const sentAt = Date.now();
         
         fetch(`/api/devices/${deviceId}/display/request`)
             .then(response => response.json())
             .then(data => {
                 showMessage('Запрос информации с дисплея отправлен. Ожидание ответа...');
                 
-                // Ждем несколько секунд и пытаемся получить данные
-                setTimeout(() => {
-                    getDisplayInfo();
-                }, 3000);
+                // Ждем ответ из потока событий, без потока - опрашиваем через 3 секунды
+                waitForEvent('display', sentAt, fillDisplayInfo, getDisplayInfo, 3000);
             })
             .catch(error => {
                 console.error('Error:', error);
@@ -580,13 +696,7 @@ document.addEventListener('DOMContentLoaded', function() {
             })
             .then(data => {
                 if (data) {
-                    document.getElementById('display-loading').classList.add('d-none');
-                    document.getElementById('display-info').classList.remove('d-none');
-                    
-                    document.getElementById('display-line-1').textContent = data.line_1 || '-';
-                    document.getElementById('display-line-2').textContent = data.line_2 || '-';
-                    
-                    showMessage('Информация с дисплея успешно получена');
+                    fillDisplayInfo(data);
                 }
             })
             .catch(error => {
@@ -595,6 +705,17 @@ document.addEventListener('DOMContentLoaded', function() {
             });
     }
 
+    // Функция для отображения информации с дисплея
+    function fillDisplayInfo(data) {
+        document.getElementById('display-loading').classList.add('d-none');
+        document.getElementById('display-info').classList.remove('d-none');
+        
+        document.getElementById('display-line-1').textContent = data.line_1 || '-';
+        document.getElementById('display-line-2').textContent = data.line_2 || '-';
+        
+        showMessage('Информация с дисплея успешно получена');
+    }
+
     // Функция для отправки QR-code платежа
     function sendQRCodePayment() {
         const orderId = document.getElementById('qrcode-order-id').value || `order_${Date.now()}`;
@@ -605,6 +726,7 @@ document.addEventListener('DOMContentLoaded', function() {
             return;
         }
         
+        const sentAt = Date.now();
         fetch(`/api/devices/${deviceId}/payment/qrcode`, {
             method: 'POST',
             headers: {
@@ -619,7 +741,7 @@ document.addEventListener('DOMContentLoaded', function() {
         .then(data => {
             showMessage(`QR-code платеж отправлен: ${amount} коп., ID заказа: ${orderId}`);
             // Начинаем проверять ACK платежа
-            setTimeout(checkPaymentAck, 1000);
+            waitForAck('payment_ack', sentAt, checkPaymentAck, '✅ Устройство подтвердило получение платежа');
         })
         .catch(error => {
             console.error('Error:', error);
@@ -636,6 +758,7 @@ document.addEventListener('DOMContentLoaded', function() {
             return;
         }
         
+        const sentAt = Date.now();
         fetch(`/api/devices/${deviceId}/payment/free`, {
             method: 'POST',
             headers: {
@@ -649,7 +772,7 @@ document.addEventListener('DOMContentLoaded', function() {
         .then(data => {
             showMessage(`Свободное начисление отправлено: ${amount} коп.`);
             // Начинаем проверять ACK платежа
-            setTimeout(checkPaymentAck, 1000);
+            waitForAck('payment_ack', sentAt, checkPaymentAck, '✅ Устройство подтвердило получение платежа');
         })
         .catch(error => {
             console.error('Error:', error);
@@ -668,6 +791,7 @@ document.addEventListener('DOMContentLoaded', function() {
             PayPassClear: document.getElementById('clear-paypass').checked
         };
         
+        const sentAt = Date.now();
         fetch(`/api/devices/${deviceId}/payment/clear`, {
             method: 'POST',
             headers: {
@@ -679,7 +803,7 @@ document.addEventListener('DOMContentLoaded', function() {
         .then(data => {
             showMessage('Команда обнуления платежей отправлена');
             // Начинаем проверять ACK платежа
-            setTimeout(checkPaymentAck, 1000);
+            waitForAck('payment_ack', sentAt, checkPaymentAck, '✅ Устройство подтвердило получение платежа');
         })
         .catch(error => {
             console.error('Error:', error);
@@ -699,6 +823,7 @@ document.addEventListener('DOMContentLoaded', function() {
             actionData.blocking = blocking;
         }
         
+        const sentAt = Date.now();
         fetch(`/api/devices/${deviceId}/action`, {
             method: 'POST',
             headers: {
@@ -723,7 +848,7 @@ document.addEventListener('DOMContentLoaded', function() {
             
             showMessage(actionMessage);
             // Начинаем проверять ACK действия
-            setTimeout(checkActionAck, 1000);
+            waitForAck('action_ack', sentAt, checkActionAck, '✅ Устройство подтвердило получение команды');
         })
         .catch(error => {
             console.error('Error:', error);
@@ -747,12 +872,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 return response.json();
             })
             .then(data => {
-                if (data && data.code === 0) {
-                    showMessage('✅ Устройство подтвердило получение команды');
-                } else {
-                    const errorMessage = getErrorDescription(data.code);
-                    showError(`⚠️ Устройство вернуло ошибку: ${errorMessage} (код ${data.code})`);
-                }
+                handleAck(data, '✅ Устройство подтвердило получение команды');
             })
             .catch(error => {
                 console.error('Error:', error);
@@ -778,12 +898,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 return response.json();
             })
             .then(data => {
-                if (data && data.code === 0) {
-                    showMessage('✅ Устройство подтвердило получение платежа');
-                } else {
-                    const errorMessage = getErrorDescription(data.code);
-                    showError(`⚠️ Устройство вернуло ошибку: ${errorMessage} (код ${data.code})`);
-                }
+                handleAck(data, '✅ Устройство подтвердило получение платежа');
             })
             .catch(error => {
                 console.error('Error:', error);